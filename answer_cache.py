@@ -0,0 +1,152 @@
+import os
+import re
+import zlib
+import threading
+
+import numpy as np
+
+from search_cache import normalize_text
+from medical_index import tokenize
+
+ANSWER_CACHE = os.getenv("ANSWER_CACHE", "false").lower() == "true"
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "5000"))  # per language
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.92"))
+VECTOR_DIMENSIONS = 2 ** 10
+# Bigrams keep some word order ("no fever" vs "fever") without making symptom order matter much
+BIGRAM_WEIGHT = 0.35
+
+_CHUNK = re.compile(r"\S+\s*")
+
+
+def embed(text, dimensions=VECTOR_DIMENSIONS):
+    """
+        Local hashing vectorizer: word unigrams and (down weighted) bigrams hashed (crc32, stable across
+        processes) into a signed, L2 normalized float32 vector. No network, no model.
+    """
+    words = tokenize(normalize_text(text))
+    features = [(word, 1.0) for word in words] + [(f"{a} {b}", BIGRAM_WEIGHT) for a, b in zip(words, words[1:])]
+    vector = np.zeros(dimensions, dtype=np.float32)
+    for feature, weight in features:
+        digest = zlib.crc32(feature.encode("utf-8"))
+        vector[digest % dimensions] += weight if digest & 0x80000000 else -weight
+    length = np.linalg.norm(vector)
+    return vector / length if length else vector
+
+
+class _Partition:
+    """ One language: a (rows x dimensions) matrix grown by doubling up to capacity, plus answers. """
+
+    def __init__(self, capacity, dimensions, initial_rows=256):
+        self.capacity = capacity
+        rows = min(initial_rows, capacity)
+        self.matrix = np.zeros((rows, dimensions), dtype=np.float32)
+        self.last_used = np.zeros(rows, dtype=np.int64)
+        self.answers = []
+        self.size = 0
+
+    def next_row(self):
+        """ Row for a new entry, None once full (caller evicts). """
+        if self.size == self.capacity:
+            return None
+        if self.size == len(self.matrix):
+            rows = min(len(self.matrix) * 2, self.capacity)
+            self.matrix = np.resize(self.matrix, (rows, self.matrix.shape[1]))
+            self.last_used = np.resize(self.last_used, rows)
+        self.answers.append(None)
+        self.size += 1
+        return self.size - 1
+
+
+class AnswerCache:
+    """
+        Semantic cache of first turn answers, partitioned by language.
+
+        A question is embedded locally and compared with every stored question through one
+        matrix-vector product (cosine similarity, vectors are normalized). Above `threshold`
+        the stored answer is served instead of a tool round trip plus a generation.
+    """
+
+    def __init__(self, capacity=ANSWER_CACHE_SIZE, threshold=ANSWER_CACHE_THRESHOLD, dimensions=VECTOR_DIMENSIONS):
+        self.capacity = capacity
+        self.threshold = threshold
+        self.dimensions = dimensions
+        self.partitions = {}
+        self.lock = threading.Lock()
+        self.clock = 0
+        self.hits = 0
+        self.misses = 0
+        self.rejected = 0  # misses where a stored question was closest but below the threshold
+        self.rejected_scores = 0.0
+        self.stores = 0
+        self.evictions = 0
+
+    def _partition(self, lang):
+        if lang not in self.partitions:
+            self.partitions[lang] = _Partition(self.capacity, self.dimensions)
+        return self.partitions[lang]
+
+    def get(self, lang, question):
+        """ Cached answer for a similar enough question, or None. """
+        vector = embed(question, self.dimensions)
+        with self.lock:
+            partition = self.partitions.get(lang)
+            if partition is None or not partition.size or not vector.any():
+                self.misses += 1
+                return None
+
+            scores = partition.matrix[:partition.size] @ vector
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                self.misses += 1
+                self.rejected += 1
+                self.rejected_scores += float(scores[best])
+                return None
+
+            self.clock += 1
+            partition.last_used[best] = self.clock
+            self.hits += 1
+            return partition.answers[best]
+
+    def set(self, lang, question, answer):
+        vector = embed(question, self.dimensions)
+        if not vector.any() or not answer:
+            return
+        with self.lock:
+            partition = self._partition(lang)
+            row = partition.next_row()
+            if row is None:
+                row = int(np.argmin(partition.last_used))
+                self.evictions += 1
+
+            self.clock += 1
+            partition.matrix[row] = vector
+            partition.answers[row] = answer
+            partition.last_used[row] = self.clock
+            self.stores += 1
+
+    def stats(self):
+        """ Hit / miss / reject rates; a high reject rate close to the threshold suggests lowering it. """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": {lang: partition.size for lang, partition in self.partitions.items()},
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "rejected": self.rejected,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "miss_rate": self.misses / lookups if lookups else 0.0,
+                "reject_rate": self.rejected / lookups if lookups else 0.0,
+                "avg_rejected_score": self.rejected_scores / self.rejected if self.rejected else None,
+                "stores": self.stores,
+                "evictions": self.evictions,
+            }
+
+
+def stream_text(text):
+    """ Replay a cached answer as word sized chunks, like a model stream. """
+    for match in _CHUNK.finditer(text):
+        yield match.group(0)
+
+
+ANSWER_CACHE_STORE = AnswerCache()
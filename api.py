@@ -0,0 +1,365 @@
+"""
+    Headless streaming HTTP API for the bot (ASGI, Starlette), for clients other than the
+    Streamlit app and for running several workers behind a load balancer.
+
+        POST   /sessions                   {"lang": "en", "user_location": {...}} -> {"session_id": ...}
+        POST   /sessions/{id}/messages     {"message": "..."} -> text/event-stream
+        DELETE /sessions/{id}
+        GET    /health
+        GET    /stats                      includes the LLM scheduler queue (scheduler.py)
+        GET    /metrics                    Prometheus text (see tracing.py)
+
+    Answers stream as Server-Sent Events: one `data: {"token": "..."}` event per chunk, then
+    `event: done` (or `event: error`). Closing the connection cancels the turn upstream.
+
+        python api.py --port 8000            # or: uvicorn api:app --port 8000
+        python api.py --port 8000 --stub     # offline stub OpenAI / Tavily, for load tests
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import asyncio
+import signal
+import argparse
+import threading
+import contextlib
+from contextlib import aclosing
+
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.routing import Route
+
+from answer_cache import ANSWER_CACHE_STORE
+from bot import AsyncTeleMedicBot, PROMPT_CACHE_STATS
+from clients import aclose_clients
+from hedging import hedge_stats, DeadlineExceeded
+from intent_router import INTENT_ROUTER
+from prefetch import CLINIC_PREFETCHER
+from scheduler import SCHEDULER, AdmissionRejected
+from search_cache import SEARCH_CACHE
+from session_store import open_store, SessionConflict
+from singleflight import flight_stats
+from stubs import AsyncStubOpenAI, AsyncStubTavily
+from tracing import TRACER
+
+API_STUB = os.getenv("API_STUB", "false").lower() == "true"
+API_MAX_TURNS = int(os.getenv("API_MAX_TURNS", "64"))  # concurrent streaming answers per worker
+API_MAX_SESSIONS = int(os.getenv("API_MAX_SESSIONS", "10000"))
+API_SESSION_TTL = float(os.getenv("API_SESSION_TTL", "3600"))  # idle sessions are dropped after this long
+API_MAX_MESSAGE_CHARS = int(os.getenv("API_MAX_MESSAGE_CHARS", "4000"))
+API_SHUTDOWN_GRACE = float(os.getenv("API_SHUTDOWN_GRACE", "30"))
+# Seconds between SIGTERM / SIGINT and uvicorn closing its listener, for the load balancer to see /health fail
+API_DRAIN_DELAY = float(os.getenv("API_DRAIN_DELAY", "0"))
+
+
+class StubTeleMedicBot(AsyncTeleMedicBot):
+    """ AsyncTeleMedicBot on the offline stub clients. """
+
+    def create_clients(self):
+        return AsyncStubOpenAI(), AsyncStubTavily()
+
+
+class Session:
+    def __init__(self, bot):
+        self.bot = bot
+        self.lock = asyncio.Lock()  # one turn at a time per conversation
+        self.last_used = time.monotonic()
+
+    async def try_lock(self):
+        """ Take the session lock, or False right away when a turn holds it. """
+        if self.lock.locked():
+            return False
+        await self.lock.acquire()  # a free lock is taken without suspending, nothing can get in between
+        return True
+
+
+class State:
+    def __init__(self):
+        self.sessions = {}
+        self.turns = asyncio.Semaphore(API_MAX_TURNS)
+        self.active_turns = 0
+        self.served_turns = 0
+        self.rejected_turns = 0
+        self.draining = False
+
+    def session(self, session_id):
+        """ Live session, rebuilt from the session store when another worker (or a restart) created it. """
+        session = self.sessions.get(session_id)
+        if session is None and SESSION_STORE is not None:
+            bot = bot_class().from_session(SESSION_STORE, session_id)
+            if bot is not None:
+                session = self.sessions[session_id] = Session(bot)
+        return session
+
+    def refresh(self, session_id, session):
+        """ Reload the bot when another worker stored turns since this copy was loaded (its seqs are stale). """
+        if SESSION_STORE is None or session.bot.next_seq == SESSION_STORE.next_seq(session_id):
+            return
+        bot = bot_class().from_session(SESSION_STORE, session_id)
+        if bot is not None:
+            print(f"[API] Session {session_id} changed on another worker, reloaded" , flush=True)
+            session.bot = bot
+
+    async def take_turn(self):
+        """ One of the API_MAX_TURNS permits, or False right away when none is free. """
+        if self.turns.locked():
+            return False
+        await self.turns.acquire()  # a free permit is taken without suspending, nothing can get in between
+        return True
+
+    def expire_sessions(self):
+        now = time.monotonic()
+        for session_id, session in list(self.sessions.items()):
+            if now - session.last_used > API_SESSION_TTL and not session.lock.locked():
+                del self.sessions[session_id]
+
+
+STATE = State()
+SESSION_STORE = open_store()
+
+
+def bot_class():
+    return StubTeleMedicBot if API_STUB else AsyncTeleMedicBot
+
+
+def error(status, message, **headers):
+    return JSONResponse({"error": message}, status_code=status, headers=headers or None)
+
+
+def sse(data, event=None):
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def read_json(request):
+    try:
+        body = await request.json()
+    except ValueError:
+        return None
+    return body if isinstance(body, dict) else None
+
+
+async def create_session(request):
+    if STATE.draining:
+        return error(503, "Server is shutting down.", **{"Retry-After": "1"})
+    body = await read_json(request)
+    if body is None:
+        return error(400, "Expected a JSON object.")
+
+    STATE.expire_sessions()
+    if len(STATE.sessions) >= API_MAX_SESSIONS:
+        return error(503, "Too many sessions.", **{"Retry-After": "5"})
+
+    lang = "es" if body.get("lang") == "es" else "en"
+    bot = bot_class()(lang=lang, user_location=body.get("user_location") or {})
+    session_id = uuid.uuid4().hex
+    if SESSION_STORE is not None:
+        bot.attach_session(SESSION_STORE, session_id)
+    STATE.sessions[session_id] = Session(bot)
+    return JSONResponse({"session_id": session_id, "lang": lang}, status_code=201)
+
+
+async def delete_session(request):
+    session_id = request.path_params["session_id"]
+    known = STATE.sessions.pop(session_id, None) is not None
+    if SESSION_STORE is not None:
+        known = SESSION_STORE.delete(session_id) or known
+    if not known:
+        return error(404, "Unknown session.")
+    return JSONResponse({"deleted": True})
+
+
+async def post_message(request):
+    session_id = request.path_params["session_id"]
+    session = STATE.session(session_id)
+    if session is None:
+        return error(404, "Unknown session.")
+    if STATE.draining:
+        return error(503, "Server is shutting down.", **{"Retry-After": "1"})
+
+    body = await read_json(request)
+    message = str((body or {}).get("message") or "").strip()
+    if not message:
+        return error(400, "Expected {\"message\": \"...\"}.")
+    if len(message) > API_MAX_MESSAGE_CHARS:
+        return error(413, f"Message longer than {API_MAX_MESSAGE_CHARS} characters.")
+    if not await session.try_lock():
+        return error(409, "A turn is already streaming for this session.")
+    if not await STATE.take_turn():
+        session.lock.release()
+        STATE.rejected_turns += 1
+        return error(503, "Too many concurrent turns.", **{"Retry-After": "1"})
+
+    return TurnResponse(
+        session, stream_turn(session_id, session, message), media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+class TurnResponse(StreamingResponse):
+    """
+        Streamed turn that gives its turn permit and its session lock back however it ends, even if
+        the body never started.
+    """
+
+    def __init__(self, session, content, **kwargs):
+        super().__init__(content, **kwargs)
+        self.session = session
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.session.lock.release()
+            STATE.turns.release()
+
+
+async def stream_turn(session_id, session, message):
+    """
+        SSE events for one turn. Starlette cancels this on disconnect, which closes the upstream stream.
+        Runs under the session lock, taken by post_message and given back by TurnResponse.
+    """
+    STATE.active_turns += 1
+    session.last_used = time.monotonic()
+    started = time.perf_counter()
+    chunks = 0
+    try:
+        STATE.refresh(session_id, session)
+        async with aclosing(session.bot.chat(message)) as tokens:
+            async for token in tokens:
+                chunks += 1
+                yield sse({"token": token})
+        yield sse({"chunks": chunks, "seconds": round(time.perf_counter() - started, 3)}, event="done")
+        STATE.served_turns += 1
+    except asyncio.CancelledError:
+        print(f"[API] Client disconnected after {chunks} chunks" , flush=True)
+        raise
+    except AdmissionRejected as e:
+        STATE.rejected_turns += 1
+        print(f"[API] Turn rejected by the LLM scheduler => {e}" , flush=True)
+        yield sse({"error": "The service is busy, please retry.", "retry_after": e.retry_after}, event="error")
+    except DeadlineExceeded as e:
+        print(f"[API] Turn missed its deadline => {e}" , flush=True)
+        yield sse({"error": "The model is slow to answer, please retry.", "retry_after": 1}, event="error")
+    except SessionConflict as e:
+        # Lost a race with another worker: drop this copy, the retry reloads it from the store
+        STATE.sessions.pop(session_id, None)
+        print(f"[API] {e}" , flush=True)
+        yield sse({"error": "The conversation changed elsewhere, please retry.", "retry_after": 0}, event="error")
+    except Exception as e:
+        print(f"[API] Turn failed => {e}" , flush=True)
+        yield sse({"error": "The answer could not be generated."}, event="error")
+    finally:
+        STATE.active_turns -= 1
+        session.last_used = time.monotonic()
+
+
+async def health(request):
+    return JSONResponse({"status": "draining" if STATE.draining else "ok"}, status_code=503 if STATE.draining else 200)
+
+
+async def stats(request):
+    return JSONResponse({
+        "stub": API_STUB,
+        "sessions": len(STATE.sessions),
+        "active_turns": STATE.active_turns,
+        "served_turns": STATE.served_turns,
+        "rejected_turns": STATE.rejected_turns,
+        "prompt_cache": PROMPT_CACHE_STATS,
+        "intent_router": INTENT_ROUTER.stats(),
+        "clinic_prefetch": CLINIC_PREFETCHER.stats(),
+        "search_cache": SEARCH_CACHE.stats(),
+        "coalescing": flight_stats(),
+        "answer_cache": ANSWER_CACHE_STORE.stats(),
+        "llm_scheduler": SCHEDULER.stats(),
+        "hedging": hedge_stats(),
+    })
+
+
+async def metrics(request):
+    sink = TRACER.prometheus()
+    if sink is None:
+        return error(404, "Prometheus sink not enabled (TRACE_SINKS).")
+    return PlainTextResponse(sink.render(), headers={"Content-Type": "text/plain; version=0.0.4"})
+
+
+def drain_on_signals(loop):
+    """
+        Chain in front of the server's SIGTERM / SIGINT handlers (uvicorn installs them before the
+        lifespan starts): mark the worker draining at once, so new sessions and turns get a 503 and
+        /health fails while the listener is still open, then hand the signal on after API_DRAIN_DELAY.
+        A second signal is handed on right away. Returns a function restoring the previous handlers.
+    """
+    if threading.current_thread() is not threading.main_thread():
+        return lambda: None
+
+    previous = {}
+
+    def handle(signum, frame):
+        handler = previous[signum]
+        if not callable(handler):
+            return
+        if STATE.draining or not API_DRAIN_DELAY:
+            STATE.draining = True
+            handler(signum, frame)
+            return
+        STATE.draining = True
+        print(f"[API] Draining, closing the listener in {API_DRAIN_DELAY:g}s" , flush=True)
+        loop.call_soon_threadsafe(loop.call_later, API_DRAIN_DELAY, handler, signum, frame)
+
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        previous[signum] = signal.signal(signum, handle)
+
+    def restore():
+        for signum, handler in previous.items():
+            signal.signal(signum, handler)
+    return restore
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    restore_signals = drain_on_signals(asyncio.get_running_loop())
+    try:
+        yield
+    finally:
+        restore_signals()
+    # Graceful shutdown: refuse new work (already the case when a signal started it), let streaming
+    # turns finish, then close the pooled clients
+    STATE.draining = True
+    deadline = time.monotonic() + API_SHUTDOWN_GRACE
+    while STATE.active_turns and time.monotonic() < deadline:
+        await asyncio.sleep(0.1)
+    print(f"[API] Shutting down with {STATE.active_turns} turns still active" , flush=True)
+    await aclose_clients()
+
+
+app = Starlette(
+    routes=[
+        Route("/sessions", create_session, methods=["POST"]),
+        Route("/sessions/{session_id}", delete_session, methods=["DELETE"]),
+        Route("/sessions/{session_id}/messages", post_message, methods=["POST"]),
+        Route("/health", health),
+        Route("/stats", stats),
+        Route("/metrics", metrics),
+    ],
+    lifespan=lifespan,
+)
+
+
+def main(argv=None):
+    global API_STUB
+    parser = argparse.ArgumentParser(description="Serve the TeleMedic bot over HTTP with Server-Sent Events.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--stub", action="store_true", help="Use offline stub OpenAI / Tavily clients.")
+    args = parser.parse_args(argv)
+
+    import uvicorn
+    API_STUB = API_STUB or args.stub
+    uvicorn.run(app, host=args.host, port=args.port, timeout_graceful_shutdown=API_SHUTDOWN_GRACE)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -14,15 +14,25 @@ st.set_page_config(page_title="TeleMedicine Chatbot", page_icon=":hospital:", la
 
 
 
-# Get client IP using JavaScript and return it to Python
-client_ip = streamlit_js_eval(
-    js_expressions="fetch('https://ipinfo.io/json').then(res => res.json()).then(data => data.ip)",
-    key="get_client_ip"
-)
+def get_client_ip_from_headers():
+    """ Client IP from the proxy headers of the request, no third party round trip. """
+    context = getattr(st, "context", None)
+    headers = getattr(context, "headers", None) or {}
+    forwarded = headers.get("X-Forwarded-For") or headers.get("X-Real-Ip")
+    return forwarded.split(",")[0].strip() if forwarded else None
+
 
+if not st.session_state.get("client_ip"):
+    client_ip = get_client_ip_from_headers()
+    if not client_ip:
+        # Get client IP using JavaScript and return it to Python (arrives on a later rerun)
+        client_ip = streamlit_js_eval(
+            js_expressions="fetch('https://ipinfo.io/json').then(res => res.json()).then(data => data.ip)",
+            key="get_client_ip"
+        )
 
-if client_ip:
-    st.session_state["client_ip"] = client_ip
+    if client_ip:
+        st.session_state["client_ip"] = client_ip
 
 
 
@@ -136,6 +146,5 @@ def main():
             st.rerun()
 
 if __name__ == "__main__":
-
-    if st.session_state.get("client_ip"):
-        main()
+    # Render right away, the chat screen picks up the location once the IP is known
+    main()
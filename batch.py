@@ -0,0 +1,360 @@
+"""
+    Batch runner replaying recorded consultations through the bot, e.g. to check answer
+    quality after a prompt change.
+
+    Conversations are read lazily from JSONL, one per line:
+
+        {"id": "c-001", "lang": "en", "user_location": {...}, "turns": ["Hi", "I have ...", ...]}
+
+    and run `--concurrency` at a time, on AsyncTeleMedicBot (async mode, default) or on
+    TeleMedicBot in a process pool (process mode). Every finished conversation is appended to
+    the output JSONL right away, which is also the checkpoint: running the same command again
+    skips the conversations already answered, failed ones are retried and their old row is
+    dropped, so the output holds one row per conversation.
+
+        python batch.py dialogs.jsonl -o answers.jsonl --concurrency 64
+        python batch.py dialogs.jsonl -o answers.jsonl --mode process --concurrency 8
+        python batch.py dialogs.jsonl -o answers.jsonl --stub          # offline stand-ins (stubs.py)
+
+    A summary with throughput, prompt / search cache hit rates, token spend and (async mode)
+    the routing stats is printed at the end (also after Ctrl+C) and written with --report.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from stubs import StubSettings, serve_stubs
+
+
+class CountingCache:
+    """ Hit / miss counts of one conversation over the shared search cache. """
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.counts = Counter()
+
+    def get(self, tool, key):
+        value = self.cache.get(tool, key)
+        self.counts["hits" if value is not None else "misses"] += 1
+        return value
+
+    def __getattr__(self, name):
+        return getattr(self.cache, name)
+
+
+def batch_bot(base):
+    """ `base` bot class that keeps the token usage and search cache lookups of its conversation. """
+
+    class BatchBot(base):
+        def __init__(self, *args, **kwargs):
+            self.usage = Counter()
+            super().__init__(*args, **kwargs)
+            self.search_cache = CountingCache(self.search_cache)
+
+        def record_usage(self, usage):
+            if usage is not None:
+                details = getattr(usage, "prompt_tokens_details", None)
+                self.usage["prompt_tokens"] += usage.prompt_tokens
+                self.usage["completion_tokens"] += usage.completion_tokens
+                self.usage["cached_tokens"] += getattr(details, "cached_tokens", None) or 0
+                self.usage["requests"] += 1
+            super().record_usage(usage)
+
+    return BatchBot
+
+
+def read_conversations(path):
+    """ (id, row) per JSONL line, lazily. Lines without an "id" are keyed by their line number. """
+    with open(path, "r", encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            yield str(row.get("id", number)), row
+
+
+def load_checkpoint(path):
+    """
+        Ids answered in a previous run. The output is compacted first: a torn last line (the run
+        was killed mid write) is cut off and a conversation written more than once (failed, then
+        retried) keeps only its latest row.
+    """
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, "rb") as f:
+        data = f.read()
+    lines = data.decode("utf-8").splitlines(keepends=True)
+    if lines and not lines[-1].endswith("\n"):
+        lines.pop()
+
+    latest = {}
+    for line in lines:
+        try:
+            result = json.loads(line)
+        except ValueError:
+            continue
+        conversation_id = str(result["id"])
+        latest.pop(conversation_id, None)
+        latest[conversation_id] = line
+        if result.get("status") == "ok":
+            done.add(conversation_id)
+        else:
+            done.discard(conversation_id)
+
+    if len(latest) != len(lines):
+        # Rewritten next to the output and swapped in, so a crash here keeps the old file
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            f.writelines(latest.values())
+        os.replace(path + ".tmp", path)
+    return done
+
+
+def result_row(conversation_id, row, bot, turns, started):
+    failed = any(turn.get("error") for turn in turns)
+    return {
+        "id": conversation_id,
+        "lang": row.get("lang", "en"),
+        "status": "error" if failed else "ok",
+        "seconds": round(time.perf_counter() - started, 3),
+        "turns": turns,
+        "usage": dict(bot.usage) if bot is not None else {},
+        "search_cache": dict(bot.search_cache.counts) if bot is not None else {},
+    }
+
+
+async def consult_async(bot_class, conversation_id, row):
+    started = time.perf_counter()
+    bot = None
+    turns = []
+    try:
+        bot = bot_class(lang=row.get("lang", "en"), user_location=row.get("user_location") or {})
+        for message in row["turns"]:
+            turn_started, first_token, answer = time.perf_counter(), None, []
+            try:
+                async for token in bot.chat(message):
+                    if first_token is None:
+                        first_token = time.perf_counter() - turn_started
+                    answer.append(token)
+            except Exception as e:
+                # History after a failed turn is not worth replaying further
+                turns.append({"user": message, "answer": "".join(answer), "error": repr(e)})
+                break
+            turns.append({
+                "user": message, "answer": "".join(answer),
+                "ttft": round(first_token, 3) if first_token is not None else None,
+                "seconds": round(time.perf_counter() - turn_started, 3),
+            })
+    except Exception as e:
+        turns.append({"error": repr(e)})
+    return result_row(conversation_id, row, bot, turns, started)
+
+
+_BOT_CLASS = None
+
+
+def consult_in_process(conversation_id, row):
+    """ One conversation on TeleMedicBot, run in a pool worker (the bot is imported there, not in the parent). """
+    global _BOT_CLASS
+    if _BOT_CLASS is None:
+        from bot import TeleMedicBot
+        _BOT_CLASS = batch_bot(TeleMedicBot)
+
+    started = time.perf_counter()
+    bot = None
+    turns = []
+    try:
+        bot = _BOT_CLASS(lang=row.get("lang", "en"), user_location=row.get("user_location") or {})
+        for message in row["turns"]:
+            turn_started, first_token, answer = time.perf_counter(), None, []
+            try:
+                for token in bot.chat(message, stream=True):
+                    if first_token is None:
+                        first_token = time.perf_counter() - turn_started
+                    answer.append(token)
+            except Exception as e:
+                turns.append({"user": message, "answer": "".join(answer), "error": repr(e)})
+                break
+            turns.append({
+                "user": message, "answer": "".join(answer),
+                "ttft": round(first_token, 3) if first_token is not None else None,
+                "seconds": round(time.perf_counter() - turn_started, 3),
+            })
+    except Exception as e:
+        turns.append({"error": repr(e)})
+    return result_row(conversation_id, row, bot, turns, started)
+
+
+class Summary:
+    """ Aggregates finished conversations of this run. """
+
+    def __init__(self, skipped):
+        self.started = time.perf_counter()
+        self.skipped = skipped
+        self.counts = Counter()
+        self.usage = Counter()
+        self.search_cache = Counter()
+
+    def add(self, result):
+        self.counts["conversations"] += 1
+        self.counts[result["status"]] += 1
+        self.counts["turns"] += sum(1 for turn in result["turns"] if "user" in turn)
+        self.usage.update(result["usage"])
+        self.search_cache.update(result["search_cache"])
+        if self.counts["conversations"] % 100 == 0:
+            print(f"[BATCH] {self.counts['conversations']} conversations, {self.counts['error']} failed" , flush=True)
+
+    def report(self, input_price=None, output_price=None):
+        seconds = time.perf_counter() - self.started
+        lookups = self.search_cache["hits"] + self.search_cache["misses"]
+        report = {
+            "conversations": self.counts["conversations"],
+            "ok": self.counts["ok"],
+            "failed": self.counts["error"],
+            "skipped_from_checkpoint": self.skipped,
+            "turns": self.counts["turns"],
+            "seconds": round(seconds, 3),
+            "conversations_per_s": self.counts["conversations"] / seconds if seconds else 0.0,
+            "turns_per_s": self.counts["turns"] / seconds if seconds else 0.0,
+            "tokens": dict(self.usage),
+            "prompt_cache_hit_rate": self.usage["cached_tokens"] / self.usage["prompt_tokens"] if self.usage["prompt_tokens"] else 0.0,
+            "search_cache_hit_rate": self.search_cache["hits"] / lookups if lookups else 0.0,
+            "search_cache": dict(self.search_cache),
+        }
+        if input_price is not None and output_price is not None:
+            # USD per million tokens; cached prompt tokens are billed at half the input price
+            uncached = self.usage["prompt_tokens"] - self.usage["cached_tokens"]
+            report["cost_usd"] = round(
+                (uncached + self.usage["cached_tokens"] / 2) * input_price / 1e6
+                + self.usage["completion_tokens"] * output_price / 1e6, 4
+            )
+        return report
+
+
+def process_stats():
+    """
+        Stats kept process wide by the bot modules. Only collected in async mode: in process mode
+        they live in the pool workers.
+    """
+    from intent_router import INTENT_ROUTER
+    return {"intent_router": INTENT_ROUTER.stats()}
+
+
+def pending_conversations(args, done):
+    for conversation_id, row in read_conversations(args.input):
+        if conversation_id not in done:
+            yield conversation_id, row
+
+
+def run_async(args, conversations, write, summary):
+    from bot import AsyncTeleMedicBot
+    bot_class = batch_bot(AsyncTeleMedicBot)
+
+    async def run_all():
+        limit = asyncio.Semaphore(args.concurrency)
+        tasks = set()
+
+        async def one(conversation_id, row):
+            try:
+                result = await consult_async(bot_class, conversation_id, row)
+                write(result)
+                summary.add(result)
+            finally:
+                limit.release()
+
+        # Acquire before reading the next line so only `concurrency` conversations are in memory
+        for conversation_id, row in conversations:
+            await limit.acquire()
+            task = asyncio.ensure_future(one(conversation_id, row))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks)
+
+    asyncio.run(run_all())
+
+
+def run_process(args, conversations, write, summary):
+    with ProcessPoolExecutor(max_workers=args.concurrency) as executor:
+        pending = set()
+        for conversation_id, row in conversations:
+            if len(pending) >= args.concurrency * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    result = future.result()
+                    write(result)
+                    summary.add(result)
+            pending.add(executor.submit(consult_in_process, conversation_id, row))
+        for future in pending:
+            result = future.result()
+            write(result)
+            summary.add(result)
+
+
+def use_stubs(args):
+    """ Point the clients at the HTTP stub server (started here unless --stub-url is given). """
+    url = args.stub_url
+    if url is None:
+        serve_stubs(StubSettings(seed=args.seed), port=args.stub_port)
+        url = f"http://127.0.0.1:{args.stub_port}"
+    # Set before the bot is imported, process pool workers inherit them
+    os.environ.update({
+        "OPENAI_BASE_URL": f"{url}/v1", "OPENAI_API_KEY": "stub", "TAVILY_BASE_URL": url, "TRAVILY_API_KEY": "stub",
+    })
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay recorded consultations through the TeleMedic bot in bulk.")
+    parser.add_argument("input", help='JSONL of {"id": ..., "lang": ..., "user_location": {...}, "turns": [...]}')
+    parser.add_argument("-o", "--output", required=True, help="Results JSONL, appended to and used as the checkpoint.")
+    parser.add_argument("--concurrency", type=int, default=32, help="Conversations in flight (process mode: worker processes).")
+    parser.add_argument("--mode", choices=("async", "process"), default="async")
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint and start a new output file.")
+    parser.add_argument("--report", help="Also write the summary JSON here.")
+    parser.add_argument("--input-price", type=float, help="USD per million prompt tokens, to report the cost.")
+    parser.add_argument("--output-price", type=float, help="USD per million completion tokens.")
+    parser.add_argument("--stub", action="store_true", help="Use the offline OpenAI / Tavily stand-ins.")
+    parser.add_argument("--stub-url", help="Already running stub server (implies --stub).")
+    parser.add_argument("--stub-port", type=int, default=8900)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    if args.stub or args.stub_url:
+        use_stubs(args)
+    if args.restart and os.path.exists(args.output):
+        os.remove(args.output)
+
+    done = load_checkpoint(args.output)
+    if done:
+        print(f"[BATCH] Resuming, {len(done)} conversations already answered" , flush=True)
+    summary = Summary(skipped=len(done))
+
+    with open(args.output, "a", encoding="utf-8") as output:
+        def write(result):
+            output.write(json.dumps(result, ensure_ascii=False) + "\n")
+            output.flush()
+
+        try:
+            runner = run_async if args.mode == "async" else run_process
+            runner(args, pending_conversations(args, done), write, summary)
+        except KeyboardInterrupt:
+            print("[BATCH] Interrupted, run again with the same arguments to resume" , flush=True)
+        finally:
+            report = summary.report(args.input_price, args.output_price)
+            if args.mode == "async":
+                report.update(process_stats())
+            print(json.dumps(report, indent=2, ensure_ascii=False))
+            if args.report:
+                with open(args.report, "w", encoding="utf-8") as f:
+                    json.dump(report, f, indent=2, ensure_ascii=False)
+    load_checkpoint(args.output)  # drop the rows the retries of this run replaced
+    return 1 if summary.counts["error"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
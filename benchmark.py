@@ -0,0 +1,320 @@
+"""
+    Reproducible benchmark / load test of the bot against local OpenAI and Tavily stand-ins.
+
+    Starts the HTTP stub server from `stubs.py` (or uses one given with --stub-url), points the
+    real pooled clients at it and drives N concurrent scripted consultations (English and
+    Spanish, several turns each) through `chat`. Reports time to first token percentiles,
+    streaming rate, upstream requests per turn, memory per session and throughput as JSON:
+
+        python benchmark.py run --sessions 200 --concurrency 50 -o results.json
+        python benchmark.py run --mode sync --sessions 50            # TeleMedicBot on threads
+        python benchmark.py serve --stub-port 8900                   # stub server only
+        python benchmark.py compare baseline.json results.json
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import statistics
+import subprocess
+import tracemalloc
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from stubs import StubSettings, serve_stubs
+
+SYMPTOMS = {
+    "en": [
+        "a headache and mild fever for two days",
+        "a dry cough and a sore throat since yesterday",
+        "stomach pain and nausea after eating",
+        "an itchy rash on my arms",
+        "dizziness when I stand up",
+    ],
+    "es": [
+        "dolor de cabeza y fiebre leve desde hace dos días",
+        "tos seca y dolor de garganta desde ayer",
+        "dolor de estómago y náuseas después de comer",
+        "un sarpullido con picazón en los brazos",
+        "mareos cuando me levanto",
+    ],
+}
+DIALOG = {
+    "en": ["Hi", "I have {symptoms}", "It is about 6 out of 10 and worse in the evening",
+           "Where can I see a doctor near me?", "Thanks!"],
+    "es": ["Hola", "Tengo {symptoms}", "Es como un 6 de 10 y empeora por la noche",
+           "¿Dónde puedo ver a un médico cerca de mí?", "¡Gracias!"],
+}
+USER_LOCATION = {"city": "Lahore", "region": "Punjab", "country": "PK", "loc": "31.5204,74.3587"}
+# Metrics compared by `compare`, True when higher is better
+HEADLINE = {
+    "throughput_turns_per_s": True,
+    "ttft_s.p50": False,
+    "ttft_s.p99": False,
+    "turn_s.p99": False,
+    "tokens_per_s.p50": True,
+    "requests_per_turn.completions": False,
+    "memory_per_session_kb": False,
+}
+
+
+def dialogs(count, langs, path=None):
+    """ `count` scripted consultations as (lang, [user messages]), from `path` (JSONL) or built in. """
+    if path:
+        with open(path, "r", encoding="utf-8") as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+        return [(rows[i % len(rows)].get("lang", "en"), rows[i % len(rows)]["turns"]) for i in range(count)]
+
+    result = []
+    for i in range(count):
+        lang = langs[i % len(langs)]
+        symptoms = SYMPTOMS[lang][(i // len(langs)) % len(SYMPTOMS[lang])]
+        result.append((lang, [turn.format(symptoms=symptoms) for turn in DIALOG[lang]]))
+    return result
+
+
+def percentiles(values):
+    if not values:
+        return {}
+    ordered = sorted(values)
+
+    def pick(p):
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+    return {"p50": pick(50), "p90": pick(90), "p99": pick(99), "mean": statistics.fmean(ordered), "max": ordered[-1]}
+
+
+def record(turns, started, first_token, chunks, error=None):
+    seconds = time.perf_counter() - started
+    turns.append({
+        "ttft": first_token, "seconds": seconds, "chunks": chunks, "error": error,
+        "tokens_per_s": chunks / (seconds - first_token) if first_token is not None and seconds > first_token else None,
+    })
+
+
+async def consult_async(bot_class, lang, messages, turns):
+    bot = bot_class(lang=lang, user_location=dict(USER_LOCATION))
+    for message in messages:
+        started, first_token, chunks = time.perf_counter(), None, 0
+        try:
+            async for _ in bot.chat(message):
+                if first_token is None:
+                    first_token = time.perf_counter() - started
+                chunks += 1
+            record(turns, started, first_token, chunks)
+        except Exception as e:
+            record(turns, started, first_token, chunks, error=repr(e))
+    return bot
+
+
+def consult_sync(bot_class, lang, messages, turns):
+    bot = bot_class(lang=lang, user_location=dict(USER_LOCATION))
+    for message in messages:
+        started, first_token, chunks = time.perf_counter(), None, 0
+        try:
+            for _ in bot.chat(message, stream=True):
+                if first_token is None:
+                    first_token = time.perf_counter() - started
+                chunks += 1
+            record(turns, started, first_token, chunks)
+        except Exception as e:
+            record(turns, started, first_token, chunks, error=repr(e))
+    return bot
+
+
+def drive(mode, conversations, concurrency):
+    """ Run every consultation, `concurrency` at a time. Returns (turn records, seconds). """
+    from bot import TeleMedicBot, AsyncTeleMedicBot
+
+    turns = []
+    started = time.perf_counter()
+    if mode == "sync":
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(lambda c: consult_sync(TeleMedicBot, c[0], c[1], turns), conversations))
+    else:
+        async def run_all():
+            limit = asyncio.Semaphore(concurrency)
+
+            async def one(lang, messages):
+                async with limit:
+                    await consult_async(AsyncTeleMedicBot, lang, messages, turns)
+            await asyncio.gather(*(one(lang, messages) for lang, messages in conversations))
+        asyncio.run(run_all())
+    return turns, time.perf_counter() - started
+
+
+def memory_per_session(conversations):
+    """ Bytes a finished consultation keeps alive (bot, history, summaries), traced on a few sessions. """
+    from bot import TeleMedicBot
+
+    bots = []
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for lang, messages in conversations:
+        bots.append(consult_sync(TeleMedicBot, lang, messages, []))
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    retained = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    return retained / max(1, len(bots))
+
+
+def stub_stats(url):
+    with urllib.request.urlopen(f"{url}/stats", timeout=5) as response:
+        return json.load(response)
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def stub_settings(args):
+    return StubSettings(
+        first_token_delay=args.first_token_ms / 1000, token_delay=args.token_ms / 1000, tokens=args.tokens,
+        tool_rate=args.tool_rate, search_delay=args.search_ms / 1000, seed=args.seed,
+    )
+
+
+def run(args):
+    settings = stub_settings(args)
+    url = args.stub_url
+    if url is None:
+        serve_stubs(settings, port=args.stub_port)
+        url = f"http://127.0.0.1:{args.stub_port}"
+
+    # Clients are created lazily, so pointing them at the stubs before the first bot is enough.
+    # Real keys are never sent to the stub server.
+    os.environ.update({
+        "OPENAI_BASE_URL": f"{url}/v1", "OPENAI_API_KEY": "stub", "TAVILY_BASE_URL": url, "TRAVILY_API_KEY": "stub",
+    })
+    from answer_cache import ANSWER_CACHE_STORE
+    from bot import PROMPT_CACHE_STATS
+    from hedging import hedge_stats
+    from intent_router import INTENT_ROUTER
+    from prefetch import CLINIC_PREFETCHER
+    from scheduler import SCHEDULER
+    from search_cache import SEARCH_CACHE
+    from singleflight import flight_stats
+
+    conversations = dialogs(args.sessions, args.langs.split(","), args.dialogs)
+    upstream_before = stub_stats(url)
+    turns, seconds = drive(args.mode, conversations, args.concurrency)
+    upstream = {key: value - upstream_before.get(key, 0) for key, value in stub_stats(url).items()}
+    memory = memory_per_session(conversations[:args.memory_sessions]) if args.memory_sessions else None
+
+    ok = [turn for turn in turns if not turn["error"]]
+    results = {
+        "meta": {
+            "timestamp": time.time(), "commit": git_commit(), "python": platform.python_version(),
+            "args": {key: value for key, value in vars(args).items() if key != "func"},
+        },
+        "sessions": len(conversations),
+        "turns": len(turns),
+        "errors": len(turns) - len(ok),
+        "seconds": seconds,
+        "throughput_turns_per_s": len(turns) / seconds if seconds else 0.0,
+        "ttft_s": percentiles([turn["ttft"] for turn in ok if turn["ttft"] is not None]),
+        "turn_s": percentiles([turn["seconds"] for turn in ok]),
+        "tokens_per_s": percentiles([turn["tokens_per_s"] for turn in ok if turn["tokens_per_s"]]),
+        "chunks_per_s": sum(turn["chunks"] for turn in ok) / seconds if seconds else 0.0,
+        "requests_per_turn": {key: value / len(turns) for key, value in upstream.items() if key != "completion_tokens"} if turns else {},
+        "upstream": upstream,
+        "memory_per_session_kb": memory / 1024 if memory is not None else None,
+        "search_cache": SEARCH_CACHE.stats(),
+        "coalescing": flight_stats(),
+        "answer_cache": ANSWER_CACHE_STORE.stats(),
+        "prompt_cache": dict(PROMPT_CACHE_STATS),
+        "llm_scheduler": SCHEDULER.stats(),
+        "hedging": hedge_stats(),
+        "intent_router": INTENT_ROUTER.stats(),
+        "clinic_prefetch": CLINIC_PREFETCHER.stats(),
+    }
+    output = json.dumps(results, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    print(output)
+
+
+def lookup(results, dotted):
+    value = results
+    for key in dotted.split("."):
+        value = (value or {}).get(key)
+    return value
+
+
+def compare(args):
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(args.candidate, "r", encoding="utf-8") as f:
+        candidate = json.load(f)
+
+    regressions = 0
+    for metric, higher_is_better in HEADLINE.items():
+        old, new = lookup(baseline, metric), lookup(candidate, metric)
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        worse = change < -args.tolerance if higher_is_better else change > args.tolerance
+        regressions += worse
+        print(f"{metric:32} {old:12.4f} -> {new:12.4f}  {change:+7.1%}{'  REGRESSION' if worse else ''}")
+    return 1 if regressions else 0
+
+
+def serve(args):
+    serve_stubs(stub_settings(args), host=args.host, port=args.stub_port)
+    print(f"[BENCH] Stub OpenAI at http://{args.host}:{args.stub_port}/v1, Tavily at http://{args.host}:{args.stub_port}" , flush=True)
+    while True:
+        time.sleep(3600)
+
+
+def stub_arguments(parser):
+    parser.add_argument("--stub-port", type=int, default=8900)
+    parser.add_argument("--first-token-ms", type=float, default=300)
+    parser.add_argument("--token-ms", type=float, default=10, help="Delay between streamed chunks.")
+    parser.add_argument("--tokens", type=int, default=60, help="Chunks per answer.")
+    parser.add_argument("--tool-rate", type=float, default=0.5)
+    parser.add_argument("--search-ms", type=float, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the TeleMedic bot against local OpenAI / Tavily stand-ins.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    bench = commands.add_parser("run", help="Drive concurrent scripted consultations and report metrics.")
+    stub_arguments(bench)
+    bench.add_argument("--sessions", type=int, default=100)
+    bench.add_argument("--concurrency", type=int, default=50)
+    bench.add_argument("--mode", choices=("async", "sync"), default="async")
+    bench.add_argument("--langs", default="en,es")
+    bench.add_argument("--dialogs", help='JSONL of {"lang": ..., "turns": [...]} instead of the built in dialogs.')
+    bench.add_argument("--memory-sessions", type=int, default=10, help="Sessions traced for memory per session, 0 to skip.")
+    bench.add_argument("--stub-url", help="Use an already running stub server.")
+    bench.add_argument("-o", "--output")
+    bench.set_defaults(func=run)
+
+    server = commands.add_parser("serve", help="Only run the stub server.")
+    stub_arguments(server)
+    server.add_argument("--host", default="127.0.0.1")
+    server.set_defaults(func=serve)
+
+    diff = commands.add_parser("compare", help="Compare two result files, exit 1 on a regression.")
+    diff.add_argument("baseline")
+    diff.add_argument("candidate")
+    diff.add_argument("--tolerance", type=float, default=0.1)
+    diff.set_defaults(func=compare)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,13 +1,52 @@
+import copy
 import json
+import time
+import uuid
+import asyncio
+from contextlib import aclosing
 import requests, os
-from openai import OpenAI
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from dotenv import load_dotenv
-from tavily import TavilyClient
+from clients import get_client, OPENAI_FALLBACK_BASE_URL
+from search_cache import SEARCH_CACHE, normalize_text, normalize_symptoms
+from singleflight import SEARCH_FLIGHT, ASYNC_SEARCH_FLIGHT, COMPLETION_FLIGHT, SharedStream, StreamAbandoned
+from medical_index import open_index
+from clinic_directory import open_directory
+from prefetch import CLINIC_PREFETCH, CLINIC_PREFETCHER, candidate_conditions
+from intent_router import INTENT_ROUTING, INTENT_ROUTER, SMALL_TALK, CLINIC
+from answer_cache import ANSWER_CACHE, ANSWER_CACHE_STORE, stream_text
+from context_window import ContextWindow
+from tool_results import TOOL_RESULT_BUDGET, DEFAULT_BUDGET, compact_results, digest
+from tracing import TRACER, NULL_TRACE, LOG_PAYLOADS
+from scheduler import SCHEDULER, LLM_SCHEDULER, FOLLOW_UP, ONGOING, NEW_SESSION, estimate_cost
+from hedging import (
+    FIRST_TOKEN_HEDGER, RESPONSE_HEDGER, SEARCH_HEDGER, HEDGE_FALLBACK_MODEL, DeadlineExceeded,
+    peek_stream, apeek_stream, close_stream, aclose_stream,
+)
 
 load_dotenv()
 
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-TRAVILY_API_KEY = os.getenv("TRAVILY_API_KEY")
+TOOL_TIMEOUT = float(os.getenv("TOOL_TIMEOUT", "15"))
+TOOL_WORKERS = int(os.getenv("TOOL_WORKERS", "16"))
+# Tool result when Tavily missed its deadline: the model answers without search data
+SEARCH_UNAVAILABLE = "The search did not answer in time. Answer from general medical knowledge, say that no sources could be checked and recommend seeing a doctor."
+# Prompt prefix cache instrumentation, totals for the process. The provider only caches prompts of
+# 1024+ tokens and the shared system prompt + tools are ~420, so hits only come from the history of
+# a long consultation (until it is folded), not from sharing the prefix between sessions
+PROMPT_CACHE_STATS = {"requests": 0, "prompt_tokens": 0, "cached_tokens": 0}
+# Where fetch_medical_info looks things up: "remote" (Tavily), "local" (offline index) or "local-first"
+MEDICAL_INFO_BACKEND = os.getenv("MEDICAL_INFO_BACKEND", "remote").lower()
+MEDICAL_INDEX_PATH = os.getenv("MEDICAL_INDEX_PATH", "medical.idx")
+MEDICAL_INDEX_TOP_K = int(os.getenv("MEDICAL_INDEX_TOP_K", "5"))
+# Local clinic directory tried before the web search for fetch_nearby_clinic
+CLINIC_DIRECTORY_PATH = os.getenv("CLINIC_DIRECTORY_PATH", "clinics.csv")
+CLINIC_TOP_K = int(os.getenv("CLINIC_TOP_K", "5"))
+CLINIC_MIN_RESULTS = int(os.getenv("CLINIC_MIN_RESULTS", "3"))
+# Share identical in-flight tool-free first-turn completions (streamed or not) between sessions
+COALESCE_COMPLETIONS = os.getenv("COALESCE_COMPLETIONS", "false").lower() == "true"
+
+# Shared pool so every tool call of a turn runs at once
+TOOL_EXECUTOR = ThreadPoolExecutor(max_workers=TOOL_WORKERS, thread_name_prefix="telemedic-tool")
 
 
 TOOLS = [
@@ -65,7 +104,7 @@ SYSTEM_PROMPT_EN = """
     If external data is needed, call the 'fetch_medical_info' function.
 
     If user asks about clinics or doctors nearby use 'fetch_nearby_clinic' function to return response and also the url of clinic/doctor returned from function.
-    User Location is {user_location}
+    The user location is given in the system message that follows.
 
     Whenever recommending a user about some disease or giving a suggestion, ALWAYS remind users to consult a doctor for a proper diagnosis.
 """
@@ -86,11 +125,13 @@ SYSTEM_PROMPT_ES = """
     Si necesitas datos externos, llama a la función 'fetch_medical_info'.
 
         Si el usuario pregunta sobre clínicas o médicos cercanos, utiliza la función 'fetch_nearby_clinic' para devolver la respuesta y también la URL de la clínica o del médico que devuelve la función.
-        La ubicación del usuario es {user_location}
+        La ubicación del usuario se indica en el mensaje del sistema que sigue.
 
     Siempre que recomiendes algo o hables de enfermedades, RECUERDA a los usuarios que consulten a un médico para un diagnóstico adecuado.
 """
 
+SYSTEM_PROMPTS = {"en": SYSTEM_PROMPT_EN, "es": SYSTEM_PROMPT_ES}
+
 
 
 
@@ -105,127 +146,643 @@ class TeleMedicBot:
         self.max_tokens = max_tokens
         self.user_location = user_location
         self.tools = tools if tools else TOOLS
-        self.client = OpenAI(api_key=OPENAI_API_KEY)
-        self.tavily_client = TavilyClient(api_key=TRAVILY_API_KEY)
-        self.system_prompt = SYSTEM_PROMPT_ES if self.lang == "es" else SYSTEM_PROMPT_EN
-        self.system_prompt = self.system_prompt.format(user_location=self.user_location)
+        self.client, self.tavily_client = self.create_clients()
+        self.search_cache = SEARCH_CACHE
+        # Static per language, so it (and TOOLS) form a byte identical prefix shared by every session
+        self.system_prompt = SYSTEM_PROMPTS.get(self.lang, SYSTEM_PROMPT_EN)
 
 
         self.messages = [{"role": "system", "content": self.system_prompt}]
+        self.context = ContextWindow(user_context=self.user_context())
+        self.tool_digests = {}
+        self.trace = NULL_TRACE  # spans of the current turn
+        # Durable session (see `attach_session`): seq of messages[1] and of the next message to store
+        self.session_store = None
+        self.session_id = None
+        self.first_seq = 0
+        self.next_seq = 0
         self.__str__()
 
+    @classmethod
+    def from_session(cls, store, session_id, **kwargs):
+        """ Rebuild a bot from a stored session: unfolded messages plus running summary. None if unknown. """
+        session = store.load(session_id)
+        if session is None:
+            return None
+        bot = cls(lang=session["lang"], user_location=session["user_location"], **kwargs)
+        bot.messages.extend(session["messages"])
+        bot.context.summary = session["summary"]
+        bot.session_store, bot.session_id = store, session_id
+        bot.first_seq, bot.next_seq = session["first_seq"], session["next_seq"]
+        return bot
+
+    def attach_session(self, store, session_id):
+        """ Persist this (new) conversation under `session_id`. """
+        store.create(session_id, self.lang, self.user_location)
+        self.session_store, self.session_id = store, session_id
+        self.persist()
+
+    def persist(self):
+        """ Append the messages not stored yet to the session log. """
+        if self.session_store is None:
+            return
+        unsaved = self.messages[1 + self.next_seq - self.first_seq:]
+        if unsaved:
+            self.session_store.append(self.session_id, self.next_seq, unsaved)
+            self.next_seq += len(unsaved)
+
+    def persist_fold(self, folded):
+        """ `folded` messages went into the summary: store the summary and where the log resumes. """
+        self.first_seq += len(folded)
+        if self.session_store is not None:
+            self.session_store.update(self.session_id, summary=self.context.summary, folded_seq=self.first_seq)
+
+    def persisted(self, tokens):
+        """ Pass tokens through and store the turn once it ended (also when the stream is closed early). """
+        try:
+            yield from tokens
+        finally:
+            self.persist()
+
+    def set_user_location(self, user_location):
+        """ Location resolved after the bot was created (geolocation runs in the background). """
+        self.user_location = user_location or {}
+        self.context.user_context = self.user_context()
+        if self.session_store is not None:
+            self.session_store.update(self.session_id, user_location=self.user_location)
+
+    def set_language(self, lang):
+        """
+            Switch the conversation language in place: swap in the cached system prompt of `lang`
+            and re-render the user context. History, clients and caches are kept as they are.
+        """
+        if lang == self.lang:
+            return
+        self.lang = lang
+        self.system_prompt = SYSTEM_PROMPTS.get(lang, SYSTEM_PROMPT_EN)
+        self.messages[0] = {"role": "system", "content": self.system_prompt}
+        self.context.user_context = self.user_context()
+        if self.session_store is not None:
+            self.session_store.update(self.session_id, lang=lang)
+
+    def user_context(self):
+        """ Per user data sent after the shared prompt prefix. """
+        if self.lang == "es":
+            return f"La ubicación del usuario es {self.user_location}"
+        return f"User Location is {self.user_location}"
+
+    def record_usage(self, usage):
+        """ Log prompt cache hits reported by the provider and keep process wide totals. """
+        if usage is None:
+            return
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached_tokens = getattr(details, "cached_tokens", None) or 0
+        self.trace.add(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens, cached_tokens=cached_tokens)
+        PROMPT_CACHE_STATS["requests"] += 1
+        PROMPT_CACHE_STATS["prompt_tokens"] += usage.prompt_tokens
+        PROMPT_CACHE_STATS["cached_tokens"] += cached_tokens
+        hit_rate = PROMPT_CACHE_STATS["cached_tokens"] / (PROMPT_CACHE_STATS["prompt_tokens"] or 1)
+        print(
+            f"[USAGE] PromptTokens => {usage.prompt_tokens} CachedTokens => {cached_tokens} "
+            f"CompletionTokens => {usage.completion_tokens} CacheHitRate => {hit_rate:.2%}" , flush=True
+        )
+
+    def create_clients(self):
+        """ OpenAI and Tavily clients used by this bot, borrowed from the process wide pool. """
+        return get_client("openai"), get_client("tavily")
+
     def add_message(self, role, content):
         self.messages.append({"role": role, "content": content.strip()})
 
-    def web_search_tool(self, query , reuturn_urls = False):
+    def web_search_tool(self, query , reuturn_urls = False, tool="web_search", cache_key=None):
         """ 
             Calls the external API (Tavily) to fetch medical data.
+            Results are served from the process wide search cache when fresh.
         """
+        cache_key = cache_key or normalize_text(query)
+        with self.trace.span("cache.lookup", tool=tool) as span:
+            result = self.search_cache.get(tool, cache_key)
+            span.set(outcome="miss" if result is None else "hit")
+        if result is not None:
+            print(f"[WEB_SEARCH] Cache Hit => {query}" , flush=True)
+            return result
+
+        # Identical searches already in flight wait for that one instead of hitting Tavily again
+        return SEARCH_FLIGHT.do(
+            (tool, cache_key), self.search_and_cache, query, reuturn_urls, tool, cache_key
+        )
+
+    def search_and_cache(self, query, reuturn_urls, tool, cache_key):
+        with self.trace.span("search", tool=tool) as span:
+            try:
+                response = SEARCH_HEDGER.run(lambda: self.tavily_client.search(query), trace=self.trace)
+            except DeadlineExceeded:
+                span.set(outcome="deadline")
+                print(f"[WEB_SEARCH] Deadline exceeded => {query}" , flush=True)
+                return {"error": SEARCH_UNAVAILABLE}
+        result = self.parse_search_response(query, response, reuturn_urls=reuturn_urls)
+        if isinstance(result, list):
+            self.search_cache.set(tool, cache_key, result)
+        return result
+
+    def parse_search_response(self, query, response, reuturn_urls = False):
+        """ Shape a raw Tavily response into the tool result format. """
         result = None
-        response = self.tavily_client.search(query)
         if len(response.get('results', [])) > 0:
             if reuturn_urls : 
                 result = [ { "content" : res['content'] , "url" : res['url'] } for res in response['results']]
             else : 
                 result = [res['content'] for res in response['results']]
 
-        print(f"[WEB_SEARCH] Query => {query} Result => {result}" , flush=True)
+        print(f"[WEB_SEARCH] Query => {query} Results => {len(result or [])}" , flush=True)
+        if LOG_PAYLOADS:
+            print(f"[WEB_SEARCH] Result => {result}" , flush=True)
         return result or {"error": "No relevant information found."}
     
     def fetch_medical_info(self , symptoms) : 
         """
             Fetch Medical Info
         """
-        query = f"possible conditions for symptoms: {symptoms}"
-        response = self.web_search_tool(query=query)
+        query = self.medical_info_query(symptoms)
+        if MEDICAL_INFO_BACKEND in ("local", "local-first"):
+            response = self.local_medical_info(query)
+            if response or MEDICAL_INFO_BACKEND == "local":
+                return response or {"error": "No relevant information found."}
+
+        response = self.web_search_tool(
+            query=query, tool="fetch_medical_info", cache_key=normalize_symptoms(symptoms)
+        )
         return response
+
+    def local_medical_info(self, query):
+        """ Top snippets from the offline medical index, empty if there is no index or no match. """
+        index = open_index(MEDICAL_INDEX_PATH)
+        if index is None:
+            return []
+        with self.trace.span("medical_index") as span:
+            result = index.snippets(query, k=MEDICAL_INDEX_TOP_K)
+            span.set(results=len(result))
+        print(f"[MEDICAL_INDEX] Query => {query} Results => {len(result)}" , flush=True)
+        return result
+
+    def medical_info_query(self, symptoms):
+        return f"possible conditions for symptoms: {symptoms}"
     
     def fetch_nearby_clinic(self , disease): 
         """
             Fetch Nearby clinic
         """
+        CLINIC_PREFETCHER.record_lookup(self.nearby_clinic_key(disease))
+        return self.search_nearby_clinic(disease)
+
+    def search_nearby_clinic(self, disease):
+        """ Clinic lookup shared by the tool call and the background prefetch. """
+        response = self.local_nearby_clinics(disease)
+        if len(response) >= CLINIC_MIN_RESULTS:
+            return response
+
+        query = self.nearby_clinic_query(disease)
+        response = self.web_search_tool(
+            query=query , reuturn_urls=True, tool="fetch_nearby_clinic", cache_key=self.nearby_clinic_key(disease)
+        )
+        return response
+
+    def local_nearby_clinics(self, disease):
+        """ Nearest relevant providers from the local directory using the ipinfo `loc` lat/long. """
+        if not self.user_location.get("loc"):
+            return []
+        directory = open_directory(CLINIC_DIRECTORY_PATH)
+        if directory is None:
+            return []
+        with self.trace.span("clinic_directory") as span:
+            result = directory.search(self.user_location["loc"], disease, k=CLINIC_TOP_K)
+            span.set(results=len(result))
+        print(f"[CLINIC_DIRECTORY] Disease => {disease} Results => {len(result)}" , flush=True)
+        return result
+
+    def nearby_clinic_query(self, disease):
         city = self.user_location.get("city")
         country = self.user_location.get("country")
-        query = f'doctors or clinics in {city}, {country} for {disease}'
-        response = self.web_search_tool(query=query , reuturn_urls=True)
-        return response
+        return f'doctors or clinics in {city}, {country} for {disease}'
 
-        
+    def nearby_clinic_key(self, disease):
+        city = normalize_text(self.user_location.get("city"))
+        country = normalize_text(self.user_location.get("country"))
+        return f"{city}|{country}|{normalize_symptoms(disease)}"
 
+    def turn_priority(self):
+        """ Scheduler priority of a turn's first model call: a new consultation waits behind ongoing ones. """
+        return NEW_SESSION if self.is_first_turn() else ONGOING
 
-    def get_inference(self, is_tool=True, stream=False):
+    def hedge_client(self):
+        """ Where hedged completions go: the fallback backend when configured, else the primary one. """
+        return get_client("openai_fallback") if OPENAI_FALLBACK_BASE_URL else self.client
+
+    def open_completion(self, request, priority=ONGOING):
+        """
+            Completion admitted by the process wide LLM scheduler (rate limits, priority, retries),
+            then sent under its deadline (first token when streamed, whole answer otherwise) and
+            hedged to the fallback model / backend when it is slower than usual (see hedging.py).
+            Time spent queued does not count against the deadline.
+        """
+        stream = request.get("stream")
+        cost = estimate_cost(request["messages"], request.get("tools"), request.get("max_tokens"))
+
+        def attempt(client, model):
+            response = client.chat.completions.create(**{**request, "model": model})
+            return peek_stream(response) if stream else response
+
+        def send():
+            return (FIRST_TOKEN_HEDGER if stream else RESPONSE_HEDGER).run(
+                lambda: attempt(self.client, request["model"]),
+                lambda: attempt(self.hedge_client(), HEDGE_FALLBACK_MODEL or request["model"]),
+                cleanup=close_stream if stream else None, trace=self.trace,
+                admit=(lambda: SCHEDULER.try_admit(cost)) if LLM_SCHEDULER else None,
+            )
+
+        if not LLM_SCHEDULER:
+            return send()
+        return SCHEDULER.call(send, cost=cost, priority=priority, trace=self.trace)
+
+    def open_recorded_completion(self, request, priority=ONGOING):
+        """ Coalesced non-streamed completion: its usage is recorded by the leader only. """
+        response = self.open_completion(request, priority)
+        self.record_usage(response.usage)
+        return response
+
+    def open_shared_stream(self, request, priority=ONGOING):
+        """ Coalesced streamed completion, every caller reads it through `SharedStream.reader()`. """
+        return SharedStream(self.open_completion(request, priority))
+
+    def get_inference(self, is_tool=True, stream=False, priority=None):
         """ Get response from OpenAI API with optional streaming. """
-        print(f"[INFO] Conversation Lenght : {len(self.messages)}")
-        response = self.client.chat.completions.create(
+        priority = self.turn_priority() if priority is None else priority
+        request = dict(
             model=self.model,
-            messages=self.messages,
+            messages=self.context.prompt(self.messages),
             tools=self.tools if is_tool else None,
             tool_choice="auto" if is_tool else None,
             temperature=self.temprature,
             max_tokens=self.max_tokens,
-            stream=stream 
+            stream=stream ,
+            stream_options={"include_usage": True} if stream else None
         )
+        if COALESCE_COMPLETIONS and not is_tool and self.is_first_turn():
+            # Identical tool-free openers (e.g. a greeting from the same city) share one upstream request
+            key = json.dumps(request, sort_keys=True, default=str)
+            with self.trace.span("llm.request", stream=stream, tools=False, coalesced=True) as span:
+                if not stream:
+                    return COMPLETION_FLIGHT.do(key, self.open_recorded_completion, request, priority)
+                try:
+                    return COMPLETION_FLIGHT.do(key, self.open_shared_stream, request, priority).reader()
+                except StreamAbandoned:
+                    span.set(abandoned=True)  # joined too late, the others already left: ask on our own
+
+        with self.trace.span("llm.request", stream=stream, tools=is_tool, messages=len(request["messages"])):
+            response = self.open_completion(request, priority)
+        if not stream:
+            self.record_usage(response.usage)
         return response
 
-    def chat(self, user_message, stream=False):
-        """ Process user input and generate an AI response with optional streaming. """
-        self.add_message(role="user", content=user_message)
+    def run_tool_call(self, name, arguments):
+        """
+            Execute a single tool call.
+            Returns the tool message content and the short digest that replaces it once answered.
+        """
+        parsed = json.loads(arguments or "{}")
+        if name == "fetch_medical_info":
+            with self.trace.span("tool.fetch_medical_info"):
+                return self.format_tool_result(name, arguments, parsed["symptoms"], self.fetch_medical_info(parsed["symptoms"]))
 
-        # Step 1: Check if a function needs to be called (No Streaming)
-        response = self.get_inference(stream=False)
-        output = response.choices[0].message
+        if name == "fetch_nearby_clinic" :
+            with self.trace.span("tool.fetch_nearby_clinic"):
+                return self.format_tool_result(name, arguments, parsed["disease"], self.fetch_nearby_clinic(parsed["disease"]))
 
-        if hasattr(output, "tool_calls") and output.tool_calls:
-            # Step 2: Execute Function if required
-            tool_call = output.tool_calls[0]
-            print(f'[TOOL_CALL] Tool Call => {tool_call.function}' , flush=True)
-            if tool_call.function.name == "fetch_medical_info":
-                symptoms = json.loads(tool_call.function.arguments)["symptoms"]
-                medical_data = self.fetch_medical_info(symptoms)
-                tool_response = f"Using the following relevant info to answer user query. Info: {str(medical_data)}. User Question: {user_message}"
-
-            if tool_call.function.name == "fetch_nearby_clinic" : 
-                disease = json.loads(tool_call.function.arguments)["disease"]
-                clinics_data = self.fetch_nearby_clinic(disease)                
-                tool_response = f"Here are few neearby clnics / doctors info: {str(clinics_data)}. Use this clinics / doctors info to answer user query. User Question: {user_message}"
-
-            # Add retrieved data and regenerate response (With Streaming)
-            self.add_message(
-                role="assistant",
-                content=tool_response
-            )
+        error = json.dumps({"error": f"Unknown tool {name}"})
+        return error, error
+
+    def format_tool_result(self, name, arguments, query, data):
+        """
+            Tool message content handed back to the model: deduplicated, ranked against the
+            query and cut to the tool's token budget. Also returns its digest.
+        """
+        data = compact_results(data, query, budget=TOOL_RESULT_BUDGET.get(name, DEFAULT_BUDGET))
+        if name == "fetch_nearby_clinic":
+            content = f"Here are few neearby clnics / doctors info: {str(data)}. Use this clinics / doctors info to answer user query."
+        else:
+            content = f"Using the following relevant info to answer user query. Info: {str(data)}"
+        return content, digest(name, arguments, data)
 
-            print(f"[INFO] ToolResp => {tool_response}" , flush=True)
+    def expire_tool_results(self, tool_messages):
+        """ Replace answered tool payloads in history with their digest so later turns don't resend them. """
+        for message in tool_messages:
+            message["content"] = self.tool_digests.pop(message["tool_call_id"], message["content"])
 
-            # Step 3: Now generate the final response using streaming
-            response_stream = self.get_inference(is_tool=False, stream=True)
-            def stream_response():
-                collected_text = ""
+    def run_tool_calls(self, tool_calls, timeout=None):
+        """
+            Dispatch every tool call of the turn concurrently, each with its own timeout.
+            Returns one `tool` message per call tied to its tool_call_id, in call order.
+        """
+        timeout = TOOL_TIMEOUT if timeout is None else timeout
+        started = time.monotonic()
+        futures = [
+            TOOL_EXECUTOR.submit(self.run_tool_call, tool_call["function"]["name"], tool_call["function"]["arguments"])
+            for tool_call in tool_calls
+        ]
+
+        tool_messages = []
+        for tool_call, future in zip(tool_calls, futures):
+            try:
+                content, self.tool_digests[tool_call["id"]] = future.result(
+                    timeout=max(0.0, started + timeout - time.monotonic())
+                )
+            except FutureTimeoutError:
+                future.cancel()
+                content = json.dumps({"error": f"{tool_call['function']['name']} timed out."})
+            except Exception as e:
+                content = json.dumps({"error": str(e)})
+
+            self.log_tool_call(tool_call, content)
+            tool_messages.append({"role": "tool", "tool_call_id": tool_call["id"], "content": content})
+
+        return tool_messages
+
+    def log_tool_call(self, tool_call, content):
+        function = tool_call["function"]
+        print(f"[TOOL_CALL] Tool Call => {function['name']}({function['arguments']}) ResultChars => {len(content)}" , flush=True)
+        if LOG_PAYLOADS:
+            print(f"[TOOL_CALL] Result => {content}" , flush=True)
+
+    def stream_response(self, response_stream):
+        """ Yield content deltas from a streaming completion and store the final text in history. """
+        collected_text = ""
+        with self.trace.span("llm.answer"):
+            try:
                 for chunk in response_stream:
+                    self.record_usage(getattr(chunk, "usage", None))  # only set on the final chunk
                     if hasattr(chunk, "choices") and chunk.choices:
                         delta = chunk.choices[0].delta
                         if hasattr(delta, "content") and delta.content:
                             collected_text += delta.content
                             yield delta.content  # Yield progressively
-                self.add_message(role="assistant", content=collected_text)
+            finally:
+                response_stream.close()
+        self.add_message(role="assistant", content=collected_text)
 
-            return stream_response()
+    def answer_with_tools(self, tool_calls, content=""):
+        """ Run all tool calls, inject their results and stream the final tool-free answer. """
+        tool_messages = self.run_tool_calls(tool_calls)
+        self.messages.append({"role": "assistant", "content": content or None, "tool_calls": tool_calls})
+        self.messages.extend(tool_messages)
 
-        # Step 4: If no function is required, just return streaming response
-        if stream:
-            response_stream = self.get_inference(stream=True)
-            def stream_response():
-                collected_text = ""
+        try:
+            response_stream = self.get_inference(is_tool=False, stream=True, priority=FOLLOW_UP)
+            yield from self.stream_response(response_stream)
+        finally:
+            self.expire_tool_results(tool_messages)
+
+        if CLINIC_PREFETCH and any(tool_call["function"]["name"] == "fetch_medical_info" for tool_call in tool_calls):
+            self.prefetch_clinics(self.messages[-1]["content"])
+
+    def prefetch_clinics(self, answer):
+        """ Warm the clinic lookup for the conditions of a diagnosis answer on a background worker. """
+        if not (self.user_location.get("city") or self.user_location.get("loc")):
+            return
+        for condition in candidate_conditions(answer):
+            if CLINIC_PREFETCHER.submit(self.nearby_clinic_key(condition), self.prefetch_clinic, condition, self.trace):
+                print(f"[PREFETCH] Clinics for => {condition}" , flush=True)
+
+    def prefetch_worker(self, condition, parent):
+        """
+            Copy of the bot for a background clinic lookup, with its own trace linked to the turn
+            `parent` that started it: `self.trace` is replaced by the next turn, and the parent is
+            usually exported before the lookup ends.
+        """
+        worker = copy.copy(self)
+        worker.trace = TRACER.start(
+            "prefetch", route="prefetch", lang=self.lang, condition=condition, parent=getattr(parent, "trace_id", None)
+        )
+        return worker
+
+    def prefetch_clinic(self, condition, parent):
+        worker = self.prefetch_worker(condition, parent)
+        status = "ok"
+        try:
+            worker.search_nearby_clinic(condition)
+        except Exception:
+            status = "error"
+            raise
+        finally:
+            worker.trace.finish(status=status)
+
+    @staticmethod
+    def merge_tool_call_deltas(tool_calls, delta):
+        """ Accumulate streamed tool call fragments into `tool_calls` keyed by their index. """
+        for tool_delta in getattr(delta, "tool_calls", None) or []:
+            tool_call = tool_calls.setdefault(
+                tool_delta.index,
+                {"id": None, "type": "function", "function": {"name": "", "arguments": ""}}
+            )
+            if tool_delta.id:
+                tool_call["id"] = tool_delta.id
+            if tool_delta.function:
+                tool_call["function"]["name"] += tool_delta.function.name or ""
+                tool_call["function"]["arguments"] += tool_delta.function.arguments or ""
+
+    def stream_turn(self, route=None):
+        """
+            Single streaming request with tools enabled.
+            Content deltas are forwarded as they arrive while tool call deltas are assembled by index;
+            the tool path is taken only if the stream actually carried tool_calls.
+        """
+        response_stream = self.get_inference(stream=True)
+        collected_text = ""
+        tool_calls = {}
+        with self.trace.span("llm.decision") as span:
+            try:
                 for chunk in response_stream:
-                    if hasattr(chunk, "choices") and chunk.choices:
-                        delta = chunk.choices[0].delta
-                        if hasattr(delta, "content") and delta.content:
-                            collected_text += delta.content
-                            yield delta.content  # Yield progressively
-                self.add_message(role="assistant", content=collected_text)
+                    self.record_usage(getattr(chunk, "usage", None))  # only set on the final chunk
+                    if not (hasattr(chunk, "choices") and chunk.choices):
+                        continue
+                    delta = chunk.choices[0].delta
+                    if getattr(delta, "content", None):
+                        collected_text += delta.content
+                        yield delta.content
+
+                    self.merge_tool_call_deltas(tool_calls, delta)
+            finally:
+                # Also runs when the consumer stops early (Streamlit rerun, disconnect): end the upstream stream
+                response_stream.close()
+            span.set(tool_calls=len(tool_calls))
+
+        if route:
+            INTENT_ROUTER.record_outcome(route, [tool_call["function"]["name"] for tool_call in tool_calls.values()])
+        if not tool_calls:
+            self.add_message(role="assistant", content=collected_text)
+            return
+
+        tool_calls = [tool_calls[index] for index in sorted(tool_calls)]
+        yield from self.answer_with_tools(tool_calls, content=collected_text)
+
+    def compact_history(self):
+        """ Fold the oldest turns into the running clinical summary once the prompt goes over budget. """
+        folded, kept = self.context.split(self.messages)
+        if not folded:
+            return
+
+        try:
+            with self.trace.span("context.summary", folded=len(folded)):
+                response = self.open_completion(dict(
+                    model=self.model,
+                    messages=self.context.summary_request(folded),
+                    temperature=0,
+                    max_tokens=self.context.summary_max_tokens
+                ))
+            self.record_usage(response.usage)
+            self.context.summary = response.choices[0].message.content.strip()
+        except Exception as e:
+            print(f"[CONTEXT] Summary failed => {e}" , flush=True)
+            self.context.summary = self.context.fallback_summary(folded)
 
-            return stream_response()
+        self.messages = self.messages[:1] + kept
+        self.persist_fold(folded)
+        print(f"[CONTEXT] Folded {len(folded)} messages into summary, keeping {len(kept)}" , flush=True)
 
+    def is_first_turn(self):
+        """
+            True while answering the opening message of a consultation. Checked after
+            `compact_history`, so `[system, user]` with a summary is a later turn whose earlier
+            history was folded, and must not be shared through the answer cache.
+        """
+        return len(self.messages) == 2 and not self.context.summary
+
+    def last_answer(self):
+        """ Content of the latest assistant reply, if any. """
+        for message in reversed(self.messages):
+            if message["role"] == "assistant" and message.get("content") and not message.get("tool_calls"):
+                return message["content"]
+        return None
+
+    def stream_small_talk(self):
+        """ Tool-free streaming completion for turns the intent router marked as small talk. """
+        yield from self.stream_response(self.get_inference(is_tool=False, stream=True))
+
+    def clinic_tool_call(self, user_message, previous_answer):
+        """ fetch_nearby_clinic call for a routed clinic turn: first condition of the previous answer, else the message. """
+        conditions = candidate_conditions(previous_answer or "", limit=1)
+        return {
+            "id": f"call_{uuid.uuid4().hex[:24]}",
+            "type": "function",
+            "function": {
+                "name": "fetch_nearby_clinic",
+                "arguments": json.dumps({"disease": conditions[0] if conditions else user_message}, ensure_ascii=False),
+            },
+        }
+
+    def stream_clinic_turn(self, user_message, previous_answer):
+        """
+            Turn the intent router marked as a clinic request: the lookup starts right away and the
+            tool-free answer streams once it is back, without the tool decision request first.
+        """
+        yield from self.answer_with_tools([self.clinic_tool_call(user_message, previous_answer)])
+
+    def answer_used_clinics(self, start):
+        """ True if any tool call since `messages[start]` looked up clinics, i.e. the answer depends on location. """
+        return any(
+            tool_call["function"]["name"] == "fetch_nearby_clinic"
+            for message in self.messages[start:] for tool_call in message.get("tool_calls") or []
+        )
+
+    def stream_first_turn(self, user_message, route=None):
+        """ First turn through the semantic answer cache: replay a cached answer or cache the new one. """
+        cached = ANSWER_CACHE_STORE.get(self.lang, user_message)
+        if cached is not None:
+            print(f"[ANSWER_CACHE] Hit => {user_message}" , flush=True)
+            yield from stream_text(cached)
+            self.add_message(role="assistant", content=cached)
+            return
+
+        yield from self.stream_turn(route)
+        if not self.answer_used_clinics(start=2):
+            ANSWER_CACHE_STORE.set(self.lang, user_message, self.messages[-1]["content"])
+
+    def start_trace(self):
+        self.trace = TRACER.start("turn", lang=self.lang, messages=len(self.messages) + 1)
+        return self.trace
+
+    def traced_stream(self, trace, route, tokens):
+        """
+            Pass tokens through, recording time to first token (also per route for the router
+            stats), chunk count and outcome of the turn, then finish its trace.
+        """
+        started = time.perf_counter()
+        chunks = 0
+        status = "ok"
+        try:
+            for token in tokens:
+                if not chunks:
+                    trace.mark("first_token")
+                    if route:
+                        INTENT_ROUTER.record_first_token(route, time.perf_counter() - started)
+                chunks += 1
+                yield token
+        except GeneratorExit:
+            status = "cancelled"
+            raise
+        except Exception:
+            status = "error"
+            raise
+        finally:
+            tokens.close()  # inner spans end before the trace does
+            trace.finish(chunks=chunks, status=status)
+
+    def chat(self, user_message, stream=False):
+        """ Process user input and generate an AI response with optional streaming. """
+        trace = self.start_trace()
+        previous_answer = self.last_answer()
+        self.add_message(role="user", content=user_message)
+        self.compact_history()
+        self.persist()
+
+        # Streaming: one tool-enabled request, tool path only when the stream carries tool_calls
+        if stream:
+            route = INTENT_ROUTER.route(user_message, previous_assistant=previous_answer) if INTENT_ROUTING else None
+            trace.set(route=route)
+            if route:
+                print(f"[ROUTER] Route => {route}" , flush=True)
+
+            if route == SMALL_TALK:
+                turn = self.stream_small_talk()
+            elif route == CLINIC:
+                turn = self.stream_clinic_turn(user_message, previous_answer)
+            elif ANSWER_CACHE and self.is_first_turn():
+                turn = self.stream_first_turn(user_message, route)
+            else:
+                turn = self.stream_turn(route)
+            return self.persisted(self.traced_stream(trace, route, turn))
+
+        # Non streaming: check if a function needs to be called
+        try:
+            response = self.get_inference(stream=False)
+        except Exception:
+            trace.finish(status="error")
+            raise
+        output = response.choices[0].message
+
+        if hasattr(output, "tool_calls") and output.tool_calls:
+            tool_calls = [
+                {
+                    "id": tool_call.id,
+                    "type": "function",
+                    "function": {"name": tool_call.function.name, "arguments": tool_call.function.arguments},
+                }
+                for tool_call in output.tool_calls
+            ]
+            return self.persisted(self.traced_stream(trace, None, self.answer_with_tools(tool_calls, content=output.content or "")))
+
+        self.add_message(role="assistant", content=output.content or "")
+        self.persist()
+        trace.finish(status="ok")
         return {"response": output.content}  # Fallback for non-streaming
 
     def __str__(self):
@@ -240,6 +797,322 @@ class TeleMedicBot:
         print(doc_string , flush=True)
         return doc_string
 
+
+class AsyncTeleMedicBot(TeleMedicBot):
+    """
+        asyncio version of TeleMedicBot built on the pooled AsyncOpenAI / async Tavily clients.
+        Same prompts, tools and history semantics as `TeleMedicBot.chat`; network waits
+        don't hold a thread, so one process can carry many concurrent consultations.
+
+            async for token in bot.chat("I have a headache"):
+                ...
+
+        Cancelling the consuming task (or calling `aclose()` on the stream when the client
+        disconnects) closes the upstream completion and cancels pending tool calls.
+    """
+
+    def create_clients(self):
+        return get_client("async_openai"), get_client("async_tavily")
+
+    async def web_search_tool(self, query , reuturn_urls = False, tool="web_search", cache_key=None):
+        cache_key = cache_key or normalize_text(query)
+        with self.trace.span("cache.lookup", tool=tool) as span:
+            result = self.search_cache.get(tool, cache_key)
+            span.set(outcome="miss" if result is None else "hit")
+        if result is not None:
+            print(f"[WEB_SEARCH] Cache Hit => {query}" , flush=True)
+            return result
+
+        return await ASYNC_SEARCH_FLIGHT.do(
+            (tool, cache_key), self.search_and_cache, query, reuturn_urls, tool, cache_key
+        )
+
+    async def search_and_cache(self, query, reuturn_urls, tool, cache_key):
+        with self.trace.span("search", tool=tool) as span:
+            try:
+                response = await SEARCH_HEDGER.run_async(lambda: self.tavily_client.search(query), trace=self.trace)
+            except DeadlineExceeded:
+                span.set(outcome="deadline")
+                print(f"[WEB_SEARCH] Deadline exceeded => {query}" , flush=True)
+                return {"error": SEARCH_UNAVAILABLE}
+        result = self.parse_search_response(query, response, reuturn_urls=reuturn_urls)
+        if isinstance(result, list):
+            self.search_cache.set(tool, cache_key, result)
+        return result
+
+    async def fetch_medical_info(self, symptoms):
+        query = self.medical_info_query(symptoms)
+        if MEDICAL_INFO_BACKEND in ("local", "local-first"):
+            response = self.local_medical_info(query)
+            if response or MEDICAL_INFO_BACKEND == "local":
+                return response or {"error": "No relevant information found."}
+
+        return await self.web_search_tool(
+            query=query, tool="fetch_medical_info", cache_key=normalize_symptoms(symptoms)
+        )
+
+    async def fetch_nearby_clinic(self, disease):
+        CLINIC_PREFETCHER.record_lookup(self.nearby_clinic_key(disease))
+        return await self.search_nearby_clinic(disease)
+
+    async def search_nearby_clinic(self, disease):
+        response = self.local_nearby_clinics(disease)
+        if len(response) >= CLINIC_MIN_RESULTS:
+            return response
+
+        return await self.web_search_tool(
+            query=self.nearby_clinic_query(disease), reuturn_urls=True,
+            tool="fetch_nearby_clinic", cache_key=self.nearby_clinic_key(disease)
+        )
+
+    def hedge_client(self):
+        return get_client("async_openai_fallback") if OPENAI_FALLBACK_BASE_URL else self.client
+
+    async def open_completion(self, request, priority=ONGOING):
+        stream = request.get("stream")
+        cost = estimate_cost(request["messages"], request.get("tools"), request.get("max_tokens"))
+
+        async def attempt(client, model):
+            response = await client.chat.completions.create(**{**request, "model": model})
+            return await apeek_stream(response) if stream else response
+
+        async def send():
+            return await (FIRST_TOKEN_HEDGER if stream else RESPONSE_HEDGER).run_async(
+                lambda: attempt(self.client, request["model"]),
+                lambda: attempt(self.hedge_client(), HEDGE_FALLBACK_MODEL or request["model"]),
+                cleanup=aclose_stream if stream else None, trace=self.trace,
+                admit=(lambda: SCHEDULER.try_admit(cost)) if LLM_SCHEDULER else None,
+            )
+
+        if not LLM_SCHEDULER:
+            return await send()
+        return await SCHEDULER.call_async(send, cost=cost, priority=priority, trace=self.trace)
+
+    async def get_inference(self, is_tool=True, stream=False, priority=None):
+        priority = self.turn_priority() if priority is None else priority
+        messages = self.context.prompt(self.messages)
+        with self.trace.span("llm.request", stream=stream, tools=is_tool, messages=len(messages)):
+            response = await self.open_completion(dict(
+                model=self.model,
+                messages=messages,
+                tools=self.tools if is_tool else None,
+                tool_choice="auto" if is_tool else None,
+                temperature=self.temprature,
+                max_tokens=self.max_tokens,
+                stream=stream,
+                stream_options={"include_usage": True} if stream else None
+            ), priority)
+        if not stream:
+            self.record_usage(response.usage)
+        return response
+
+    async def run_tool_call(self, name, arguments):
+        parsed = json.loads(arguments or "{}")
+        if name == "fetch_medical_info":
+            with self.trace.span("tool.fetch_medical_info"):
+                return self.format_tool_result(name, arguments, parsed["symptoms"], await self.fetch_medical_info(parsed["symptoms"]))
+
+        if name == "fetch_nearby_clinic" :
+            with self.trace.span("tool.fetch_nearby_clinic"):
+                return self.format_tool_result(name, arguments, parsed["disease"], await self.fetch_nearby_clinic(parsed["disease"]))
+
+        error = json.dumps({"error": f"Unknown tool {name}"})
+        return error, error
+
+    async def run_tool_calls(self, tool_calls, timeout=None):
+        timeout = TOOL_TIMEOUT if timeout is None else timeout
+
+        async def run(tool_call):
+            try:
+                content, self.tool_digests[tool_call["id"]] = await asyncio.wait_for(
+                    self.run_tool_call(tool_call["function"]["name"], tool_call["function"]["arguments"]),
+                    timeout=timeout
+                )
+            except asyncio.TimeoutError:
+                content = json.dumps({"error": f"{tool_call['function']['name']} timed out."})
+            except Exception as e:
+                content = json.dumps({"error": str(e)})
+
+            self.log_tool_call(tool_call, content)
+            return {"role": "tool", "tool_call_id": tool_call["id"], "content": content}
+
+        return list(await asyncio.gather(*(run(tool_call) for tool_call in tool_calls)))
+
+    async def stream_response(self, response_stream):
+        collected_text = ""
+        with self.trace.span("llm.answer"):
+            try:
+                async for chunk in response_stream:
+                    self.record_usage(getattr(chunk, "usage", None))  # only set on the final chunk
+                    if hasattr(chunk, "choices") and chunk.choices:
+                        delta = chunk.choices[0].delta
+                        if hasattr(delta, "content") and delta.content:
+                            collected_text += delta.content
+                            yield delta.content
+            finally:
+                # Also runs on disconnect: stop the upstream generation and keep what was said
+                await response_stream.close()
+                self.add_message(role="assistant", content=collected_text)
+
+    async def answer_with_tools(self, tool_calls, content=""):
+        # History is only touched once every tool finished, so a cancelled turn never
+        # leaves an assistant tool_calls message without its tool responses.
+        tool_messages = await self.run_tool_calls(tool_calls)
+        self.messages.append({"role": "assistant", "content": content or None, "tool_calls": tool_calls})
+        self.messages.extend(tool_messages)
+
+        try:
+            response_stream = await self.get_inference(is_tool=False, stream=True, priority=FOLLOW_UP)
+            async with aclosing(self.stream_response(response_stream)) as tokens:
+                async for token in tokens:
+                    yield token
+        finally:
+            self.expire_tool_results(tool_messages)
+
+        if CLINIC_PREFETCH and any(tool_call["function"]["name"] == "fetch_medical_info" for tool_call in tool_calls):
+            self.prefetch_clinics(self.messages[-1]["content"])
+
+    def prefetch_clinics(self, answer):
+        if not (self.user_location.get("city") or self.user_location.get("loc")):
+            return
+        for condition in candidate_conditions(answer):
+            if CLINIC_PREFETCHER.acquire(self.nearby_clinic_key(condition)):
+                print(f"[PREFETCH] Clinics for => {condition}" , flush=True)
+                CLINIC_PREFETCHER.track(asyncio.ensure_future(self.prefetch_clinic(condition, self.trace)))
+
+    async def prefetch_clinic(self, condition, parent):
+        worker = self.prefetch_worker(condition, parent)
+        status = "ok"
+        try:
+            await worker.search_nearby_clinic(condition)
+        except Exception as e:
+            status = "error"
+            print(f"[PREFETCH] Failed for {condition} => {e}" , flush=True)
+        finally:
+            CLINIC_PREFETCHER.release()
+            worker.trace.finish(status=status)
+
+    async def stream_turn(self, route=None):
+        response_stream = await self.get_inference(stream=True)
+        collected_text = ""
+        tool_calls = {}
+        with self.trace.span("llm.decision") as span:
+            try:
+                async for chunk in response_stream:
+                    self.record_usage(getattr(chunk, "usage", None))  # only set on the final chunk
+                    if not (hasattr(chunk, "choices") and chunk.choices):
+                        continue
+                    delta = chunk.choices[0].delta
+                    if getattr(delta, "content", None):
+                        collected_text += delta.content
+                        yield delta.content
+
+                    self.merge_tool_call_deltas(tool_calls, delta)
+            finally:
+                await response_stream.close()
+                if not tool_calls:
+                    self.add_message(role="assistant", content=collected_text)
+            span.set(tool_calls=len(tool_calls))
+
+        if route:
+            INTENT_ROUTER.record_outcome(route, [tool_call["function"]["name"] for tool_call in tool_calls.values()])
+
+        if tool_calls:
+            tool_calls = [tool_calls[index] for index in sorted(tool_calls)]
+            async with aclosing(self.answer_with_tools(tool_calls, content=collected_text)) as tokens:
+                async for token in tokens:
+                    yield token
+
+    async def compact_history(self):
+        folded, kept = self.context.split(self.messages)
+        if not folded:
+            return
+
+        try:
+            with self.trace.span("context.summary", folded=len(folded)):
+                response = await self.open_completion(dict(
+                    model=self.model,
+                    messages=self.context.summary_request(folded),
+                    temperature=0,
+                    max_tokens=self.context.summary_max_tokens
+                ))
+            self.record_usage(response.usage)
+            self.context.summary = response.choices[0].message.content.strip()
+        except Exception as e:
+            print(f"[CONTEXT] Summary failed => {e}" , flush=True)
+            self.context.summary = self.context.fallback_summary(folded)
+
+        self.messages = self.messages[:1] + kept
+        self.persist_fold(folded)
+        print(f"[CONTEXT] Folded {len(folded)} messages into summary, keeping {len(kept)}" , flush=True)
+
+    async def stream_small_talk(self):
+        response_stream = await self.get_inference(is_tool=False, stream=True)
+        async with aclosing(self.stream_response(response_stream)) as tokens:
+            async for token in tokens:
+                yield token
+
+    async def stream_clinic_turn(self, user_message, previous_answer):
+        async with aclosing(self.answer_with_tools([self.clinic_tool_call(user_message, previous_answer)])) as tokens:
+            async for token in tokens:
+                yield token
+
+    async def stream_first_turn(self, user_message, route=None):
+        cached = ANSWER_CACHE_STORE.get(self.lang, user_message)
+        if cached is not None:
+            print(f"[ANSWER_CACHE] Hit => {user_message}" , flush=True)
+            for chunk in stream_text(cached):
+                yield chunk
+            self.add_message(role="assistant", content=cached)
+            return
+
+        async with aclosing(self.stream_turn(route)) as tokens:
+            async for token in tokens:
+                yield token
+        if not self.answer_used_clinics(start=2):
+            ANSWER_CACHE_STORE.set(self.lang, user_message, self.messages[-1]["content"])
+
+    async def chat(self, user_message):
+        """ Process user input and stream the AI response as an async generator. """
+        trace = self.start_trace()
+        previous_answer = self.last_answer()
+        self.add_message(role="user", content=user_message)
+        await self.compact_history()
+        self.persist()
+
+        route = INTENT_ROUTER.route(user_message, previous_assistant=previous_answer) if INTENT_ROUTING else None
+        trace.set(route=route)
+        if route == SMALL_TALK:
+            turn = self.stream_small_talk()
+        elif route == CLINIC:
+            turn = self.stream_clinic_turn(user_message, previous_answer)
+        elif ANSWER_CACHE and self.is_first_turn():
+            turn = self.stream_first_turn(user_message, route)
+        else:
+            turn = self.stream_turn(route)
+
+        started = time.perf_counter()
+        chunks = 0
+        status = "ok"
+        try:
+            async with aclosing(turn) as tokens:
+                async for token in tokens:
+                    if not chunks:
+                        trace.mark("first_token")
+                        if route:
+                            INTENT_ROUTER.record_first_token(route, time.perf_counter() - started)
+                    chunks += 1
+                    yield token
+        except (GeneratorExit, asyncio.CancelledError):
+            status = "cancelled"
+            raise
+        except Exception:
+            status = "error"
+            raise
+        finally:
+            trace.finish(chunks=chunks, status=status)
+            self.persist()
+
 if __name__ == "__main__":
     bot = TeleMedicBot()
     while True:
@@ -1,6 +1,24 @@
-import requests
+import os
+import time
+import secrets
 import streamlit as st
+from streamlit_js_eval import streamlit_js_eval
 from bot import TeleMedicBot
+from geolocation import lookup_async, GEO_TIMEOUT
+from session_store import open_store
+from tracing import TRACER, serve_metrics
+
+# Streamed tokens are rendered at most every STREAM_RENDER_INTERVAL seconds, or sooner once
+# STREAM_RENDER_CHARS characters are pending. STREAM_RENDER_INTERVAL=0 renders every token.
+STREAM_RENDER_INTERVAL = float(os.getenv("STREAM_RENDER_INTERVAL", "0.05"))
+STREAM_RENDER_CHARS = int(os.getenv("STREAM_RENDER_CHARS", "400"))
+# Only the most recent CHAT_HISTORY_WINDOW messages are rendered, "load earlier" pages further back
+CHAT_HISTORY_WINDOW = int(os.getenv("CHAT_HISTORY_WINDOW", "20"))
+# Cookie holding the resumable session id (never the URL: it would leak through history, referrers and logs)
+SESSION_COOKIE = "telemedic_session"
+SESSION_COOKIE_MAX_AGE = int(os.getenv("SESSION_COOKIE_MAX_AGE", str(7 * 24 * 3600)))
+
+serve_metrics()  # no-op unless TRACE_METRICS_PORT is set
 
 # Define translations
 translations = {
@@ -10,6 +28,7 @@ translations = {
         "ask_placeholder": "Ask Something...",
         "typing_message": "Type your message...",
         "processing": "Processing...",
+        "load_earlier": "Load earlier messages",
     },
     "es": {
         "title": "AI Tele-Médico",
@@ -17,49 +36,138 @@ translations = {
         "ask_placeholder": "Pregunta algo...",
         "typing_message": "Escribe tu mensaje...",
         "processing": "Procesando...",
+        "load_earlier": "Cargar mensajes anteriores",
     }
 }
 
+def chat_bubble(role, message):
+    """ HTML fragment of one chat message, styled by the shared .chat-bubble classes. """
+    return f"<div class='chat-bubble {role}'>{message}</div>"
+
+def add_chat_message(role, message):
+    """ Appends to the chat history, rendering the message's HTML fragment once. """
+    st.session_state.chat_history.append({"role": role, "message": message, "html": chat_bubble(role, message)})
+
+def remember_session(session_id):
+    """ Store the session id in a first party cookie, SameSite=Strict so no other site sends it. """
+    streamlit_js_eval(
+        js_expressions=(
+            f"document.cookie = '{SESSION_COOKIE}={session_id}; path=/; max-age={SESSION_COOKIE_MAX_AGE}; SameSite=Strict'"
+            " + (location.protocol === 'https:' ? '; Secure' : '')"
+        ),
+        key=f"remember_session_{session_id}",
+    )
+
+def restore_session(store):
+    """
+        Bot and chat history for the session in the session cookie, so a reload or another app
+        worker carries on with the same consultation. Starts a new session otherwise.
+
+        The id gives access to a patient's consultation, so it is random (256 bits) and kept in
+        a cookie, never in the URL where browser history, referrers and proxy logs would keep it.
+    """
+    session_id = st.context.cookies.get(SESSION_COOKIE)
+    bot = TeleMedicBot.from_session(store, session_id) if session_id else None
+    if bot is None:
+        session_id = secrets.token_urlsafe(32)
+        bot = TeleMedicBot(lang="en", user_location=st.session_state.get("user_location", {}))
+        bot.attach_session(store, session_id)
+        remember_session(session_id)
+
+    st.session_state.TELEMEDIC_BOT = bot
+    st.session_state.language = bot.lang
+    st.session_state.chat_history = []
+    for message in bot.messages[1:]:
+        if message["role"] in ("user", "assistant") and message.get("content") and not message.get("tool_calls"):
+            add_chat_message("user" if message["role"] == "user" else "bot", message["content"])
+
 # Function to handle streaming responses
 def get_bot_response(user_input):
-    response_text = ""
-    
+    """
+        Yields the response text so far, batched: tokens are buffered in a list and the text is
+        only joined and handed to the UI when the interval elapsed or enough characters are pending,
+        instead of rebuilding and re-rendering the whole bubble on every token.
+    """
+    parts = []
+    pending = 0
+    last_render = time.monotonic()
+    started_cpu = time.process_time()
+    chunks = renders = 0
+    render_seconds = 0.0
+
     for chunk in st.session_state.TELEMEDIC_BOT.chat(user_input, stream=True):
-        response_text += chunk
-        yield response_text
+        parts.append(chunk)
+        pending += len(chunk)
+        chunks += 1
+        now = time.monotonic()
+        if now - last_render >= STREAM_RENDER_INTERVAL or pending >= STREAM_RENDER_CHARS:
+            renders += 1
+            yield "".join(parts)  # the caller renders while we are suspended here
+            render_seconds += time.monotonic() - now
+            pending = 0
+            last_render = time.monotonic()
+
+    renders += 1
+    now = time.monotonic()
+    yield "".join(parts)
+    render_seconds += time.monotonic() - now
+    cpu_seconds = time.process_time() - started_cpu
+    TRACER.observe("ui.render", render_seconds, chunks=chunks, renders=renders, cpu_seconds=round(cpu_seconds, 6))
+    print(
+        f"[RENDER] Chunks => {chunks} Renders => {renders} "
+        f"RenderTime => {render_seconds * 1000:.1f}ms CPU => {cpu_seconds * 1000:.1f}ms" , flush=True
+    )
 
 def get_user_location(client_ip):
+    """ Starts the geolocation lookup in the background and returns its Future. """
+    print(f"ClientIP = {client_ip}" , flush=True)
+    return lookup_async(client_ip)
+
+def resolve_user_location(wait=False):
+    """ Hand the resolved location to the session (and bot) once the lookup finished. """
+    future = st.session_state.get("user_location_future")
+    if future is None or "user_location" in st.session_state:
+        return
+    if not (wait or future.done()):
+        return
+
     try:
-        print(f"ClientIP = {client_ip}" , flush=True)
-        response = requests.get(f"https://ipinfo.io/{client_ip}/json")
-        data = response.json()
-        return { "status" : True , "data" : data}
-    except Exception as e:
-        return { "status" : False }
+        user_location = future.result(timeout=GEO_TIMEOUT)
+    except Exception:
+        user_location = { "status" : False }
+
+    st.session_state.user_location = user_location.get("data" , {}) if user_location.get("status") else {}
+    if "TELEMEDIC_BOT" in st.session_state:
+        st.session_state.TELEMEDIC_BOT.set_user_location(st.session_state.user_location)
 
 
 
 
 # Main Chat Screen
 def chat_screen(client_ip):
-    if "user_ip" not in st.session_state:
-        user_location = get_user_location(client_ip)
-        if user_location : 
-            ip = client_ip
-            user_location = user_location.get("data" , {})
-            st.session_state.user_ip = ip
-            st.session_state.user_location = user_location
+    # Location is resolved in the background, the screen renders without waiting for it
+    if "user_ip" not in st.session_state and client_ip:
+        st.session_state.user_ip = client_ip
+        st.session_state.user_location_future = get_user_location(client_ip)
+    resolve_user_location()
+
 
+    store = open_store()
+    if "TELEMEDIC_BOT" not in st.session_state and store is not None:
+        restore_session(store)
 
     if "TELEMEDIC_BOT" not in st.session_state:
         st.session_state.TELEMEDIC_BOT = TeleMedicBot(
-            lang="en" , user_location=st.session_state.user_location
+            lang="en" , user_location=st.session_state.get("user_location", {})
             )
 
     # Initialize chat history
     if "chat_history" not in st.session_state:
         st.session_state.chat_history = []
 
+    if "history_window" not in st.session_state:
+        st.session_state.history_window = CHAT_HISTORY_WINDOW
+
     if "waiting_for_response" not in st.session_state:
         st.session_state.waiting_for_response = False
 
@@ -74,12 +182,9 @@ def chat_screen(client_ip):
     # Get translated text
     t = translations[lang]
 
-    # Update bot language if changed
+    # Update bot language if changed, the conversation carries on in the new language
     if st.session_state.TELEMEDIC_BOT.lang != lang:
-        st.session_state.TELEMEDIC_BOT = TeleMedicBot(
-            lang=lang, user_location=st.session_state.user_location
-            )
-        st.session_state.chat_history = []
+        st.session_state.TELEMEDIC_BOT.set_language(lang)
 
 
     st.title(t["title"])
@@ -103,6 +208,25 @@ def chat_screen(client_ip):
             padding-right: 40px !important; /* Space for send button */
             resize: none !important;
         }
+        .chat-bubble {
+            padding: 10px;
+            border-radius: 10px;
+            margin: 5px;
+            width: fit-content;
+            max-width: 70%;
+            word-wrap: break-word;
+            overflow-wrap: break-word;
+        }
+        .chat-bubble.user {
+            text-align: right;
+            background-color: #dcf8c6;
+            margin-left: auto;
+        }
+        .chat-bubble.bot {
+            text-align: left;
+            background-color: #e8e8e8;
+            margin-right: auto;
+        }
         .send-button {
             position: absolute;
             right: 3px;
@@ -144,7 +268,7 @@ def chat_screen(client_ip):
 
 
         if user_input and user_input.strip():
-            st.session_state.chat_history.append({"role": "user", "message": user_input})
+            add_chat_message("user", user_input)
             st.session_state.waiting_for_response = True
             st.rerun()
     else:
@@ -155,33 +279,33 @@ def chat_screen(client_ip):
     if st.session_state.chat_history:
         chat_placeholder = st.container()
         with chat_placeholder:
-            for chat in st.session_state.chat_history:
-                if chat["role"] == "user":
-                    st.markdown(f"<div style='text-align: right; background-color: #dcf8c6; padding: 10px; border-radius: 10px; margin: 5px; width: fit-content; max-width: 70%; margin-left: auto; word-wrap: break-word; overflow-wrap: break-word;'>"
-                                f"{chat['message']}</div>", unsafe_allow_html=True)
-                else:
-                    st.markdown(f"<div style='text-align: left; background-color: #e8e8e8; padding: 10px; border-radius: 10px; margin: 5px; width: fit-content; max-width: 70%; margin-right: auto; word-wrap: break-word; overflow-wrap: break-word;'>"
-                                f"{chat['message']}</div>", unsafe_allow_html=True)
+            history = st.session_state.chat_history
+            if len(history) > st.session_state.history_window:
+                if st.button(t["load_earlier"]):
+                    st.session_state.history_window += CHAT_HISTORY_WINDOW
+            for chat in history[-st.session_state.history_window:]:
+                st.markdown(chat.get("html") or chat_bubble(chat["role"], chat["message"]), unsafe_allow_html=True)
 
     # **Show Processing Spinner if Waiting for Response**
     if st.session_state.waiting_for_response:
         with st.spinner(t["processing"]):
             last_message = st.session_state.chat_history[-1]
             if last_message["role"] == "user":
+                resolve_user_location(wait=True)
                 with st.empty():
                     bot_response = ""
                     for chunk in get_bot_response(last_message["message"]):
                         bot_response = chunk
-                        st.markdown(f"<div style='text-align: left; background-color: #e8e8e8; padding: 10px; border-radius: 10px; margin: 5px; width: fit-content; max-width: 70%; margin-right: auto; word-wrap: break-word; overflow-wrap: break-word;'>"
-                                    f"{bot_response}</div>", unsafe_allow_html=True)
+                        st.markdown(chat_bubble("bot", bot_response), unsafe_allow_html=True)
 
                 # Append final bot response to chat history
-                st.session_state.chat_history.append({"role": "bot", "message": bot_response})
+                add_chat_message("bot", bot_response)
                 st.session_state.waiting_for_response = False
                 st.rerun()
 
     # **Handle chat input submission after first message**
     if user_input and user_input.strip():
-        st.session_state.chat_history.append({"role": "user", "message": user_input})
+        add_chat_message("user", user_input)
+        st.session_state.history_window = CHAT_HISTORY_WINDOW
         st.session_state.waiting_for_response = True
         st.rerun()
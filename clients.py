@@ -0,0 +1,171 @@
+import os
+import json
+import threading
+import importlib.util
+
+import httpx
+from openai import OpenAI, AsyncOpenAI
+from dotenv import load_dotenv
+from tavily.errors import UsageLimitExceededError, InvalidAPIKeyError, MissingAPIKeyError
+
+from scheduler import LLM_SCHEDULER
+
+load_dotenv()
+
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+TRAVILY_API_KEY = os.getenv("TRAVILY_API_KEY")
+TAVILY_BASE_URL = os.getenv("TAVILY_BASE_URL", "https://api.tavily.com")
+# Optional second OpenAI compatible backend for hedged completions (see hedging.py)
+OPENAI_FALLBACK_BASE_URL = os.getenv("OPENAI_FALLBACK_BASE_URL")
+OPENAI_FALLBACK_API_KEY = os.getenv("OPENAI_FALLBACK_API_KEY", OPENAI_API_KEY)
+
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "60"))
+# HTTP/2 needs the optional `h2` package (pip install httpx[http2])
+HTTP2 = os.getenv("HTTP2", "true").lower() == "true" and importlib.util.find_spec("h2") is not None
+# The LLM scheduler retries with jitter itself, SDK retries on top would multiply the attempts
+OPENAI_MAX_RETRIES = 0 if LLM_SCHEDULER else 2
+
+
+def http_options():
+    """ Connection pool settings shared by every pooled client. """
+    return dict(
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(HTTP_TIMEOUT, connect=10.0),
+        http2=HTTP2,
+    )
+
+
+def _tavily_request(query, search_depth="basic", topic="general", days=3, max_results=5, **kwargs):
+    # Same payload as TavilyClient.search
+    data = {
+        "query": query,
+        "search_depth": search_depth,
+        "topic": topic,
+        "days": days,
+        "max_results": max_results,
+        "include_answer": False,
+        "include_raw_content": False,
+        "include_images": False,
+    }
+    data.update(kwargs)
+    return json.dumps(data)
+
+
+def _tavily_response(response):
+    if response.status_code == 200:
+        return response.json()
+    if response.status_code == 429:
+        try:
+            detail = response.json()["detail"]["error"]
+        except Exception:
+            detail = "Too many requests."
+        raise UsageLimitExceededError(detail)
+    if response.status_code == 401:
+        raise InvalidAPIKeyError()
+    response.raise_for_status()
+
+
+class PooledTavilyClient:
+    """
+        Drop in for `TavilyClient.search` that keeps a pooled keep-alive connection to Tavily
+        instead of opening a new one (and a new TLS handshake) on every search.
+    """
+
+    def __init__(self, api_key=TRAVILY_API_KEY, http_client=None):
+        if not api_key:
+            raise MissingAPIKeyError()
+        self.http_client = http_client or httpx.Client(
+            base_url=TAVILY_BASE_URL, headers={"Authorization": f"Bearer {api_key}"}, **http_options()
+        )
+
+    def search(self, query, **kwargs):
+        response = self.http_client.post(
+            "/search", content=_tavily_request(query, **kwargs), headers={"Content-Type": "application/json"}
+        )
+        return _tavily_response(response)
+
+    def close(self):
+        self.http_client.close()
+
+
+class AsyncPooledTavilyClient(PooledTavilyClient):
+    """ asyncio flavour of PooledTavilyClient. """
+
+    def __init__(self, api_key=TRAVILY_API_KEY, http_client=None):
+        if not api_key:
+            raise MissingAPIKeyError()
+        self.http_client = http_client or httpx.AsyncClient(
+            base_url=TAVILY_BASE_URL, headers={"Authorization": f"Bearer {api_key}"}, **http_options()
+        )
+
+    async def search(self, query, **kwargs):
+        response = await self.http_client.post(
+            "/search", content=_tavily_request(query, **kwargs), headers={"Content-Type": "application/json"}
+        )
+        return _tavily_response(response)
+
+    async def close(self):
+        await self.http_client.aclose()
+
+
+_REGISTRY = {}
+_REGISTRY_LOCK = threading.Lock()
+
+_FACTORIES = {
+    "openai": lambda: OpenAI(api_key=OPENAI_API_KEY, max_retries=OPENAI_MAX_RETRIES, http_client=httpx.Client(**http_options())),
+    "tavily": lambda: PooledTavilyClient(),
+    # Async clients belong to the event loop that first uses them (one serving loop per process)
+    "async_openai": lambda: AsyncOpenAI(
+        api_key=OPENAI_API_KEY, max_retries=OPENAI_MAX_RETRIES, http_client=httpx.AsyncClient(**http_options())
+    ),
+    "async_tavily": lambda: AsyncPooledTavilyClient(),
+    "openai_fallback": lambda: OpenAI(
+        api_key=OPENAI_FALLBACK_API_KEY, base_url=OPENAI_FALLBACK_BASE_URL, max_retries=OPENAI_MAX_RETRIES,
+        http_client=httpx.Client(**http_options())
+    ),
+    "async_openai_fallback": lambda: AsyncOpenAI(
+        api_key=OPENAI_FALLBACK_API_KEY, base_url=OPENAI_FALLBACK_BASE_URL, max_retries=OPENAI_MAX_RETRIES,
+        http_client=httpx.AsyncClient(**http_options())
+    ),
+}
+
+
+def get_client(name):
+    """
+        Process wide client borrowed by every bot: "openai", "tavily", "async_openai", "async_tavily"
+        or the hedging backend "openai_fallback" / "async_openai_fallback".
+    """
+    client = _REGISTRY.get(name)
+    if client is None:
+        with _REGISTRY_LOCK:
+            client = _REGISTRY.get(name)
+            if client is None:
+                client = _REGISTRY[name] = _FACTORIES[name]()
+    return client
+
+
+def reset_clients():
+    """ Drop the pooled sync clients (e.g. after a fork), they are rebuilt on next use. """
+    with _REGISTRY_LOCK:
+        for name in ("openai", "tavily", "openai_fallback"):
+            client = _REGISTRY.pop(name, None)
+            if client is not None:
+                client.close()
+        for name in ("async_openai", "async_tavily", "async_openai_fallback"):
+            _REGISTRY.pop(name, None)
+
+
+async def aclose_clients():
+    """ Close the pooled async clients on server shutdown, they are rebuilt on next use. """
+    with _REGISTRY_LOCK:
+        clients = [_REGISTRY.pop(name, None) for name in ("async_openai", "async_tavily", "async_openai_fallback")]
+    for client in clients:
+        if client is not None:
+            await client.close()
@@ -0,0 +1,187 @@
+"""
+    Local clinic / doctor directory used by `fetch_nearby_clinic` before falling back to web search.
+
+    Providers are loaded from a CSV (or Parquet, when pandas is installed) with the columns
+    name, specialty, lat, lon, and optionally address, city, country, phone, url.
+    They are bucketed on a lat/lon grid per specialty, so the k nearest relevant providers
+    are found by scanning a few rings of cells around the user instead of the whole table.
+
+        python clinic_directory.py clinics.csv 31.52,74.35 "migraine"
+"""
+import os
+import re
+import sys
+import csv
+import math
+import heapq
+import threading
+from collections import defaultdict
+
+CELL_DEGREES = float(os.getenv("CLINIC_CELL_DEGREES", "0.1"))  # ~11 km
+MAX_DISTANCE_KM = float(os.getenv("CLINIC_MAX_DISTANCE_KM", "50"))
+EARTH_RADIUS_KM = 6371.0
+GENERAL_PRACTICE = "general practice"
+
+# Disease / symptom words (English and Spanish) to the specialty that treats them. Words match
+# whole words (a plural "s" / "es" is allowed), a trailing "*" matches any ending
+SPECIALTY_KEYWORDS = {
+    "cardiology": ("heart", "chest pain", "cardiac", "palpitation", "hypertension", "blood pressure", "corazón", "pecho", "presión"),
+    "dermatology": ("skin", "rash", "acne", "eczema", "psoriasis", "itch*", "piel", "sarpullido", "picazón"),
+    "neurology": ("migraine", "headache", "seizure", "epilepsy", "numbness", "stroke", "migraña", "cabeza", "convulsión"),
+    "gastroenterology": ("stomach", "abdominal", "heartburn", "diarrhea", "vomit*", "nausea", "reflux", "gastro*", "estómago", "diarrea", "vómito"),
+    "pulmonology": ("asthma", "breath*", "lung", "pneumonia", "bronchitis", "respir*", "pulmón", "pulmones", "asma", "neumonía"),
+    "ent": ("ear", "throat", "sinus", "tonsil*", "oído", "garganta", "sinusitis"),
+    "orthopedics": ("bone", "joint", "fracture", "back pain", "knee", "sprain", "hueso", "articulación", "espalda", "rodilla"),
+    "ophthalmology": ("eye", "vision", "conjunctivitis", "ojo", "visión"),
+    "psychiatry": ("anxiety", "depression", "insomnia", "panic", "ansiedad", "depresión", "insomnio"),
+    "gynecology": ("pregnan*", "menstrua*", "period", "embaraz*", "menstruación"),
+    "pediatrics": ("child*", "baby", "babies", "infant", "niño", "niña", "bebé"),
+    "endocrinology": ("diabetes", "thyroid", "tiroides"),
+    "urology": ("urinary", "kidney", "bladder", "urinaria", "riñón", "riñones"),
+}
+
+
+def _keyword_pattern(words):
+    alternatives = (
+        re.escape(word[:-1]) + r"\w*" if word.endswith("*") else re.escape(word) + "(?:e?s)?"
+        for word in words
+    )
+    return re.compile(r"\b(?:" + "|".join(alternatives) + r")\b")
+
+
+# Compiled once: substring matching made "ear" match "heart" and "eye" match "eyebrow"
+SPECIALTY_PATTERNS = {specialty: _keyword_pattern(words) for specialty, words in SPECIALTY_KEYWORDS.items()}
+
+
+def specialties_for(disease):
+    """ Specialties relevant to `disease`, general practice always included. """
+    text = str(disease or "").lower()
+    wanted = [specialty for specialty, pattern in SPECIALTY_PATTERNS.items() if pattern.search(text)]
+    return wanted + [GENERAL_PRACTICE]
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def parse_loc(loc):
+    """ ipinfo style "lat,lon" string to floats, None if missing or malformed. """
+    try:
+        lat, lon = (float(part) for part in str(loc).split(","))
+        return lat, lon
+    except (TypeError, ValueError):
+        return None
+
+
+def read_providers(path):
+    if path.endswith(".parquet"):
+        import pandas as pd  # optional, only needed for Parquet directories
+        rows = pd.read_parquet(path).to_dict("records")
+    else:
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            rows = list(csv.DictReader(f))
+
+    for row in rows:
+        try:
+            lat, lon = float(row["lat"]), float(row["lon"])
+        except (KeyError, TypeError, ValueError):
+            continue
+        specialty = str(row.get("specialty") or GENERAL_PRACTICE).strip().lower()
+        yield {**row, "lat": lat, "lon": lon, "specialty": specialty}
+
+
+class ClinicDirectory:
+    """ Providers bucketed on a lat/lon grid, one grid per specialty. """
+
+    def __init__(self, providers, cell_degrees=CELL_DEGREES):
+        self.cell_degrees = cell_degrees
+        self.providers = list(providers)
+        self.grids = defaultdict(lambda: defaultdict(list))
+        for i, provider in enumerate(self.providers):
+            self.grids[provider["specialty"]][self.cell(provider["lat"], provider["lon"])].append(i)
+
+    @classmethod
+    def load(cls, path):
+        return cls(read_providers(path))
+
+    def cell(self, lat, lon):
+        return math.floor(lat / self.cell_degrees), math.floor(lon / self.cell_degrees)
+
+    def _ring(self, center, radius):
+        row, col = center
+        if radius == 0:
+            yield center
+            return
+        for d in range(-radius, radius + 1):
+            yield row - radius, col + d
+            yield row + radius, col + d
+        for d in range(-radius + 1, radius):
+            yield row + d, col - radius
+            yield row + d, col + radius
+
+    def nearest(self, lat, lon, k=5, specialties=None, max_distance_km=MAX_DISTANCE_KM):
+        """ Up to `k` (distance_km, provider) pairs, nearest first, within `max_distance_km`. """
+        grids = [self.grids[s] for s in (specialties or list(self.grids)) if s in self.grids]
+        if not grids:
+            return []
+
+        center = self.cell(lat, lon)
+        # Narrowest cell side in km, so every ring past `radius` is at least this much further out
+        cell_km = self.cell_degrees * math.pi * EARTH_RADIUS_KM / 180 * max(math.cos(math.radians(abs(lat) + self.cell_degrees)), 0.01)
+        max_radius = int(max_distance_km / cell_km) + 1
+
+        best = []  # max-heap on distance via negation
+        for radius in range(max_radius + 1):
+            for cell in self._ring(center, radius):
+                for grid in grids:
+                    for i in grid.get(cell, ()):
+                        provider = self.providers[i]
+                        distance = haversine_km(lat, lon, provider["lat"], provider["lon"])
+                        if distance > max_distance_km:
+                            continue
+                        if len(best) < k:
+                            heapq.heappush(best, (-distance, i))
+                        elif distance < -best[0][0]:
+                            heapq.heapreplace(best, (-distance, i))
+            if len(best) == k and -best[0][0] <= radius * cell_km:
+                break
+
+        return [(-distance, self.providers[i]) for distance, i in sorted(best, reverse=True)]
+
+    def search(self, loc, disease, k=5):
+        """ Nearest relevant providers in the same shape `web_search_tool` returns with urls. """
+        point = parse_loc(loc)
+        if point is None:
+            return []
+
+        results = []
+        for distance, provider in self.nearest(*point, k=k, specialties=specialties_for(disease)):
+            details = ", ".join(
+                str(provider[key]) for key in ("address", "city", "country", "phone") if provider.get(key)
+            )
+            results.append({
+                "content": f"{provider.get('name')} ({provider['specialty']}) - {distance:.1f} km away. {details}".strip(),
+                "url": provider.get("url"),
+            })
+        return results
+
+
+_DIRECTORIES = {}
+_DIRECTORIES_LOCK = threading.Lock()
+
+
+def open_directory(path):
+    """ Process wide shared ClinicDirectory for `path`, None if it doesn't exist. """
+    with _DIRECTORIES_LOCK:
+        if path not in _DIRECTORIES:
+            _DIRECTORIES[path] = ClinicDirectory.load(path) if path and os.path.exists(path) else None
+        return _DIRECTORIES[path]
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4:
+        sys.exit("usage: python clinic_directory.py <clinics.csv> <lat,lon> <disease>")
+    for result in ClinicDirectory.load(sys.argv[1]).search(sys.argv[2], sys.argv[3]):
+        print(result["content"], result["url"] or "")
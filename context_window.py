@@ -0,0 +1,136 @@
+import os
+import json
+from functools import lru_cache
+
+try:
+    import tiktoken
+except ImportError:  # rough estimate below is good enough for budgeting
+    tiktoken = None
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "6000"))
+CONTEXT_SUMMARY_MAX_TOKENS = int(os.getenv("CONTEXT_SUMMARY_MAX_TOKENS", "300"))
+MESSAGE_OVERHEAD_TOKENS = 4
+SUMMARY_SOURCE_CHARS = 600
+
+SUMMARY_PROMPT = """
+    You maintain a running clinical summary of a tele medicine consultation.
+    Update the existing summary with the new conversation turns below. Keep it short and factual:
+    symptoms, duration, severity (1-10), what makes it better or worse, relevant history,
+    possible conditions already discussed and clinics / doctors already suggested (with URLs).
+    Drop small talk. Answer with the updated summary only, in the language of the conversation.
+"""
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.get_encoding("o200k_base")
+    except Exception:
+        return None
+
+
+@lru_cache(maxsize=8192)
+def count_text_tokens(text):
+    """ Token count of `text`, cached since the same history is counted again every turn. """
+    if not text:
+        return 0
+    encoding = _encoding()
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_message_tokens(message):
+    tokens = MESSAGE_OVERHEAD_TOKENS + count_text_tokens(message.get("content") or "")
+    for tool_call in message.get("tool_calls") or []:
+        tokens += count_text_tokens(tool_call["function"]["name"] + tool_call["function"]["arguments"])
+    return tokens
+
+
+def count_tokens(messages):
+    return sum(count_message_tokens(message) for message in messages)
+
+
+class ContextWindow:
+    """
+        Keeps the prompt sent on every turn within a token budget.
+
+        `messages[0]` is the system prompt and always stays. When the conversation goes over
+        `budget`, the oldest whole turns (a user message and everything answering it, tool
+        calls included) are folded into a running clinical summary, so recent turns stay
+        verbatim and the prompt size stops growing with the consultation length.
+    """
+
+    def __init__(self, budget=CONTEXT_TOKEN_BUDGET, summary_max_tokens=CONTEXT_SUMMARY_MAX_TOKENS, user_context=""):
+        self.budget = budget
+        self.summary_max_tokens = summary_max_tokens
+        self.user_context = user_context
+        self.summary = ""
+
+    def context_message(self):
+        """ Per user data (location, running summary), sent after the shared static prefix. """
+        parts = [self.user_context] if self.user_context else []
+        if self.summary:
+            parts.append(f"Clinical summary of the earlier conversation: {self.summary}")
+        if not parts:
+            return None
+        return {"role": "system", "content": "\n".join(parts)}
+
+    def prompt(self, messages):
+        """
+            Messages to send: the static system prompt first so every session of a language shares
+            a byte identical prefix, then the per user context message, then the recent turns.
+            The prefix alone is below the provider's 1024 token caching minimum; the layout keeps
+            it stable in case it grows past it.
+        """
+        context = self.context_message()
+        return messages[:1] + ([context] if context else []) + messages[1:]
+
+    def split(self, messages):
+        """
+            (to_fold, to_keep) for `messages[1:]` so the prompt fits the budget.
+            The latest turn is always kept, to_fold is empty while under budget.
+        """
+        history = messages[1:]
+        reserved = (
+            count_message_tokens(messages[0]) + count_text_tokens(self.user_context)
+            + self.summary_max_tokens + MESSAGE_OVERHEAD_TOKENS
+        )
+        total = reserved + count_tokens(history)
+        if total <= self.budget:
+            return [], history
+
+        turn_starts = [i for i, message in enumerate(history) if message["role"] == "user"]
+        cut = 0
+        for start in turn_starts[1:]:
+            total -= count_tokens(history[cut:start])
+            cut = start
+            if total <= self.budget:
+                break
+        return history[:cut], history[cut:]
+
+    def summary_request(self, folded):
+        """ Messages for the summarizer call that folds `folded` into the current summary. """
+        transcript = []
+        for message in folded:
+            content = message.get("content") or ""
+            if message.get("tool_calls"):
+                content = "; ".join(
+                    f"{tool_call['function']['name']}({tool_call['function']['arguments']})"
+                    for tool_call in message["tool_calls"]
+                )
+            transcript.append(f"{message['role']}: {content[:SUMMARY_SOURCE_CHARS]}")
+
+        return [
+            {"role": "system", "content": SUMMARY_PROMPT},
+            {"role": "user", "content": json.dumps(
+                {"current_summary": self.summary, "new_turns": transcript}, ensure_ascii=False
+            )},
+        ]
+
+    def fallback_summary(self, folded):
+        """ Used when the summarizer call fails: keep what the user said, trimmed. """
+        said = " | ".join(message["content"] for message in folded if message["role"] == "user" and message.get("content"))
+        return f"{self.summary} | {said}".strip(" |")[-SUMMARY_SOURCE_CHARS * 2:]
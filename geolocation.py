@@ -0,0 +1,178 @@
+"""
+    IP geolocation for new sessions: cache -> local IP range database -> ipinfo.io.
+
+    The optional local database is a memory mapped file of sorted IPv4 ranges searched with
+    bisect, so most sessions resolve without any network call. Build it from a CSV with
+    `start_ip,end_ip,city,region,country,loc` columns (ip2location / dbip style dumps):
+
+        python geolocation.py build ip_ranges.csv -o ip_ranges.db
+        python geolocation.py lookup 8.8.8.8
+"""
+import os
+import sys
+import csv
+import json
+import mmap
+import struct
+import argparse
+import ipaddress
+import threading
+from array import array
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from search_cache import SearchCache
+
+IPINFO_URL = "https://ipinfo.io/{ip}/json"
+IPINFO_TOKEN = os.getenv("IPINFO_TOKEN")
+GEO_TIMEOUT = float(os.getenv("GEO_TIMEOUT", "3"))
+GEO_DB_PATH = os.getenv("GEO_DB_PATH", "ip_ranges.db")
+GEO_CACHE_SIZE = int(os.getenv("GEO_CACHE_SIZE", "50000"))
+GEO_CACHE_TTL = float(os.getenv("GEO_CACHE_TTL", str(24 * 3600)))
+# "prefix" shares one entry per /24 (IPv4) or /64 (IPv6), "ip" caches every address
+GEO_CACHE_KEY = os.getenv("GEO_CACHE_KEY", "prefix")
+
+MAGIC = b"TMGEO\x00\x00\x01"
+HEADER = struct.Struct("<8sI")
+
+GEO_CACHE = SearchCache(max_size=GEO_CACHE_SIZE, ttls={"ip_location": GEO_CACHE_TTL})
+GEO_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="telemedic-geo")
+_SESSION = requests.Session()  # keep-alive to ipinfo.io
+
+
+def cache_key(ip):
+    address = ipaddress.ip_address(ip)
+    if GEO_CACHE_KEY != "prefix":
+        return str(address)
+    prefix = 24 if address.version == 4 else 64
+    return str(ipaddress.ip_network(f"{address}/{prefix}", strict=False))
+
+
+def build_database(csv_path, out_path):
+    """ Build the range database from a CSV. Returns the number of ranges. """
+    ranges = []
+    with open(csv_path, "r", encoding="utf-8", newline="") as f:
+        for row in csv.DictReader(f):
+            try:
+                start = int(ipaddress.IPv4Address(row["start_ip"]))
+                end = int(ipaddress.IPv4Address(row["end_ip"]))
+            except ValueError:
+                continue  # IPv6 rows are not stored
+            record = {key: row.get(key) for key in ("city", "region", "country", "loc") if row.get(key)}
+            ranges.append((start, end, json.dumps(record, ensure_ascii=False).encode("utf-8")))
+    ranges.sort()
+
+    starts, ends, offsets = array("I"), array("I"), array("I", [0])
+    for start, end, record in ranges:
+        starts.append(start)
+        ends.append(end)
+        offsets.append(offsets[-1] + len(record))
+
+    tmp_path = f"{out_path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(ranges)))
+        for section in (starts, ends, offsets):
+            section.tofile(f)
+        f.write(b"".join(record for _, _, record in ranges))
+    os.replace(tmp_path, out_path)
+    return len(ranges)
+
+
+class IPRangeDatabase:
+    """ Memory mapped IPv4 range database produced by `build_database`. """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self.mmap)
+        magic, self.size = HEADER.unpack_from(view)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not an IP range database")
+
+        start = HEADER.size
+        self.starts = view[start:start + 4 * self.size].cast("I")
+        self.ends = view[start + 4 * self.size:start + 8 * self.size].cast("I")
+        self.offsets = view[start + 8 * self.size:start + 12 * self.size + 4].cast("I")
+        self.records_start = start + 12 * self.size + 4
+
+    def lookup(self, ip):
+        address = ipaddress.ip_address(ip)
+        if address.version != 4:
+            return None
+        value = int(address)
+        i = bisect_right(self.starts, value) - 1
+        if i < 0 or value > self.ends[i]:
+            return None
+        record = self.mmap[self.records_start + self.offsets[i]:self.records_start + self.offsets[i + 1]]
+        return {"ip": str(address), **json.loads(record.decode("utf-8"))}
+
+
+_DATABASE = None
+_DATABASE_LOCK = threading.Lock()
+
+
+def local_database():
+    """ Shared IPRangeDatabase, or None when GEO_DB_PATH doesn't exist. """
+    global _DATABASE
+    with _DATABASE_LOCK:
+        if _DATABASE is None:
+            _DATABASE = IPRangeDatabase(GEO_DB_PATH) if GEO_DB_PATH and os.path.exists(GEO_DB_PATH) else False
+    return _DATABASE or None
+
+
+def fetch_ipinfo(ip):
+    params = {"token": IPINFO_TOKEN} if IPINFO_TOKEN else None
+    response = _SESSION.get(IPINFO_URL.format(ip=ip), params=params, timeout=GEO_TIMEOUT)
+    response.raise_for_status()
+    return response.json()
+
+
+def lookup(ip):
+    """ Location for `ip` as {"status": bool, "data": {...}} (ipinfo.io fields). """
+    try:
+        key = cache_key(ip)
+    except ValueError:
+        return {"status": False}
+
+    data = GEO_CACHE.get("ip_location", key)
+    if data is None:
+        database = local_database()
+        data = database.lookup(ip) if database else None
+        if data is None:
+            try:
+                data = fetch_ipinfo(ip)
+            except Exception as e:
+                print(f"[GEO] Lookup failed for {ip} => {e}" , flush=True)
+                return {"status": False}
+        GEO_CACHE.set("ip_location", key, data)
+
+    return {"status": True, "data": {**data, "ip": ip}}
+
+
+def lookup_async(ip):
+    """ Start `lookup` on a background thread, returns a Future so the first paint doesn't wait. """
+    return GEO_EXECUTOR.submit(lookup, ip)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or query the local IP range database.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build = commands.add_parser("build", help="Build the database from a CSV of IPv4 ranges.")
+    build.add_argument("csv")
+    build.add_argument("-o", "--output", default=GEO_DB_PATH)
+
+    query = commands.add_parser("lookup", help="Resolve an IP address.")
+    query.add_argument("ip")
+
+    args = parser.parse_args(argv)
+    if args.command == "build":
+        print(f"[GEO] Stored {build_database(args.csv, args.output)} ranges => {args.output}")
+    else:
+        print(json.dumps(lookup(args.ip), indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,298 @@
+"""
+    Deadlines and hedged requests against upstream tail latency.
+
+    Every upstream call (first token of a streamed completion, a whole non streamed completion,
+    a Tavily search) runs under a deadline and raises `DeadlineExceeded` when nothing came back
+    in time. With hedging on, each upstream also learns its latency distribution: a call still
+    unanswered after the HEDGE_PERCENTILE of recent latencies gets a duplicate request (for
+    completions optionally to HEDGE_FALLBACK_MODEL / OPENAI_FALLBACK_BASE_URL), the first answer
+    wins and the other one is cancelled. Hedges are capped at HEDGE_MAX_RATE of the calls.
+
+    Completions are admitted by the LLM scheduler first, the deadline only starts once the
+    request goes out (a worker thread runs it), so queueing for rate limit capacity or for a
+    free thread never counts against it.
+
+        HEDGING=true                      # opt in, deadlines apply either way
+        LLM_FIRST_TOKEN_DEADLINE=30       LLM_RESPONSE_DEADLINE=120       SEARCH_DEADLINE=8
+"""
+import os
+import time
+import asyncio
+import threading
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from tracing import NULL_TRACE
+
+HEDGING = os.getenv("HEDGING", "false").lower() == "true"
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "0.95"))
+HEDGE_MAX_RATE = float(os.getenv("HEDGE_MAX_RATE", "0.05"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))  # no hedging until the percentile is learned
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "0.25"))
+HEDGE_FALLBACK_MODEL = os.getenv("HEDGE_FALLBACK_MODEL", "")
+HEDGE_WORKERS = int(os.getenv("HEDGE_WORKERS", "64"))
+LLM_FIRST_TOKEN_DEADLINE = float(os.getenv("LLM_FIRST_TOKEN_DEADLINE", "30"))
+LLM_RESPONSE_DEADLINE = float(os.getenv("LLM_RESPONSE_DEADLINE", "120"))
+SEARCH_DEADLINE = float(os.getenv("SEARCH_DEADLINE", "8"))
+
+# Sync calls run here so the caller can stop waiting at the deadline (a thread cannot be cancelled,
+# the abandoned call ends on its HTTP timeout and its result is released by `cleanup`)
+HEDGE_EXECUTOR = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix="telemedic-hedge")
+
+
+class DeadlineExceeded(TimeoutError):
+    """ No attempt of an upstream call answered before its deadline. """
+
+
+class Hedger:
+    """ Deadline + percentile hedging for one upstream, shared by every bot of the process. """
+
+    def __init__(self, name, deadline, percentile=HEDGE_PERCENTILE, max_rate=HEDGE_MAX_RATE,
+                 min_samples=HEDGE_MIN_SAMPLES, enabled=HEDGING, window=500):
+        self.name = name
+        self.deadline = deadline
+        self.percentile = percentile
+        self.max_rate = max_rate
+        self.min_samples = min_samples
+        self.enabled = enabled
+        self.samples = deque(maxlen=window)
+        self.counts = Counter()
+        self.lock = threading.Lock()
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+
+    def record(self, seconds):
+        with self.lock:
+            self.samples.append(seconds)
+
+    def threshold(self):
+        """ Seconds after which a call is hedged, None while there are too few samples. """
+        with self.lock:
+            if len(self.samples) < self.min_samples:
+                return None
+            ordered = sorted(self.samples)
+        return max(HEDGE_MIN_DELAY, ordered[min(len(ordered) - 1, int(len(ordered) * self.percentile))])
+
+    def hedge_delay(self):
+        if not self.enabled:
+            return None
+        return self.threshold()
+
+    def may_hedge(self, admit=None):
+        """ Within the hedge budget and, for rate limited upstreams, admitted right away by `admit()`. """
+        with self.lock:
+            if self.counts["hedges"] + 1 > self.max_rate * self.counts["calls"]:
+                return False
+        return admit is None or admit()
+
+    def _won(self, label, started, trace):
+        if label == "hedge":
+            self.count("hedge_wins")
+            trace.add(hedge_wins=1)
+            print(f"[HEDGE] {self.name} answered by the hedge after {time.monotonic() - started:.2f}s" , flush=True)
+
+    def _hedged(self, trace):
+        self.count("hedges")
+        trace.add(hedges=1)
+
+    def _missed(self, started):
+        self.count("deadline_exceeded")
+        print(f"[HEDGE] {self.name} missed its {self.deadline:g}s deadline" , flush=True)
+        return DeadlineExceeded(f"{self.name} did not answer within {time.monotonic() - started:.1f}s")
+
+    def run(self, primary, hedge=None, cleanup=None, trace=NULL_TRACE, admit=None):
+        """
+            `primary()` on a worker thread and, once it is slower than the learned threshold,
+            `hedge()` (default: primary again) if `admit()` lets it go out now. Returns the first
+            result; `cleanup(result)` is called on the result of the attempt that lost.
+            The deadline and the latency sample start once a worker thread runs `primary`,
+            waiting for a free thread of HEDGE_EXECUTOR is not the upstream's latency.
+        """
+        self.count("calls")
+        delay = self.hedge_delay()
+        began = threading.Event()
+        clock = {}
+
+        def timed_primary():
+            clock["started"] = time.monotonic()
+            began.set()
+            return primary()
+
+        def sample(future):
+            # Measured on the primary even when it lost, so hedging does not hide the tail it reacts to
+            if not future.cancelled() and future.exception() is None:
+                self.record(time.monotonic() - clock["started"])
+
+        def release(future):
+            if cleanup is not None and not future.cancelled() and future.exception() is None:
+                cleanup(future.result())
+
+        def abandon(futures):
+            for future in futures:
+                if not future.cancel():
+                    future.add_done_callback(release)
+
+        first = HEDGE_EXECUTOR.submit(timed_primary)
+        first.add_done_callback(sample)
+        began.wait()
+        started = clock["started"]
+        deadline = started + self.deadline
+        pending = {first: "primary"}
+        hedged = False
+        error = None
+        while pending:
+            now = time.monotonic()
+            if now >= deadline:
+                abandon(pending)
+                raise self._missed(started)
+            timeout = deadline - now
+            if delay is not None and not hedged:
+                timeout = min(timeout, max(0.0, started + delay - now))
+
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                label = pending.pop(future)
+                if future.exception() is not None:
+                    error = future.exception()
+                    continue
+                abandon(pending)
+                self._won(label, started, trace)
+                return future.result()
+
+            if pending and not hedged and delay is not None and time.monotonic() - started >= delay and self.may_hedge(admit):
+                hedged = True
+                self._hedged(trace)
+                pending[HEDGE_EXECUTOR.submit(hedge or primary)] = "hedge"
+        raise error
+
+    async def run_async(self, primary, hedge=None, cleanup=None, trace=NULL_TRACE, admit=None):
+        """ asyncio flavour of `run`: attempts are tasks and the loser is cancelled. """
+        self.count("calls")
+        started = time.monotonic()
+        deadline = started + self.deadline
+        delay = self.hedge_delay()
+
+        first = asyncio.ensure_future(primary())
+        pending = {first: "primary"}
+        hedged = False
+        error = None
+        try:
+            while pending:
+                now = time.monotonic()
+                if now >= deadline:
+                    raise self._missed(started)
+                timeout = deadline - now
+                if delay is not None and not hedged:
+                    timeout = min(timeout, max(0.0, started + delay - now))
+
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    label = pending.pop(task)
+                    if task.exception() is not None:
+                        error = task.exception()
+                        continue
+                    if task is first:
+                        self.record(time.monotonic() - started)
+                    self._won(label, started, trace)
+                    return task.result()
+
+                if pending and not hedged and delay is not None and time.monotonic() - started >= delay and self.may_hedge(admit):
+                    hedged = True
+                    self._hedged(trace)
+                    pending[asyncio.ensure_future((hedge or primary)())] = "hedge"
+            raise error
+        finally:
+            if first in pending:
+                # Lost, missed the deadline or the turn was cancelled: still a (lower bound) latency sample
+                self.record(time.monotonic() - started)
+            for task in pending:
+                task.cancel()
+            for task in pending:
+                if task.done() and not task.cancelled() and task.exception() is None and cleanup is not None:
+                    await cleanup(task.result())
+
+    def stats(self):
+        threshold = self.threshold()
+        with self.lock:
+            counts = dict(self.counts)
+        calls = counts.get("calls", 0)
+        return {
+            **counts,
+            "hedge_rate": counts.get("hedges", 0) / calls if calls else 0.0,
+            "threshold_s": round(threshold, 4) if threshold is not None else None,
+            "deadline_s": self.deadline,
+        }
+
+
+class PeekedStream:
+    """ A completion stream whose first chunk was already read (to know it answered). """
+
+    def __init__(self, stream, chunks, first):
+        self.stream = stream
+        self.chunks = chunks
+        self.first = first
+
+    def __iter__(self):
+        if self.first is not None:
+            yield self.first
+        yield from self.chunks
+
+    def close(self):
+        self.stream.close()
+
+
+class AsyncPeekedStream(PeekedStream):
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        if self.first is not None:
+            yield self.first
+        async for chunk in self.chunks:
+            yield chunk
+
+    async def close(self):
+        await self.stream.close()
+
+
+def peek_stream(stream):
+    """ Block until the first chunk arrived. """
+    chunks = iter(stream)
+    try:
+        first = next(chunks, None)
+    except BaseException:
+        stream.close()
+        raise
+    return PeekedStream(stream, chunks, first)
+
+
+async def apeek_stream(stream):
+    chunks = stream.__aiter__()
+    try:
+        first = await chunks.__anext__()
+    except StopAsyncIteration:
+        first = None
+    except BaseException:
+        # Also on cancellation when the other attempt won
+        await stream.close()
+        raise
+    return AsyncPeekedStream(stream, chunks, first)
+
+
+def close_stream(stream):
+    stream.close()
+
+
+async def aclose_stream(stream):
+    await stream.close()
+
+
+def hedge_stats():
+    return {hedger.name: hedger.stats() for hedger in (FIRST_TOKEN_HEDGER, RESPONSE_HEDGER, SEARCH_HEDGER)}
+
+
+FIRST_TOKEN_HEDGER = Hedger("llm.first_token", LLM_FIRST_TOKEN_DEADLINE)
+RESPONSE_HEDGER = Hedger("llm.response", LLM_RESPONSE_DEADLINE)
+SEARCH_HEDGER = Hedger("search", SEARCH_DEADLINE)
@@ -0,0 +1,225 @@
+"""
+    Local intent router in front of `TeleMedicBot.chat` (English and Spanish).
+
+    Decides in microseconds, without a model call, whether a turn is
+      - "small_talk": clearly needs no tools, answered by a tool-free streaming completion
+      - "clinic": clearly asks where to find a doctor / clinic, so the clinic lookup runs right away
+        and the answer streams without the model's tool decision request first
+      - "unknown": everything else, the model decides about tools as usual
+
+    Rules (keywords / regex) decide the clear cases; a character trigram profile built from
+    seed phrases catches small talk variants the rules miss. Check it against labelled turns:
+
+        python intent_router.py eval labelled.jsonl     # {"text": ..., "label": ...} per line
+"""
+import os
+import re
+import sys
+import json
+import math
+import time
+import threading
+import unicodedata
+from collections import Counter, defaultdict
+
+INTENT_ROUTING = os.getenv("INTENT_ROUTING", "true").lower() == "true"
+NGRAM_THRESHOLD = 0.55
+NGRAM_MARGIN = 0.2
+SMALL_TALK_MAX_WORDS = 8
+
+SMALL_TALK = "small_talk"
+CLINIC = "clinic"
+UNKNOWN = "unknown"
+
+
+def normalize(text):
+    """ Lowercase and strip accents so "Adiós" and "adios" match the same rules. """
+    text = unicodedata.normalize("NFKD", str(text).lower())
+    return "".join(char for char in text if not unicodedata.combining(char)).strip()
+
+
+_GREETING = re.compile(
+    r"^(hi+|hello+|hey+|hola+|good (morning|afternoon|evening|night)|buen(os|as) (dias|tardes|noches)|"
+    r"thanks?( you)?( so much| a lot)?|thank u|thx|ty|gracias( por todo)?|muchas gracias|"
+    r"bye+|goodbye|see you|adios|hasta (luego|pronto|manana)|chao|"
+    r"who are you|what are you|what can you do|quien eres|que eres|que puedes hacer|"
+    r"how are you|como estas|que tal)"
+    r"[\s!.,?¡¿:)(]*(jd|doc|doctor|bot)?[\s!.,?¡¿:)(]*$"
+)
+_ACKNOWLEDGEMENT = re.compile(
+    r"^(ok(ay)?|k|cool|great|nice|perfect|perfecto|vale|genial|bien|entendido|got it|understood|"
+    r"yes|yeah|yep|no|nope|si|sure|claro|de acuerdo)[\s!.,?¡¿:)(]*$"
+)
+_MEDICAL_CUE = re.compile(
+    r"\b(pain|ache|hurt|fever|cough|headache|sick|ill|nause|vomit|rash|bleed|dizz|swell|sympt|sore|"
+    r"tired|infect|breath|chest|throat|stomach|diarrh|allerg|pregnan|medic|pill|dose|"
+    r"dolor|duele|fiebre|tos|mareo|vomit|sangr|sintoma|enferm|cansad|garganta|pecho|estomago|"
+    r"alergi|embaraz|medicina|pastilla|\d+\s*(day|week|month|hour|dia|semana|mes|hora)s?)"
+)
+_CLINIC = re.compile(
+    r"\b(doctor|doctors|physician|clinic|clinics|hospital|specialist|appointment|urgent care|emergency room|"
+    r"medico|medicos|clinica|clinicas|especialista|cita|urgencias|consultorio)\b"
+)
+# A doctor mentioned in passing ("I saw a doctor yesterday") is not a lookup: also require a place ...
+_CLINIC_PLACE = re.compile(r"\b(near me|nearby|close to me|around here|in my (city|area|town)|cerca( de mi)?|en mi (ciudad|zona))\b")
+# ... or asking where to go
+_CLINIC_SEEK = re.compile(
+    r"\b(where|find (a|an|me|some)|looking for|recommend|book|donde|encontrar|busco|buscar|recomienda|recomiendas)\b"
+)
+
+SEED_PHRASES = {
+    SMALL_TALK: [
+        "hi", "hello there", "hey", "good morning", "thanks", "thank you very much", "ok thanks", "bye",
+        "see you later", "who are you", "how are you", "nice", "great thank you", "that helps thanks",
+        "hola", "buenos dias", "gracias", "muchas gracias", "adios", "hasta luego", "quien eres",
+        "como estas", "vale gracias", "perfecto gracias", "eso me ayuda gracias",
+    ],
+    UNKNOWN: [
+        "i have a headache", "my stomach hurts", "fever for two days", "it started yesterday",
+        "what could this be", "is it serious", "tengo dolor de cabeza", "me duele el estomago",
+        "fiebre desde ayer", "que puede ser", "es grave", "i feel dizzy and tired",
+    ],
+}
+
+
+def trigrams(text):
+    text = f"  {normalize(text)} "
+    return Counter(text[i:i + 3] for i in range(len(text) - 2))
+
+
+def norm(grams):
+    return math.sqrt(sum(count * count for count in grams.values()))
+
+
+class IntentRouter:
+    """ Rule + trigram intent classifier with routing stats. """
+
+    def __init__(self, seed_phrases=SEED_PHRASES):
+        # label -> (trigram -> [(phrase index, count)], phrase norms), so scoring only touches shared trigrams
+        self.profiles = {}
+        for label, phrases in seed_phrases.items():
+            index, norms = defaultdict(list), []
+            for i, grams in enumerate(map(trigrams, phrases)):
+                for gram, count in grams.items():
+                    index[gram].append((i, count))
+                norms.append(norm(grams))
+            self.profiles[label] = (dict(index), norms)
+        self.lock = threading.Lock()
+        self.routes = Counter()
+        self.classify_seconds = 0.0
+        self.first_token_seconds = defaultdict(list)
+        # route -> how often the model ended up calling tools anyway, and which
+        self.outcomes = defaultdict(Counter)
+
+    def ngram_score(self, text, label):
+        """ Best cosine similarity between the trigrams of `text` and a seed phrase of `label`. """
+        if label not in self.profiles:
+            return 0.0
+        index, norms = self.profiles[label]
+        grams = trigrams(text)
+        dots = [0] * len(norms)
+        for gram, count in grams.items():
+            for i, seed_count in index.get(gram, ()):
+                dots[i] += count * seed_count
+        text_norm = norm(grams) or 1.0
+        return max((dot / (text_norm * seed_norm) for dot, seed_norm in zip(dots, norms)), default=0.0)
+
+    def classify(self, text, previous_assistant=None):
+        """ SMALL_TALK, CLINIC or UNKNOWN for a user message. """
+        text = normalize(text).lstrip("¡¿!?.,:;- ")
+        if not text:
+            return SMALL_TALK
+
+        place, seek = _CLINIC_PLACE.search(text), _CLINIC_SEEK.search(text)
+        if (place or seek) and (_CLINIC.search(text) or (place and seek)):
+            return CLINIC
+
+        if _MEDICAL_CUE.search(text) or len(text.split()) > SMALL_TALK_MAX_WORDS:
+            return UNKNOWN
+
+        if _GREETING.match(text):
+            return SMALL_TALK
+
+        # "yes" / "ok" may be agreeing to something the bot just offered (e.g. finding clinics)
+        asked_question = bool(previous_assistant) and previous_assistant.rstrip().endswith("?")
+        if _ACKNOWLEDGEMENT.match(text):
+            return UNKNOWN if asked_question else SMALL_TALK
+
+        small_talk = self.ngram_score(text, SMALL_TALK)
+        if not asked_question and small_talk >= NGRAM_THRESHOLD and small_talk - self.ngram_score(text, UNKNOWN) >= NGRAM_MARGIN:
+            return SMALL_TALK
+        return UNKNOWN
+
+    def route(self, text, previous_assistant=None):
+        """ classify() plus bookkeeping for the routing stats. """
+        started = time.perf_counter()
+        route = self.classify(text, previous_assistant=previous_assistant)
+        with self.lock:
+            self.classify_seconds += time.perf_counter() - started
+            self.routes[route] += 1
+        return route
+
+    def record_first_token(self, route, seconds):
+        with self.lock:
+            samples = self.first_token_seconds[route]
+            samples.append(seconds)
+            del samples[:-1000]
+
+    def record_outcome(self, route, tool_names):
+        """ Which tools the model called on a routed turn, to check the router against the model. """
+        with self.lock:
+            self.outcomes[route]["turns"] += 1
+            for name in set(tool_names):
+                self.outcomes[route][name] += 1
+
+    def stats(self):
+        with self.lock:
+            total = sum(self.routes.values())
+            ttft = {route: sum(samples) / len(samples) for route, samples in self.first_token_seconds.items() if samples}
+            unknown = self.outcomes[UNKNOWN]
+            return {
+                "routes": dict(self.routes),
+                # Share of turns left to the model's own tool decision
+                "fallback_rate": self.routes[UNKNOWN] / total if total else 0.0,
+                "avg_classify_us": self.classify_seconds / total * 1e6 if total else 0.0,
+                "avg_first_token_s": ttft,
+                # Time to first token saved on small talk turns compared with tool enabled turns
+                "small_talk_saved_s": ttft[UNKNOWN] - ttft[SMALL_TALK] if SMALL_TALK in ttft and UNKNOWN in ttft else None,
+                "unknown_without_tools_rate": (
+                    1 - (unknown["fetch_medical_info"] + unknown["fetch_nearby_clinic"]) / unknown["turns"]
+                    if unknown["turns"] else None
+                ),
+            }
+
+
+def evaluate(router, examples):
+    """ Accuracy and per label precision / recall over (text, label) pairs. """
+    confusion = defaultdict(Counter)
+    started = time.perf_counter()
+    for text, label in examples:
+        confusion[label][router.classify(text)] += 1
+    elapsed = time.perf_counter() - started
+
+    total = sum(sum(row.values()) for row in confusion.values())
+    correct = sum(confusion[label][label] for label in confusion)
+    labels = set(confusion) | {predicted for row in confusion.values() for predicted in row}
+    report = {"examples": total, "accuracy": correct / total if total else 0.0, "avg_us": elapsed / total * 1e6 if total else 0.0}
+    for label in sorted(labels):
+        predicted = sum(row[label] for row in confusion.values())
+        actual = sum(confusion[label].values())
+        report[label] = {
+            "precision": confusion[label][label] / predicted if predicted else 0.0,
+            "recall": confusion[label][label] / actual if actual else 0.0,
+        }
+    return report
+
+
+INTENT_ROUTER = IntentRouter()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or sys.argv[1] != "eval":
+        sys.exit("usage: python intent_router.py eval <labelled.jsonl>")
+    with open(sys.argv[2], "r", encoding="utf-8") as f:
+        examples = [(row["text"], row["label"]) for row in map(json.loads, filter(str.strip, f))]
+    print(json.dumps(evaluate(INTENT_ROUTER, examples), indent=2))
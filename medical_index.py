@@ -0,0 +1,232 @@
+"""
+    Offline medical knowledge index used as a `fetch_medical_info` backend.
+
+    A BM25 inverted index over condition / symptom documents stored in a single compact
+    binary file that is memory mapped on open, so workers start instantly and share pages.
+
+        python medical_index.py build conditions.jsonl -o medical.idx
+        python medical_index.py search medical.idx "fever and headache for two days"
+
+    The corpus is JSONL, one document per line: {"title": ..., "content": ..., "url": ...}
+    (only "content" is required). A directory of .txt / .md files works too, the file name
+    becomes the title.
+"""
+import os
+import re
+import sys
+import json
+import math
+import mmap
+import struct
+import argparse
+import threading
+from array import array
+from collections import Counter, defaultdict
+
+MAGIC = b"TMBM25\x00\x01"
+# magic, docs, terms, postings, avgdl, then byte offsets of every section
+HEADER = struct.Struct("<8sIIIdQQQQQQ")
+
+K1 = 1.5
+B = 0.75
+SNIPPET_CHARS = 600
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+STOPWORDS = frozenset("""
+    a an and are as at be by for from has have i in is it its me my of on or that the this to was with
+    possible conditions symptoms symptom
+    de del el la las los un una unos unas y o en con por para que es mi me se al lo
+""".split())
+
+
+def tokenize(text):
+    return [token for token in _TOKEN.findall(str(text).lower()) if token not in STOPWORDS and len(token) > 1]
+
+
+def _pad(f):
+    f.write(b"\x00" * (-f.tell() % 8))
+    return f.tell()
+
+
+def read_corpus(path):
+    """ Yield documents from a JSONL file or a directory of text files. """
+    if os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            if name.endswith((".txt", ".md")):
+                with open(os.path.join(path, name), "r", encoding="utf-8") as f:
+                    yield {"title": os.path.splitext(name)[0].replace("_", " "), "content": f.read().strip()}
+        return
+
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                doc = json.loads(line)
+                if doc.get("content"):
+                    yield doc
+
+
+def build_index(documents, out_path):
+    """ Build the on-disk index from an iterable of documents. Returns the number of documents indexed. """
+    postings = defaultdict(list)
+    doc_lengths = array("I")
+    doc_blobs = []
+
+    for doc_id, doc in enumerate(documents):
+        terms = Counter(tokenize(f"{doc.get('title', '')} {doc['content']}"))
+        for term, tf in terms.items():
+            postings[term].append((doc_id, min(tf, 0xFFFF)))
+        doc_lengths.append(sum(terms.values()))
+        doc_blobs.append(json.dumps(
+            {"title": doc.get("title", ""), "content": doc["content"], "url": doc.get("url")},
+            ensure_ascii=False
+        ).encode("utf-8"))
+
+    # Sorted by utf-8 bytes so lookups can binary search the raw term blob
+    vocabulary = sorted(term.encode("utf-8") for term in postings)
+    term_offsets, term_postings = array("I", [0]), array("I", [0])
+    posting_docs, posting_tfs = array("I"), array("H")
+    for term in vocabulary:
+        term_offsets.append(term_offsets[-1] + len(term))
+        for doc_id, tf in postings[term.decode("utf-8")]:
+            posting_docs.append(doc_id)
+            posting_tfs.append(tf)
+        term_postings.append(len(posting_docs))
+
+    doc_offsets = array("Q", [0])
+    for blob in doc_blobs:
+        doc_offsets.append(doc_offsets[-1] + len(blob))
+
+    n_docs = len(doc_lengths)
+    avgdl = sum(doc_lengths) / n_docs if n_docs else 0.0
+    tmp_path = f"{out_path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(b"\x00" * HEADER.size)
+        offsets = []
+        for section in (term_offsets, term_postings, posting_docs, posting_tfs, doc_lengths, doc_offsets):
+            offsets.append(_pad(f))
+            section.tofile(f)
+        # The term and document blobs follow the arrays, their positions are derived on open
+        _pad(f)
+        f.write(b"".join(vocabulary))
+        _pad(f)
+        f.write(b"".join(doc_blobs))
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, n_docs, len(vocabulary), len(posting_docs), avgdl, *offsets))
+    os.replace(tmp_path, out_path)
+    return n_docs
+
+
+class MedicalIndex:
+    """ Read only, memory mapped BM25 index produced by `build_index`. """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self.mmap)
+
+        magic, self.n_docs, self.n_terms, n_postings, self.avgdl, *offsets = HEADER.unpack_from(view)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a medical index")
+
+        def section(index, fmt, count):
+            start = offsets[index]
+            return view[start:start + count * struct.calcsize(fmt)].cast(fmt)
+
+        self.term_offsets = section(0, "I", self.n_terms + 1)
+        self.term_postings = section(1, "I", self.n_terms + 1)
+        self.posting_docs = section(2, "I", n_postings)
+        self.posting_tfs = section(3, "H", n_postings)
+        self.doc_lengths = section(4, "I", self.n_docs)
+        self.doc_offsets = section(5, "Q", self.n_docs + 1)
+
+        doc_offsets_end = offsets[5] + (self.n_docs + 1) * 8
+        self.terms_start = doc_offsets_end + (-doc_offsets_end % 8)
+        terms_end = self.terms_start + self.term_offsets[-1]
+        self.docs_start = terms_end + (-terms_end % 8)
+
+    def term_id(self, term):
+        """ Binary search the sorted vocabulary. """
+        term = term.encode("utf-8")
+        low, high = 0, self.n_terms - 1
+        while low <= high:
+            mid = (low + high) // 2
+            start = self.terms_start + self.term_offsets[mid]
+            candidate = self.mmap[start:self.terms_start + self.term_offsets[mid + 1]]
+            if candidate == term:
+                return mid
+            if candidate < term:
+                low = mid + 1
+            else:
+                high = mid - 1
+        return None
+
+    def document(self, doc_id):
+        start = self.docs_start + self.doc_offsets[doc_id]
+        return json.loads(self.mmap[start:self.docs_start + self.doc_offsets[doc_id + 1]].decode("utf-8"))
+
+    def search(self, query, k=5):
+        """ Top `k` documents for `query` as (score, document) pairs, best first. """
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            term_id = self.term_id(term)
+            if term_id is None:
+                continue
+            start, end = self.term_postings[term_id], self.term_postings[term_id + 1]
+            idf = math.log(1 + (self.n_docs - (end - start) + 0.5) / ((end - start) + 0.5))
+            for i in range(start, end):
+                doc_id, tf = self.posting_docs[i], self.posting_tfs[i]
+                norm = K1 * (1 - B + B * self.doc_lengths[doc_id] / self.avgdl)
+                scores[doc_id] += idf * tf * (K1 + 1) / (tf + norm)
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(score, self.document(doc_id)) for doc_id, score in ranked]
+
+    def snippets(self, query, k=5, reuturn_urls=False):
+        """ Top `k` results in the same shape `web_search_tool` returns. """
+        results = []
+        for _, doc in self.search(query, k=k):
+            content = doc["content"][:SNIPPET_CHARS]
+            if doc.get("title"):
+                content = f"{doc['title']}: {content}"
+            results.append({"content": content, "url": doc.get("url")} if reuturn_urls else content)
+        return results
+
+
+_INDEXES = {}
+_INDEXES_LOCK = threading.Lock()
+
+
+def open_index(path):
+    """ Process wide shared MedicalIndex for `path`, None if it doesn't exist. """
+    with _INDEXES_LOCK:
+        if path not in _INDEXES:
+            _INDEXES[path] = MedicalIndex(path) if path and os.path.exists(path) else None
+        return _INDEXES[path]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or query the offline medical knowledge index.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build = commands.add_parser("build", help="Build an index from a JSONL corpus or a directory of text files.")
+    build.add_argument("corpus")
+    build.add_argument("-o", "--output", default="medical.idx")
+
+    search = commands.add_parser("search", help="Query an index.")
+    search.add_argument("index")
+    search.add_argument("query")
+    search.add_argument("-k", type=int, default=5)
+
+    args = parser.parse_args(argv)
+    if args.command == "build":
+        n_docs = build_index(read_corpus(args.corpus), args.output)
+        print(f"[MEDICAL_INDEX] Indexed {n_docs} documents => {args.output} ({os.path.getsize(args.output)} bytes)")
+    else:
+        for score, doc in MedicalIndex(args.index).search(args.query, k=args.k):
+            print(f"{score:7.3f}  {doc.get('title') or doc['content'][:60]}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,125 @@
+import os
+import re
+import time
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+CLINIC_PREFETCH = os.getenv("CLINIC_PREFETCH", "false").lower() == "true"
+PREFETCH_CONDITIONS = int(os.getenv("PREFETCH_CONDITIONS", "2"))
+PREFETCH_CONCURRENCY = int(os.getenv("PREFETCH_CONCURRENCY", "2"))
+PREFETCH_DAILY_LIMIT = int(os.getenv("PREFETCH_DAILY_LIMIT", "500"))
+PREFETCH_TTL = float(os.getenv("PREFETCH_TTL", "1800"))  # unused after this long counts as waste
+
+_BOLD = re.compile(r"\*\*([^*\n]{3,60})\*\*")
+_LIST_ITEM = re.compile(r"^\s*(?:\d+[.)]|[-*•])\s+(.+)$", re.MULTILINE)
+
+
+def candidate_conditions(answer, limit=PREFETCH_CONDITIONS):
+    """ Top conditions named in a diagnosis answer: bold names first, then list items. """
+    candidates = _BOLD.findall(answer) or _LIST_ITEM.findall(answer)
+    conditions = []
+    for candidate in candidates:
+        condition = re.split(r"[:(–-]", candidate.replace("*", ""), maxsplit=1)[0].strip(" .")
+        if 2 < len(condition) <= 60 and condition.lower() not in (c.lower() for c in conditions):
+            conditions.append(condition)
+        if len(conditions) >= limit:
+            break
+    return conditions
+
+
+class ClinicPrefetcher:
+    """
+        Warms the clinic lookup for the conditions of a diagnosis answer, so the usual
+        "where can I see a doctor for this?" follow-up is served from the search cache.
+
+        Caps concurrent prefetches and prefetches per day, and tracks hits (a real lookup
+        asked for a prefetched key) and waste (prefetched keys nobody asked for in time).
+    """
+
+    def __init__(self, concurrency=PREFETCH_CONCURRENCY, daily_limit=PREFETCH_DAILY_LIMIT, ttl=PREFETCH_TTL):
+        self.concurrency = concurrency
+        self.daily_limit = daily_limit
+        self.ttl = ttl
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="telemedic-prefetch")
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.day = datetime.date.today()
+        self.spent_today = 0
+        self.prefetched = {}  # key -> prefetch time
+        self.issued = 0
+        self.hits = 0
+        self.wasted = 0
+        self.skipped = 0
+        self.tasks = set()  # asyncio prefetches in flight, the event loop only keeps weak references
+
+    def _expire(self, now):
+        for key, started in list(self.prefetched.items()):
+            if now - started > self.ttl:
+                del self.prefetched[key]
+                self.wasted += 1
+
+    def acquire(self, key):
+        """ Reserve a prefetch slot for `key`, False if capped or already warm. """
+        with self.lock:
+            today = datetime.date.today()
+            if today != self.day:
+                self.day, self.spent_today = today, 0
+            self._expire(time.time())
+            if key in self.prefetched or self.in_flight >= self.concurrency or self.spent_today >= self.daily_limit:
+                self.skipped += 1
+                return False
+            self.in_flight += 1
+            self.spent_today += 1
+            self.issued += 1
+            self.prefetched[key] = time.time()
+            return True
+
+    def release(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def track(self, task):
+        """ Hold on to an asyncio prefetch task until it is done. """
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    def submit(self, key, fn, *args):
+        """ Run `fn(*args)` in the background if a slot is free. """
+        if not self.acquire(key):
+            return None
+
+        def run():
+            try:
+                fn(*args)
+            except Exception as e:
+                print(f"[PREFETCH] Failed for {key} => {e}" , flush=True)
+            finally:
+                self.release()
+
+        return self.executor.submit(run)
+
+    def record_lookup(self, key):
+        """ Called on every real clinic lookup, counts a hit if `key` was prefetched. """
+        with self.lock:
+            if self.prefetched.pop(key, None) is not None:
+                self.hits += 1
+
+    def stats(self):
+        with self.lock:
+            self._expire(time.time())
+            settled = self.hits + self.wasted
+            return {
+                "issued": self.issued,
+                "hits": self.hits,
+                "wasted": self.wasted,
+                "pending": len(self.prefetched),
+                "skipped": self.skipped,
+                "hit_rate": self.hits / settled if settled else 0.0,
+                "waste_rate": self.wasted / settled if settled else 0.0,
+                "spent_today": self.spent_today,
+            }
+
+
+CLINIC_PREFETCHER = ClinicPrefetcher()
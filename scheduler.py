@@ -0,0 +1,301 @@
+"""
+    Process wide admission scheduler in front of every chat completion.
+
+    Requests queue by priority (a turn's follow-up call after its tools ran goes before the
+    next turn of an ongoing consultation, which goes before a new consultation) and are
+    admitted once the requests-per-minute and tokens-per-minute buckets allow their estimated
+    cost. The queue is bounded: past LLM_QUEUE_DEPTH waiters, or after LLM_QUEUE_TIMEOUT
+    seconds of waiting, a request fails fast with `AdmissionRejected` instead of piling up.
+    429 / 5xx / connection errors are retried with exponential backoff and full jitter, and a
+    429 empties the buckets so everybody backs off together.
+
+        LLM_RPM=500 LLM_TPM=200000        # provider limits, 0 = unlimited
+"""
+import os
+import json
+import time
+import heapq
+import random
+import asyncio
+import itertools
+import threading
+from collections import Counter, deque
+
+from context_window import count_tokens, count_text_tokens
+from tracing import NULL_TRACE
+
+LLM_SCHEDULER = os.getenv("LLM_SCHEDULER", "true").lower() == "true"
+LLM_RPM = float(os.getenv("LLM_RPM", "0"))
+LLM_TPM = float(os.getenv("LLM_TPM", "0"))
+LLM_QUEUE_DEPTH = int(os.getenv("LLM_QUEUE_DEPTH", "200"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "30"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_RETRY_BASE = float(os.getenv("LLM_RETRY_BASE", "0.5"))
+LLM_RETRY_CAP = float(os.getenv("LLM_RETRY_CAP", "8"))
+# Expected completion length used in the cost estimate (max_tokens would reserve far too much)
+LLM_COMPLETION_ESTIMATE = int(os.getenv("LLM_COMPLETION_ESTIMATE", "512"))
+
+FOLLOW_UP = 0      # answer after tool calls, retries: the user is already mid-turn
+ONGOING = 1        # next turn of a consultation
+NEW_SESSION = 2    # first turn of a consultation
+PRIORITY_NAMES = {FOLLOW_UP: "follow_up", ONGOING: "ongoing", NEW_SESSION: "new_session"}
+
+
+def estimate_cost(messages, tools=None, max_tokens=None):
+    """ Tokens a request is charged against the TPM bucket: prompt, tool schemas and expected completion. """
+    tools_tokens = count_text_tokens(json.dumps(tools, sort_keys=True)) if tools else 0
+    completion = min(max_tokens or LLM_COMPLETION_ESTIMATE, LLM_COMPLETION_ESTIMATE)
+    return count_tokens(messages) + tools_tokens + completion
+
+
+class AdmissionRejected(RuntimeError):
+    """ The scheduler is saturated (queue full or waited too long), retry later. """
+
+    def __init__(self, reason, retry_after=1.0):
+        super().__init__(reason)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """ `rate` units per minute, bursting up to one minute's worth. rate 0 means unlimited. """
+
+    def __init__(self, rate_per_minute):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = rate_per_minute
+        self.level = rate_per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """ Seconds until `amount` is available, 0 if it is now. """
+        if not self.rate:
+            return 0.0
+        self._refill()
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount):
+        if self.rate:
+            self.level -= min(amount, self.capacity)
+
+    def drain(self):
+        if self.rate:
+            self._refill()
+            self.level = min(self.level, 0.0)
+
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "cost", "event", "loop")
+
+    def __init__(self, priority, seq, cost, event, loop=None):
+        self.priority = priority
+        self.seq = seq
+        self.cost = cost
+        self.event = event
+        self.loop = loop
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+    def wake(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.event.set)
+        else:
+            self.event.set()
+
+
+def retry_after(error):
+    response = getattr(error, "response", None)
+    try:
+        return float(response.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return 0.0
+
+
+def is_retryable(error):
+    status = getattr(error, "status_code", None)
+    if status is not None:
+        return status == 429 or status >= 500
+    return type(error).__name__ in ("APIConnectionError", "APITimeoutError")
+
+
+class LLMScheduler:
+    """ Priority queue + RPM / TPM token buckets + retries, shared by sync and async bots. """
+
+    def __init__(self, rpm=LLM_RPM, tpm=LLM_TPM, max_depth=LLM_QUEUE_DEPTH, queue_timeout=LLM_QUEUE_TIMEOUT,
+                 max_retries=LLM_MAX_RETRIES, retry_base=LLM_RETRY_BASE, retry_cap=LLM_RETRY_CAP):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_depth = max_depth
+        self.queue_timeout = queue_timeout
+        self.max_retries = max_retries
+        self.retry_base = retry_base
+        self.retry_cap = retry_cap
+        self.lock = threading.Lock()
+        self.queue = []
+        self.seq = itertools.count()
+        self.counts = Counter()
+        self.waits = deque(maxlen=2000)
+
+    # Queue bookkeeping, all under self.lock
+
+    def _enqueue(self, waiter):
+        with self.lock:
+            if len(self.queue) >= self.max_depth:
+                self.counts["rejected_full"] += 1
+                raise AdmissionRejected("LLM queue is full.")
+            heapq.heappush(self.queue, waiter)
+
+    def _try_admit(self, waiter):
+        """ 0 when admitted, else seconds to wait (None: wait until woken as the new head). """
+        with self.lock:
+            if self.queue[0] is not waiter:
+                return None
+            wait = max(self.requests.wait_time(1), self.tokens.wait_time(waiter.cost))
+            if wait > 0:
+                return wait
+            self.requests.take(1)
+            self.tokens.take(waiter.cost)
+            heapq.heappop(self.queue)
+            if self.queue:
+                self.queue[0].wake()
+            return 0
+
+    def _abandon(self, waiter, reason):
+        """ Drop a waiter that gave up (`reason`: "rejected_timeout" or "cancelled"), unless it was admitted meanwhile. """
+        with self.lock:
+            if waiter not in self.queue:
+                return
+            was_head = self.queue[0] is waiter
+            self.queue.remove(waiter)
+            heapq.heapify(self.queue)
+            if was_head and self.queue:
+                self.queue[0].wake()
+            self.counts[reason] += 1
+
+    def _admitted(self, priority, waited):
+        with self.lock:
+            self.counts[f"admitted_{PRIORITY_NAMES.get(priority, priority)}"] += 1
+            self.waits.append(waited)
+
+    def try_admit(self, cost, priority=FOLLOW_UP):
+        """ Admit now or not at all, for extra requests (hedges) that must neither queue nor jump the queue. """
+        with self.lock:
+            if self.queue or self.requests.wait_time(1) or self.tokens.wait_time(cost):
+                return False
+            self.requests.take(1)
+            self.tokens.take(cost)
+        self._admitted(priority, 0.0)
+        return True
+
+    def admit(self, cost, priority=ONGOING):
+        """ Block until the request may go out. Returns the seconds spent queued. """
+        waiter = _Waiter(priority, next(self.seq), cost, threading.Event())
+        self._enqueue(waiter)
+        started = time.monotonic()
+        deadline = started + self.queue_timeout
+        try:
+            while True:
+                wait = self._try_admit(waiter)
+                if wait == 0:
+                    waited = time.monotonic() - started
+                    self._admitted(priority, waited)
+                    return waited
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise AdmissionRejected("Timed out waiting for LLM capacity.")
+                waiter.event.wait(min(wait or remaining, remaining))
+                waiter.event.clear()
+        except AdmissionRejected:
+            self._abandon(waiter, "rejected_timeout")
+            raise
+        except BaseException:
+            self._abandon(waiter, "cancelled")
+            raise
+
+    async def admit_async(self, cost, priority=ONGOING):
+        waiter = _Waiter(priority, next(self.seq), cost, asyncio.Event(), asyncio.get_running_loop())
+        self._enqueue(waiter)
+        started = time.monotonic()
+        deadline = started + self.queue_timeout
+        try:
+            while True:
+                wait = self._try_admit(waiter)
+                if wait == 0:
+                    waited = time.monotonic() - started
+                    self._admitted(priority, waited)
+                    return waited
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise AdmissionRejected("Timed out waiting for LLM capacity.")
+                try:
+                    await asyncio.wait_for(waiter.event.wait(), timeout=min(wait or remaining, remaining))
+                except asyncio.TimeoutError:
+                    pass
+                waiter.event.clear()
+        except AdmissionRejected:
+            self._abandon(waiter, "rejected_timeout")
+            raise
+        except BaseException:
+            # The turn was cancelled (client disconnect) while queued: give the slot to the next one
+            self._abandon(waiter, "cancelled")
+            raise
+
+    def _backoff(self, attempt, error):
+        if getattr(error, "status_code", None) == 429:
+            with self.lock:
+                self.requests.drain()
+                self.tokens.drain()
+        delay = random.uniform(0, min(self.retry_cap, self.retry_base * 2 ** attempt))
+        with self.lock:
+            self.counts["retries"] += 1
+        return max(delay, retry_after(error))
+
+    def call(self, fn, *args, cost, priority=ONGOING, trace=NULL_TRACE, **kwargs):
+        """
+            `fn(*args, **kwargs)` once admitted, retried on 429 / 5xx / connection errors.
+            Time spent queued is recorded as an "llm.queue" span of `trace`.
+        """
+        for attempt in range(self.max_retries + 1):
+            current = priority if attempt == 0 else FOLLOW_UP  # a retry keeps its place ahead of new work
+            with trace.span("llm.queue", priority=PRIORITY_NAMES.get(current, current), attempt=attempt):
+                self.admit(cost, current)
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                if attempt == self.max_retries or not is_retryable(e):
+                    raise
+                delay = self._backoff(attempt, e)
+                print(f"[SCHEDULER] Retry {attempt + 1} in {delay:.2f}s => {e}" , flush=True)
+                time.sleep(delay)
+
+    async def call_async(self, fn, *args, cost, priority=ONGOING, trace=NULL_TRACE, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            current = priority if attempt == 0 else FOLLOW_UP  # a retry keeps its place ahead of new work
+            with trace.span("llm.queue", priority=PRIORITY_NAMES.get(current, current), attempt=attempt):
+                await self.admit_async(cost, current)
+            try:
+                return await fn(*args, **kwargs)
+            except Exception as e:
+                if attempt == self.max_retries or not is_retryable(e):
+                    raise
+                delay = self._backoff(attempt, e)
+                print(f"[SCHEDULER] Retry {attempt + 1} in {delay:.2f}s => {e}" , flush=True)
+                await asyncio.sleep(delay)
+
+    def stats(self):
+        with self.lock:
+            waits = sorted(self.waits)
+            return {
+                "queue_depth": len(self.queue),
+                **self.counts,
+                "wait_p50_s": waits[len(waits) // 2] if waits else 0.0,
+                "wait_p95_s": waits[int(len(waits) * 0.95)] if waits else 0.0,
+            }
+
+
+SCHEDULER = LLMScheduler()
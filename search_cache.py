@@ -0,0 +1,147 @@
+import os
+import re
+import json
+import time
+import atexit
+import threading
+from collections import OrderedDict
+
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "2048"))
+SEARCH_CACHE_PATH = os.getenv("SEARCH_CACHE_PATH")  # optional on-disk persistence
+
+# Seconds a result stays fresh, per tool. Clinics change far less often than search results for symptoms.
+SEARCH_CACHE_TTL = {
+    "fetch_medical_info": float(os.getenv("SEARCH_CACHE_TTL_MEDICAL", str(6 * 3600))),
+    "fetch_nearby_clinic": float(os.getenv("SEARCH_CACHE_TTL_CLINIC", str(7 * 24 * 3600))),
+}
+DEFAULT_TTL = float(os.getenv("SEARCH_CACHE_TTL_DEFAULT", "3600"))
+
+_WHITESPACE = re.compile(r"\s+")
+_PUNCTUATION = re.compile(r"[^\w\s,;/|]")
+_SYMPTOM_SEPARATORS = re.compile(r"\s*(?:,|;|/|\band\b|\by\b|\bwith\b|\bcon\b|&)\s*")
+
+
+def normalize_text(text):
+    """ Lowercase, drop punctuation and collapse whitespace. """
+    text = _PUNCTUATION.sub(" ", str(text or "").lower())
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def normalize_symptoms(symptoms):
+    """
+        Order independent symptom key:
+        "Fever and  Headache" and "headache, fever" both become "fever,headache".
+    """
+    parts = {part for part in _SYMPTOM_SEPARATORS.split(normalize_text(symptoms)) if part}
+    return ",".join(sorted(parts))
+
+
+class SearchCache:
+    """
+        Process wide LRU cache for web search results with a TTL per tool.
+
+        Keys are (tool, normalized query). Entries are evicted least recently used first
+        once `max_size` is reached and ignored once older than the tool's TTL.
+        If `path` is set the cache is loaded from / written to that JSON file.
+    """
+
+    def __init__(self, max_size=SEARCH_CACHE_SIZE, ttls=None, default_ttl=DEFAULT_TTL, path=None, persist_every=50):
+        self.max_size = max_size
+        self.ttls = dict(SEARCH_CACHE_TTL if ttls is None else ttls)
+        self.default_ttl = default_ttl
+        self.path = path
+        self.persist_every = persist_every
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._dirty = 0
+
+        if self.path:
+            self.load()
+            atexit.register(self.save)
+
+    def ttl(self, tool):
+        return self.ttls.get(tool, self.default_ttl)
+
+    def get(self, tool, key):
+        """ Cached value or None. Counts a hit or a miss. """
+        with self.lock:
+            entry = self.entries.get((tool, key))
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expires_at, value = entry
+            if expires_at <= time.time():
+                del self.entries[(tool, key)]
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end((tool, key))
+            self.hits += 1
+            return value
+
+    def set(self, tool, key, value):
+        with self.lock:
+            self.entries[(tool, key)] = (time.time() + self.ttl(tool), value)
+            self.entries.move_to_end((tool, key))
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+            self._dirty += 1
+            persist = self.path and self._dirty >= self.persist_every
+
+        if persist:
+            self.save()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+    def load(self):
+        """ Load unexpired entries from `path`, if it exists. """
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                rows = json.load(f)
+        except (OSError, ValueError):
+            return
+
+        now = time.time()
+        with self.lock:
+            for tool, key, expires_at, value in rows[-self.max_size:]:
+                if expires_at > now:
+                    self.entries[(tool, key)] = (expires_at, value)
+
+    def save(self):
+        """ Atomically write the cache to `path`. """
+        if not self.path:
+            return
+        with self.lock:
+            rows = [[tool, key, expires_at, value] for (tool, key), (expires_at, value) in self.entries.items()]
+            self._dirty = 0
+
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(rows, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"[SEARCH_CACHE] Could not persist cache to {self.path} => {e}", flush=True)
+
+
+SEARCH_CACHE = SearchCache(path=SEARCH_CACHE_PATH)
@@ -0,0 +1,182 @@
+"""
+    Durable conversation state, so a consultation survives restarts and any worker can pick it up.
+
+    A session is a small metadata row (language, location, running summary) plus an append-only
+    log of messages numbered by `seq`. Every turn only inserts its new messages. Resuming reads
+    the metadata and the messages after the part already folded into the summary, never the
+    whole log: the bot folds that part again once it goes over the context budget.
+
+        SESSION_STORE=sessions.db           # or sqlite:///path/to/sessions.db
+"""
+import os
+import abc
+import json
+import time
+import sqlite3
+import threading
+
+SESSION_STORE = os.getenv("SESSION_STORE")  # unset: conversations live in memory only
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    lang TEXT NOT NULL,
+    user_location TEXT NOT NULL,
+    summary TEXT NOT NULL DEFAULT '',
+    folded_seq INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS messages (
+    session_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    message TEXT NOT NULL,
+    PRIMARY KEY (session_id, seq)
+) WITHOUT ROWID;
+"""
+
+
+class SessionConflict(RuntimeError):
+    """ Another worker already stored messages under these seqs: this copy of the session is stale. """
+
+
+class SessionStore(abc.ABC):
+    """
+        Interface of a session backend. Sessions are loaded as dicts with session_id, lang,
+        user_location, summary, messages (every message not folded yet), first_seq (seq of messages[0])
+        and next_seq (seq the next appended message gets).
+    """
+
+    @abc.abstractmethod
+    def create(self, session_id, lang, user_location):
+        ...
+
+    @abc.abstractmethod
+    def append(self, session_id, seq, messages):
+        """ Store `messages` as seq, seq + 1, ... Raises SessionConflict if a seq is taken. """
+
+    @abc.abstractmethod
+    def update(self, session_id, **fields):
+        """ Set lang, user_location, summary and / or folded_seq (first seq not folded into the summary). """
+
+    @abc.abstractmethod
+    def load(self, session_id):
+        """
+            Session dict with every message from folded_seq on, None if unknown. All of them: a
+            message skipped here would be folded past without reaching the summary.
+        """
+
+    @abc.abstractmethod
+    def next_seq(self, session_id):
+        """ Seq the next appended message gets, to tell whether an in memory copy is up to date. """
+
+    @abc.abstractmethod
+    def delete(self, session_id):
+        """ Drop the session and its messages. True if it existed. """
+
+
+class SQLiteSessionStore(SessionStore):
+    """ Embedded SQLite backend (WAL, one connection shared under a lock). """
+
+    FIELDS = ("lang", "user_location", "summary", "folded_seq")
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(_SCHEMA)
+
+    def create(self, session_id, lang, user_location):
+        now = time.time()
+        with self.lock:
+            self.db.execute(
+                "INSERT OR IGNORE INTO sessions (session_id, lang, user_location, created, updated) VALUES (?, ?, ?, ?, ?)",
+                (session_id, lang, json.dumps(user_location or {}, ensure_ascii=False), now, now),
+            )
+
+    def append(self, session_id, seq, messages):
+        rows = [(session_id, seq + i, json.dumps(message, ensure_ascii=False)) for i, message in enumerate(messages)]
+        with self.lock:
+            self.db.execute("BEGIN")
+            try:
+                self.db.executemany("INSERT INTO messages (session_id, seq, message) VALUES (?, ?, ?)", rows)
+                self.db.execute("UPDATE sessions SET updated = ? WHERE session_id = ?", (time.time(), session_id))
+                self.db.execute("COMMIT")
+            except sqlite3.IntegrityError as e:
+                self.db.execute("ROLLBACK")
+                raise SessionConflict(f"Session {session_id} already has messages from seq {seq}") from e
+            except Exception:
+                self.db.execute("ROLLBACK")
+                raise
+
+    def update(self, session_id, **fields):
+        unknown = set(fields) - set(self.FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown session fields {sorted(unknown)}")
+        if "user_location" in fields:
+            fields["user_location"] = json.dumps(fields["user_location"] or {}, ensure_ascii=False)
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self.lock:
+            self.db.execute(
+                f"UPDATE sessions SET {assignments}, updated = ? WHERE session_id = ?",
+                (*fields.values(), time.time(), session_id),
+            )
+
+    def load(self, session_id):
+        with self.lock:
+            row = self.db.execute(
+                "SELECT lang, user_location, summary, folded_seq FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            lang, user_location, summary, folded_seq = row
+            rows = self.db.execute(
+                "SELECT seq, message FROM messages WHERE session_id = ? AND seq >= ? ORDER BY seq",
+                (session_id, folded_seq),
+            ).fetchall()
+            (next_seq,) = self.db.execute(
+                "SELECT COALESCE(MAX(seq) + 1, 0) FROM messages WHERE session_id = ?", (session_id,)
+            ).fetchone()
+
+        return {
+            "session_id": session_id,
+            "lang": lang,
+            "user_location": json.loads(user_location),
+            "summary": summary,
+            "messages": [json.loads(message) for _, message in rows],
+            "first_seq": folded_seq,
+            "next_seq": next_seq,
+        }
+
+    def next_seq(self, session_id):
+        with self.lock:
+            (next_seq,) = self.db.execute(
+                "SELECT COALESCE(MAX(seq) + 1, 0) FROM messages WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        return next_seq
+
+    def delete(self, session_id):
+        with self.lock:
+            self.db.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            return self.db.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,)).rowcount > 0
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+_STORES = {}
+_STORES_LOCK = threading.Lock()
+
+
+def open_store(url=SESSION_STORE):
+    """ Process wide store for `url` ("path.db" or "sqlite:///path.db"), None when unset. """
+    if not url:
+        return None
+    path = url[len("sqlite:///"):] if url.startswith("sqlite:///") else url
+    with _STORES_LOCK:
+        if path not in _STORES:
+            _STORES[path] = SQLiteSessionStore(path)
+        return _STORES[path]
@@ -0,0 +1,173 @@
+import asyncio
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+        Coalesces concurrent calls with the same key: the first caller (leader) runs the
+        function, callers arriving while it is in flight wait for it and share its result
+        (or its exception). Nothing is remembered once the call finished, pair it with a
+        cache for that.
+    """
+
+    def __init__(self, name="singleflight"):
+        self.name = name
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = _Call()
+                self.leaders += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+
+    def stats(self):
+        calls = self.leaders + self.coalesced
+        return {
+            "calls": calls,
+            "upstream": self.leaders,
+            "coalesced": self.coalesced,
+            "coalesced_rate": self.coalesced / calls if calls else 0.0,
+            "in_flight": len(self.calls),
+        }
+
+
+class AsyncSingleFlight(SingleFlight):
+    """
+        asyncio flavour of SingleFlight. The upstream call runs as its own task, so a waiter
+        being cancelled (client disconnect) doesn't cancel it for the other waiters.
+    """
+
+    async def do(self, key, fn, *args, **kwargs):
+        key = (id(asyncio.get_running_loop()), key)
+        with self.lock:
+            task = self.calls.get(key)
+            if task is None:
+                task = self.calls[key] = asyncio.ensure_future(fn(*args, **kwargs))
+                task.add_done_callback(lambda done, key=key: self._forget(key, done))
+                self.leaders += 1
+            else:
+                self.coalesced += 1
+
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        with self.lock:
+            if self.calls.get(key) is task:
+                del self.calls[key]
+        if not task.cancelled():
+            task.exception()  # retrieved, even if every waiter went away
+
+
+class StreamAbandoned(RuntimeError):
+    """ Every reader of a SharedStream left before it ended, so it stopped short: send your own request. """
+
+
+class SharedStream:
+    """
+        One upstream stream read by every caller of a coalesced call. A pump thread buffers the
+        chunks and each `reader()` replays them from the start, so late readers miss nothing.
+        Only the first reader sees the chunks without choices (the usage chunk): the upstream
+        request is billed once, not once per reader. The upstream is closed once every reader
+        went away; a caller asking for a reader after that gets `StreamAbandoned` instead of an
+        answer that silently stops halfway.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.readers = 0
+        self.opened = False
+        self.abandoned = False
+        self.cond = threading.Condition()
+        threading.Thread(target=self._pump, name="telemedic-shared-stream", daemon=True).start()
+
+    def _pump(self):
+        try:
+            for chunk in self.stream:
+                with self.cond:
+                    self.chunks.append(chunk)
+                    self.cond.notify_all()
+                    if self.opened and not self.readers:
+                        self.abandoned = True
+                        break
+        except Exception as e:
+            self.error = e
+        finally:
+            self.stream.close()
+            with self.cond:
+                self.done = True
+                self.cond.notify_all()
+
+    def reader(self):
+        with self.cond:
+            if self.abandoned:
+                raise StreamAbandoned("The shared completion stream was closed by its other readers.")
+            usage = not self.opened
+            self.opened = True
+            self.readers += 1
+        return self._read(usage)
+
+    def _read(self, usage):
+        index = 0
+        try:
+            while True:
+                with self.cond:
+                    while index >= len(self.chunks) and not self.done:
+                        self.cond.wait()
+                    if index >= len(self.chunks):
+                        if self.error is not None:
+                            raise self.error
+                        return
+                    chunk = self.chunks[index]
+                index += 1
+                if usage or getattr(chunk, "choices", None):
+                    yield chunk
+        finally:
+            with self.cond:
+                self.readers -= 1
+
+
+SEARCH_FLIGHT = SingleFlight("web_search")
+ASYNC_SEARCH_FLIGHT = AsyncSingleFlight("web_search")
+COMPLETION_FLIGHT = SingleFlight("completion")
+
+
+def flight_stats():
+    return {
+        "web_search": SEARCH_FLIGHT.stats(),
+        "async_web_search": ASYNC_SEARCH_FLIGHT.stats(),
+        "completion": COMPLETION_FLIGHT.stats(),
+    }
@@ -0,0 +1,297 @@
+"""
+    Offline stand-ins for the OpenAI and Tavily clients, for load tests and local runs
+    without API keys. They return the same shapes the bot reads (streamed chunks with
+    content / tool_calls deltas and usage, Tavily `results`) after configurable delays.
+
+    `stub_app` serves the same behaviour over HTTP (OpenAI chat completions with SSE
+    streaming at /v1/chat/completions, Tavily at /search), so the real clients and their
+    connection pools are exercised too. Its answers are deterministic for a given seed.
+
+        STUB_FIRST_TOKEN_DELAY  seconds before the first streamed chunk (default 0.3)
+        STUB_TOKEN_DELAY        seconds between streamed chunks (default 0.01)
+        STUB_TOKENS             chunks per answer (default 60)
+        STUB_TOOL_RATE          share of user turns answered with a fetch_medical_info call (default 0.5),
+                                clinic / doctor questions always get a fetch_nearby_clinic call
+        STUB_SEARCH_DELAY       seconds per Tavily search (default 0.2)
+"""
+import os
+import json
+import time
+import random
+import asyncio
+import itertools
+import threading
+from types import SimpleNamespace
+from collections import Counter
+
+STUB_FIRST_TOKEN_DELAY = float(os.getenv("STUB_FIRST_TOKEN_DELAY", "0.3"))
+STUB_TOKEN_DELAY = float(os.getenv("STUB_TOKEN_DELAY", "0.01"))
+STUB_TOKENS = int(os.getenv("STUB_TOKENS", "60"))
+STUB_TOOL_RATE = float(os.getenv("STUB_TOOL_RATE", "0.5"))
+STUB_SEARCH_DELAY = float(os.getenv("STUB_SEARCH_DELAY", "0.2"))
+
+_WORDS = {
+    "en": (
+        "Based on what you describe this could be **Tension headache** or **Migraine**. "
+        "Rest, drink water and track when it happens. Please consult a doctor for a proper diagnosis. "
+    ).split(),
+    "es": (
+        "Por lo que describes podría ser **Cefalea tensional** o **Migraña**. "
+        "Descansa, bebe agua y anota cuándo ocurre. Consulta a un médico para un diagnóstico adecuado. "
+    ).split(),
+}
+_CLINIC_WORDS = ("doctor", "clinic", "hospital", "médico", "medico", "clínica", "clinica")
+_IDS = itertools.count(1)
+
+
+def _usage(messages, completion_tokens):
+    prompt_tokens = sum(len(str(message.get("content") or "")) // 4 for message in messages)
+    return SimpleNamespace(
+        prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+        prompt_tokens_details=SimpleNamespace(cached_tokens=0),
+    )
+
+
+def _chunk(content=None, tool_calls=None, usage=None):
+    choices = [] if usage else [SimpleNamespace(delta=SimpleNamespace(content=content, tool_calls=tool_calls))]
+    return SimpleNamespace(choices=choices, usage=usage)
+
+
+def plan(messages, tools, tokens=None, rng=random, tool_rate=None):
+    """
+        What a completion answers with: ("tool", name, arguments) for some fresh user turns
+        when tools are offered (clinic questions always look up clinics), else ("text", words).
+    """
+    tokens = STUB_TOKENS if tokens is None else tokens
+    tool_rate = STUB_TOOL_RATE if tool_rate is None else tool_rate
+    last = messages[-1] if messages else {}
+    text = str(last.get("content") or "")
+    if tools and last.get("role") == "user":
+        if any(word in text.lower() for word in _CLINIC_WORDS):
+            return "tool", "fetch_nearby_clinic", json.dumps({"disease": "migraine"})
+        if rng.random() < tool_rate:
+            return "tool", "fetch_medical_info", json.dumps({"symptoms": text[:200]}, ensure_ascii=False)
+
+    lang = "es" if messages and "Eres un asistente" in str(messages[0].get("content")) else "en"
+    words = _WORDS[lang]
+    return "text", [words[i % len(words)] + " " for i in range(tokens)]
+
+
+def script(messages, tools, tokens=None):
+    """ Chunks for one streamed completion: a tool call for some fresh user turns, text otherwise. """
+    kind, *payload = plan(messages, tools, tokens)
+    if kind == "tool":
+        name, arguments = payload
+        function = SimpleNamespace(name=name, arguments=arguments)
+        yield _chunk(tool_calls=[SimpleNamespace(index=0, id=f"call_stub_{next(_IDS)}", function=function)])
+        yield _chunk(usage=_usage(messages, 20))
+        return
+
+    words = payload[0]
+    for word in words:
+        yield _chunk(content=word)
+    yield _chunk(usage=_usage(messages, len(words)))
+
+
+def message_response(messages, tokens=None):
+    """ Non streamed completion (summaries, coalesced first turns). """
+    chunks = [chunk for chunk in script(messages, None, tokens) if chunk.choices]
+    text = "".join(chunk.choices[0].delta.content for chunk in chunks)
+    return SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content=text, tool_calls=None))],
+        usage=_usage(messages, len(chunks)),
+    )
+
+
+class _Stream:
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.first = True
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            time.sleep(STUB_FIRST_TOKEN_DELAY if self.first else STUB_TOKEN_DELAY)
+            self.first = False
+            yield chunk
+
+    def close(self):
+        self.chunks.close()
+
+
+class _AsyncStream(_Stream):
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for chunk in self.chunks:
+            await asyncio.sleep(STUB_FIRST_TOKEN_DELAY if self.first else STUB_TOKEN_DELAY)
+            self.first = False
+            yield chunk
+
+    async def close(self):
+        self.chunks.close()
+
+
+class StubOpenAI:
+    """ `client.chat.completions.create(...)` without the network. """
+
+    def __init__(self):
+        self.chat = SimpleNamespace(completions=self)
+
+    def create(self, messages, tools=None, stream=False, **kwargs):
+        if stream:
+            return _Stream(script(messages, tools))
+        time.sleep(STUB_FIRST_TOKEN_DELAY)
+        return message_response(messages)
+
+    def close(self):
+        pass
+
+
+class AsyncStubOpenAI(StubOpenAI):
+    async def create(self, messages, tools=None, stream=False, **kwargs):
+        if stream:
+            return _AsyncStream(script(messages, tools))
+        await asyncio.sleep(STUB_FIRST_TOKEN_DELAY)
+        return message_response(messages)
+
+    async def close(self):
+        pass
+
+
+def search_results(query):
+    return {"results": [
+        {"content": f"Common causes and care advice for {query}.", "url": f"https://example.org/{i}"}
+        for i in range(3)
+    ]}
+
+
+class StubTavily:
+    def search(self, query, **kwargs):
+        time.sleep(STUB_SEARCH_DELAY)
+        return search_results(query)
+
+    def close(self):
+        pass
+
+
+class AsyncStubTavily(StubTavily):
+    async def search(self, query, **kwargs):
+        await asyncio.sleep(STUB_SEARCH_DELAY)
+        return search_results(query)
+
+    async def close(self):
+        pass
+
+
+class StubSettings:
+    """ Latency / shape knobs of the HTTP stub server. """
+
+    def __init__(self, first_token_delay=STUB_FIRST_TOKEN_DELAY, token_delay=STUB_TOKEN_DELAY, tokens=STUB_TOKENS,
+                 tool_rate=STUB_TOOL_RATE, search_delay=STUB_SEARCH_DELAY, seed=0):
+        self.first_token_delay = first_token_delay
+        self.token_delay = token_delay
+        self.tokens = tokens
+        self.tool_rate = tool_rate
+        self.search_delay = search_delay
+        self.seed = seed
+
+
+def _sse(data):
+    return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def stub_app(settings=None):
+    """
+        ASGI app speaking the OpenAI chat completions protocol (SSE streaming with content and
+        tool_call deltas, usage chunk, [DONE]) and Tavily search. GET /stats counts requests.
+    """
+    from starlette.applications import Starlette
+    from starlette.responses import JSONResponse, StreamingResponse
+    from starlette.routing import Route
+
+    settings = settings or StubSettings()
+    counts = Counter()
+
+    def usage(messages, completion_tokens):
+        prompt_tokens = sum(len(str(message.get("content") or "")) // 4 for message in messages)
+        return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens, "prompt_tokens_details": {"cached_tokens": 0}}
+
+    async def completions(request):
+        body = await request.json()
+        messages = body.get("messages") or []
+        counts["completions"] += 1
+        # Same request, same answer: seeded by the seed, the conversation length and the last message
+        rng = random.Random(f"{settings.seed}|{len(messages)}|{json.dumps(messages[-1:], sort_keys=True)}")
+        kind, *payload = plan(messages, body.get("tools"), settings.tokens, rng=rng, tool_rate=settings.tool_rate)
+        completion_id = f"chatcmpl-stub{next(_IDS)}"
+        base = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": body.get("model")}
+
+        if not body.get("stream"):
+            counts["completion_tokens"] += settings.tokens
+            await asyncio.sleep(settings.first_token_delay + settings.tokens * settings.token_delay)
+            text = "".join(plan(messages, None, settings.tokens)[1])
+            return JSONResponse({
+                **base, "object": "chat.completion",
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                "usage": usage(messages, settings.tokens),
+            })
+
+        async def events():
+            await asyncio.sleep(settings.first_token_delay)
+            if kind == "tool":
+                name, arguments = payload
+                call_id = f"call_stub{next(_IDS)}"
+                yield _sse({**base, "choices": [{"index": 0, "delta": {"role": "assistant", "content": None, "tool_calls": [
+                    {"index": 0, "id": call_id, "type": "function", "function": {"name": name, "arguments": ""}}
+                ]}, "finish_reason": None}]})
+                step = max(1, len(arguments) // 3)
+                for i in range(0, len(arguments), step):
+                    await asyncio.sleep(settings.token_delay)
+                    yield _sse({**base, "choices": [{"index": 0, "delta": {"tool_calls": [
+                        {"index": 0, "function": {"arguments": arguments[i:i + step]}}
+                    ]}, "finish_reason": None}]})
+                finish_reason, completion_tokens = "tool_calls", 20
+            else:
+                words = payload[0]
+                for i, word in enumerate(words):
+                    if i:
+                        await asyncio.sleep(settings.token_delay)
+                    delta = {"role": "assistant", "content": word} if i == 0 else {"content": word}
+                    yield _sse({**base, "choices": [{"index": 0, "delta": delta, "finish_reason": None}]})
+                finish_reason, completion_tokens = "stop", len(words)
+
+            counts["completion_tokens"] += completion_tokens
+            yield _sse({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": finish_reason}]})
+            if (body.get("stream_options") or {}).get("include_usage"):
+                yield _sse({**base, "choices": [], "usage": usage(messages, completion_tokens)})
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    async def search(request):
+        body = await request.json()
+        counts["searches"] += 1
+        await asyncio.sleep(settings.search_delay)
+        return JSONResponse({"query": body.get("query"), "response_time": settings.search_delay, **search_results(body.get("query"))})
+
+    async def stats(request):
+        return JSONResponse(dict(counts))
+
+    return Starlette(routes=[
+        Route("/v1/chat/completions", completions, methods=["POST"]),
+        Route("/search", search, methods=["POST"]),
+        Route("/stats", stats),
+    ])
+
+
+def serve_stubs(settings=None, host="127.0.0.1", port=8900):
+    """ Run `stub_app` on a daemon thread, returns the uvicorn server once it accepts connections. """
+    import uvicorn
+
+    server = uvicorn.Server(uvicorn.Config(stub_app(settings), host=host, port=port, log_level="warning"))
+    threading.Thread(target=server.run, name="telemedic-stubs", daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return server
@@ -0,0 +1,35 @@
+import os
+import sys
+
+import pytest
+
+# Modules read their configuration at import: no sinks, no network keys, no disk caches
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("TRAVILY_API_KEY", "test")
+os.environ.setdefault("TRACE_SINKS", "")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import stubs  # noqa: E402
+from bot import TeleMedicBot, AsyncTeleMedicBot  # noqa: E402
+
+
+class StubBot(TeleMedicBot):
+    """ TeleMedicBot on the in-process stubs (stubs.py); swap `openai_class` to watch its requests. """
+
+    openai_class = stubs.StubOpenAI
+
+    def create_clients(self):
+        return self.openai_class(), stubs.StubTavily()
+
+
+class AsyncStubBot(AsyncTeleMedicBot):
+    def create_clients(self):
+        return stubs.AsyncStubOpenAI(), stubs.AsyncStubTavily()
+
+
+@pytest.fixture(autouse=True)
+def fast_stubs(monkeypatch):
+    """ No simulated latency unless a test sets its own. """
+    monkeypatch.setattr(stubs, "STUB_FIRST_TOKEN_DELAY", 0)
+    monkeypatch.setattr(stubs, "STUB_TOKEN_DELAY", 0)
+    monkeypatch.setattr(stubs, "STUB_SEARCH_DELAY", 0)
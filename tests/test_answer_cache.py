@@ -0,0 +1,15 @@
+from answer_cache import AnswerCache
+
+
+def test_stats_split_misses_into_empty_and_rejected():
+    cache = AnswerCache(capacity=8, threshold=0.99)
+    assert cache.get("en", "I have a headache") is None  # nothing stored yet
+    cache.set("en", "I have a headache", "Rest and drink water.")
+
+    assert cache.get("en", "I have a headache") == "Rest and drink water."
+    assert cache.get("en", "my knee hurts when I run") is None
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["rejected"]) == (1, 2, 1)
+    assert stats["reject_rate"] == 1 / 3
+    assert stats["avg_rejected_score"] < 0.99
@@ -0,0 +1,72 @@
+import asyncio
+
+import httpx
+import pytest
+
+import api
+from session_store import SQLiteSessionStore
+
+
+@pytest.fixture(autouse=True)
+def state(monkeypatch):
+    state = api.State()
+    monkeypatch.setattr(api, "STATE", state)
+    monkeypatch.setattr(api, "API_STUB", True)
+    return state
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = SQLiteSessionStore(str(tmp_path / "sessions.db"))
+    monkeypatch.setattr(api, "SESSION_STORE", store)
+    yield store
+    store.close()
+
+
+def call(*requests):
+    """ Send (method, path, json) requests in order through the ASGI app, return the responses. """
+    async def main():
+        transport = httpx.ASGITransport(app=api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return [await client.request(method, path, json=body) for method, path, body in requests]
+    return asyncio.run(main())
+
+
+def test_second_turn_on_a_busy_session_is_409(state):
+    (created,) = call(("POST", "/sessions", {}))
+    session_id = created.json()["session_id"]
+    session = state.sessions[session_id]
+
+    assert asyncio.run(session.try_lock())
+    (busy,) = call(("POST", f"/sessions/{session_id}/messages", {"message": "I have a headache"}))
+    session.lock.release()
+    (served,) = call(("POST", f"/sessions/{session_id}/messages", {"message": "I have a headache"}))
+
+    assert busy.status_code == 409
+    assert served.status_code == 200 and "event: done" in served.text
+    assert not session.lock.locked() and state.served_turns == 1
+
+
+def test_rejected_turn_gives_the_session_lock_back(state):
+    (created,) = call(("POST", "/sessions", {}))
+    session_id = created.json()["session_id"]
+    state.turns = asyncio.Semaphore(0)
+
+    (rejected,) = call(("POST", f"/sessions/{session_id}/messages", {"message": "I have a headache"}))
+
+    assert rejected.status_code == 503
+    assert not state.sessions[session_id].lock.locked()
+
+
+def test_deleting_an_unknown_session_with_a_store_is_404(store):
+    (created,) = call(("POST", "/sessions", {}))
+    session_id = created.json()["session_id"]
+
+    deleted, again, unknown = call(
+        ("DELETE", f"/sessions/{session_id}", None),
+        ("DELETE", f"/sessions/{session_id}", None),
+        ("DELETE", "/sessions/unknown", None),
+    )
+
+    assert deleted.status_code == 200
+    assert again.status_code == 404 and unknown.status_code == 404
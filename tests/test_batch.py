@@ -0,0 +1,42 @@
+import json
+
+from batch import batch_bot, load_checkpoint
+from conftest import StubBot
+
+
+def write_rows(path, rows, torn=""):
+    path.write_text("".join(json.dumps(row) + "\n" for row in rows) + torn, encoding="utf-8")
+
+
+def test_checkpoint_keeps_latest_row_of_a_retried_conversation(tmp_path):
+    output = tmp_path / "answers.jsonl"
+    write_rows(output, [
+        {"id": "c-1", "status": "error", "turns": []},
+        {"id": "c-2", "status": "ok", "turns": []},
+        {"id": "c-1", "status": "ok", "turns": ["retried"]},
+    ], torn='{"id": "c-3", "sta')
+
+    assert load_checkpoint(str(output)) == {"c-1", "c-2"}
+    rows = [json.loads(line) for line in output.read_text(encoding="utf-8").splitlines()]
+    assert [(row["id"], row["status"]) for row in rows] == [("c-2", "ok"), ("c-1", "ok")]
+    assert rows[1]["turns"] == ["retried"]
+
+
+def test_checkpoint_retries_a_conversation_that_failed_again(tmp_path):
+    output = tmp_path / "answers.jsonl"
+    write_rows(output, [{"id": "c-1", "status": "ok"}, {"id": "c-1", "status": "error"}])
+
+    assert load_checkpoint(str(output)) == set()
+    assert len(output.read_text(encoding="utf-8").splitlines()) == 1
+
+
+def test_summary_tokens_are_counted():
+    bot = batch_bot(StubBot)()
+    bot.chat("I have a headache")
+    requests = bot.usage["requests"]
+    bot.context.budget = 1
+    bot.add_message(role="user", content="Is it serious?")
+    bot.compact_history()
+
+    assert bot.context.summary
+    assert bot.usage["requests"] == requests + 1
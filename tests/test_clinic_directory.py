@@ -0,0 +1,18 @@
+from clinic_directory import specialties_for, GENERAL_PRACTICE
+
+
+def test_keywords_match_whole_words():
+    assert specialties_for("heart palpitations") == ["cardiology", GENERAL_PRACTICE]
+    assert specialties_for("ear infection") == ["ent", GENERAL_PRACTICE]
+    assert "ent" not in specialties_for("heart disease, earlier this year")
+    assert "ophthalmology" not in specialties_for("rash on the eyebrow")
+    assert specialties_for("heartburn") == ["gastroenterology", GENERAL_PRACTICE]
+
+
+def test_stems_plurals_and_spanish():
+    assert specialties_for("itchy skin")[0] == "dermatology"
+    assert specialties_for("shortness of breath")[0] == "pulmonology"
+    assert specialties_for("pregnancy nausea") == ["gastroenterology", "gynecology", GENERAL_PRACTICE]
+    assert specialties_for("migraines")[0] == "neurology"
+    assert specialties_for("dolor de oído")[0] == "ent"
+    assert specialties_for("") == [GENERAL_PRACTICE]
@@ -0,0 +1,96 @@
+import time
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import bot as bot_module
+import stubs
+from bot import PROMPT_CACHE_STATS
+from conftest import StubBot
+from singleflight import SharedStream, StreamAbandoned, COMPLETION_FLIGHT
+
+
+class CountingStubOpenAI(stubs.StubOpenAI):
+    calls = 0
+
+    def create(self, messages, **kwargs):
+        CountingStubOpenAI.calls += 1
+        return super().create(messages, **kwargs)
+
+
+class CountingBot(StubBot):
+    openai_class = CountingStubOpenAI
+
+
+class ListStream:
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.closed = False
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+    def close(self):
+        self.closed = True
+
+
+def chunk(text=None, usage=None):
+    choices = [SimpleNamespace(delta=SimpleNamespace(content=text))] if text else []
+    return SimpleNamespace(choices=choices, usage=usage)
+
+
+def test_shared_stream_replays_every_chunk_and_usage_once():
+    upstream = ListStream([chunk("a"), chunk("b"), chunk(usage="usage")])
+    shared = SharedStream(upstream)
+    first, second = list(shared.reader()), list(shared.reader())
+
+    assert [c.choices[0].delta.content for c in first[:2]] == ["a", "b"] and first[2].usage == "usage"
+    assert [c.choices[0].delta.content for c in second] == ["a", "b"]
+    assert upstream.closed
+
+
+class SlowStream(ListStream):
+    def __iter__(self):
+        for chunk in self.chunks:
+            time.sleep(0.01)
+            yield chunk
+
+
+def test_late_reader_of_an_abandoned_stream_is_told_so():
+    upstream = SlowStream([chunk(str(i)) for i in range(50)])
+    shared = SharedStream(upstream)
+    leader = shared.reader()
+    next(leader)
+    leader.close()
+    while not shared.done:
+        time.sleep(0.01)
+
+    assert upstream.closed and len(shared.chunks) < 50
+    with pytest.raises(StreamAbandoned):
+        shared.reader()
+
+
+def test_identical_streamed_openers_share_one_request(monkeypatch):
+    monkeypatch.setattr(bot_module, "COALESCE_COMPLETIONS", True)
+    monkeypatch.setattr(stubs, "STUB_FIRST_TOKEN_DELAY", 0.3)
+    CountingStubOpenAI.calls = 0
+    coalesced = COMPLETION_FLIGHT.coalesced
+    requests = PROMPT_CACHE_STATS["requests"]
+    location = {"city": "Madrid", "country": "Spain"}
+    bots = [CountingBot(user_location=location) for _ in range(4)]
+    answers = [None] * len(bots)
+
+    def consult(index):
+        answers[index] = "".join(bots[index].chat("Hi", stream=True))
+
+    threads = [threading.Thread(target=consult, args=(index,)) for index in range(len(bots))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert CountingStubOpenAI.calls == 1
+    assert COMPLETION_FLIGHT.coalesced - coalesced == len(bots) - 1
+    assert PROMPT_CACHE_STATS["requests"] - requests == 1
+    assert answers[0] and len(set(answers)) == 1
@@ -0,0 +1,39 @@
+from conftest import StubBot
+
+
+def test_opening_message_is_first_turn():
+    bot = StubBot()
+    bot.add_message(role="user", content="I have a headache")
+    assert bot.is_first_turn()
+
+
+def test_turn_after_folding_everything_is_not_first_turn():
+    bot = StubBot()
+    bot.chat("I have a headache")
+    bot.context.budget = 1
+    bot.add_message(role="user", content="Is it serious?")
+    bot.compact_history()
+
+    assert len(bot.messages) == 2 and bot.context.summary
+    assert not bot.is_first_turn()
+
+
+def test_stopping_a_turn_early_closes_the_upstream_stream():
+    bot = StubBot()
+    bot.chat("I have a headache")
+    streams = []
+    get_inference = bot.get_inference
+
+    def recording_inference(*args, **kwargs):
+        response = get_inference(*args, **kwargs)
+        if kwargs.get("stream"):
+            close = response.close
+            response.close = lambda: (streams.append(response), close())
+        return response
+
+    bot.get_inference = recording_inference
+    turn = bot.chat("Is it serious?", stream=True)
+    next(turn)
+    turn.close()
+
+    assert streams
@@ -0,0 +1,86 @@
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import hedging
+from hedging import Hedger, DeadlineExceeded
+
+
+def learned(hedger, seconds=0.01, samples=20):
+    for _ in range(samples):
+        hedger.record(seconds)
+    return hedger
+
+
+def test_deadline_exceeded_releases_the_late_result():
+    released = []
+    hedger = Hedger("test", deadline=0.05, enabled=False)
+
+    with pytest.raises(DeadlineExceeded):
+        hedger.run(lambda: time.sleep(0.2) or "late", cleanup=released.append)
+    time.sleep(0.3)
+
+    assert released == ["late"]
+    assert hedger.counts["deadline_exceeded"] == 1
+
+
+def test_slow_primary_is_hedged_and_the_hedge_wins():
+    hedger = learned(Hedger("test", deadline=2, max_rate=1, min_samples=20, enabled=True))
+
+    result = hedger.run(lambda: time.sleep(1) or "primary", lambda: "hedge")
+
+    assert result == "hedge"
+    assert hedger.counts["hedges"] == 1 and hedger.counts["hedge_wins"] == 1
+
+
+def test_no_hedge_without_admission_or_budget():
+    hedger = learned(Hedger("test", deadline=2, max_rate=1, min_samples=20, enabled=True))
+    assert hedger.run(lambda: time.sleep(0.4) or "primary", lambda: "hedge", admit=lambda: False) == "primary"
+
+    capped = learned(Hedger("test", deadline=2, max_rate=0, min_samples=20, enabled=True))
+    assert capped.run(lambda: time.sleep(0.4) or "primary", lambda: "hedge") == "primary"
+    assert hedger.counts["hedges"] == capped.counts["hedges"] == 0
+
+
+def test_async_hedge_wins_and_cancels_the_primary():
+    hedger = learned(Hedger("test", deadline=2, max_rate=1, min_samples=20, enabled=True))
+    cancelled = []
+
+    async def primary():
+        try:
+            await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+        return "primary"
+
+    async def hedge():
+        return "hedge"
+
+    async def main():
+        result = await hedger.run_async(primary, hedge)
+        await asyncio.sleep(0)
+        return result
+
+    assert asyncio.run(main()) == "hedge"
+    assert cancelled == [True]
+
+
+def test_async_deadline():
+    hedger = Hedger("test", deadline=0.05, enabled=False)
+
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(hedger.run_async(lambda: asyncio.sleep(1)))
+
+
+def test_waiting_for_a_worker_thread_does_not_count(monkeypatch):
+    executor = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(hedging, "HEDGE_EXECUTOR", executor)
+    executor.submit(time.sleep, 0.3)  # every thread busy for longer than the deadline
+    hedger = Hedger("test", deadline=0.2, enabled=False)
+
+    assert hedger.run(lambda: time.sleep(0.05) or "answer") == "answer"
+    executor.shutdown(wait=True)  # the latency sample is taken in a done callback
+    assert len(hedger.samples) == 1 and hedger.samples[0] < 0.2
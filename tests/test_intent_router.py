@@ -0,0 +1,51 @@
+import pytest
+
+import stubs
+from conftest import StubBot
+from intent_router import INTENT_ROUTER, CLINIC, SMALL_TALK, UNKNOWN
+
+
+@pytest.mark.parametrize("text", [
+    "Where can I see a doctor near me?",
+    "Can you find me a clinic?",
+    "Is there a hospital nearby?",
+    "¿Dónde puedo ver a un médico cerca de mí?",
+    "Busco una clínica en mi ciudad",
+])
+def test_where_to_go_routes_to_clinic(text):
+    assert INTENT_ROUTER.classify(text) == CLINIC
+
+
+@pytest.mark.parametrize("text", [
+    "I saw a doctor yesterday, is it serious?",
+    "My doctor gave me ibuprofen, should I keep taking it?",
+    "Fui al médico ayer, ¿es grave?",
+    "The pain is near my chest",
+])
+def test_doctor_mentioned_in_passing_is_not_clinic(text):
+    assert INTENT_ROUTER.classify(text) != CLINIC
+
+
+def test_small_talk_still_routed():
+    assert INTENT_ROUTER.classify("thanks!") == SMALL_TALK
+    assert INTENT_ROUTER.classify("I have a headache") == UNKNOWN
+
+
+def test_clinic_turn_skips_the_tool_decision():
+    requests = []
+
+    class RecordingStubOpenAI(stubs.StubOpenAI):
+        def create(self, messages, tools=None, **kwargs):
+            requests.append(tools)
+            return super().create(messages, tools=tools, **kwargs)
+
+    class RecordingBot(StubBot):
+        openai_class = RecordingStubOpenAI
+
+    bot = RecordingBot(user_location={"city": "Lahore", "country": "Pakistan"})
+    answer = "".join(bot.chat("Where can I find a dermatologist near me?", stream=True))
+
+    assert answer and requests == [None]
+    tool_call = bot.messages[2]["tool_calls"][0]
+    assert tool_call["function"]["name"] == "fetch_nearby_clinic"
+    assert bot.messages[3]["role"] == "tool" and bot.messages[3]["tool_call_id"] == tool_call["id"]
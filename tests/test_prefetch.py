@@ -0,0 +1,54 @@
+import asyncio
+
+import bot as bot_module
+import stubs
+from conftest import StubBot, AsyncStubBot
+from prefetch import ClinicPrefetcher
+from tracing import TRACER
+
+
+class ListSink:
+    sampled_only = False
+
+    def __init__(self):
+        self.traces = []
+
+    def export(self, trace):
+        self.traces.append(trace)
+
+
+def test_prefetch_records_on_its_own_trace(monkeypatch):
+    sink = ListSink()
+    prefetcher = ClinicPrefetcher(concurrency=2)
+    monkeypatch.setattr(TRACER, "sinks", [sink])
+    monkeypatch.setattr(bot_module, "CLINIC_PREFETCHER", prefetcher)
+    monkeypatch.setattr(stubs, "STUB_SEARCH_DELAY", 0.1)
+    bot = StubBot(user_location={"city": "Lahore", "country": "Pakistan"})
+
+    turn = bot.start_trace()
+    bot.prefetch_clinics("It could be **Tension headache** or **Sinusitis**.")
+    bot.start_trace()  # the next turn replaces self.trace while the lookups run
+    prefetcher.executor.shutdown(wait=True)
+
+    prefetches = [trace for trace in sink.traces if trace.name == "prefetch"]
+    assert sorted(trace.attrs["condition"] for trace in prefetches) == ["Sinusitis", "Tension headache"]
+    assert all(trace.attrs["parent"] == turn.trace_id and trace.attrs["status"] == "ok" for trace in prefetches)
+    assert all(any(span.name == "search" for span in trace.spans) for trace in prefetches)
+    assert not turn.spans and not bot.trace.spans
+
+
+def test_async_prefetch_tasks_are_held_until_done(monkeypatch):
+    prefetcher = ClinicPrefetcher(concurrency=2)
+    monkeypatch.setattr(bot_module, "CLINIC_PREFETCHER", prefetcher)
+    monkeypatch.setattr(stubs, "STUB_SEARCH_DELAY", 0.05)
+    bot = AsyncStubBot(user_location={"city": "Quito", "country": "Ecuador"})
+
+    async def main():
+        bot.prefetch_clinics("It could be **Migraine** or **Influenza**.")
+        assert len(prefetcher.tasks) == 2
+        await asyncio.gather(*prefetcher.tasks)
+        await asyncio.sleep(0)
+
+    asyncio.run(main())
+    assert not prefetcher.tasks
+    assert prefetcher.stats()["issued"] == 2 and prefetcher.in_flight == 0
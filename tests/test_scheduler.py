@@ -0,0 +1,99 @@
+import time
+import asyncio
+
+import pytest
+
+from scheduler import (
+    LLMScheduler, TokenBucket, AdmissionRejected, FOLLOW_UP, ONGOING, NEW_SESSION, PRIORITY_NAMES,
+)
+
+
+def empty(scheduler):
+    """ No request left in the RPM bucket, the next one is due in 60 / rpm seconds. """
+    scheduler.requests.level = 0
+    scheduler.requests.updated = time.monotonic()
+    return scheduler
+
+
+def test_token_bucket_refills_at_its_rate():
+    bucket = TokenBucket(600)  # 10 per second
+    assert bucket.wait_time(600) == 0
+    bucket.take(600)
+    assert bucket.wait_time(1) == pytest.approx(0.1, abs=0.02)
+    assert bucket.wait_time(10_000) == pytest.approx(60, abs=0.1)  # capped at one minute's worth
+    time.sleep(0.15)
+    assert bucket.wait_time(1) == 0
+
+
+def test_token_bucket_drain_and_unlimited():
+    bucket = TokenBucket(600)
+    bucket.drain()
+    assert bucket.wait_time(1) > 0
+
+    unlimited = TokenBucket(0)
+    unlimited.take(10 ** 9)
+    unlimited.drain()
+    assert unlimited.wait_time(10 ** 9) == 0
+
+
+def test_admits_by_priority_then_arrival():
+    scheduler = empty(LLMScheduler(rpm=600, queue_timeout=5))
+    order = []
+
+    async def request(priority, name):
+        await scheduler.admit_async(1, priority)
+        order.append(name)
+
+    async def main():
+        await asyncio.gather(
+            request(NEW_SESSION, "new"), request(ONGOING, "ongoing 1"),
+            request(FOLLOW_UP, "follow up"), request(ONGOING, "ongoing 2"),
+        )
+
+    asyncio.run(main())
+    assert order == ["follow up", "ongoing 1", "ongoing 2", "new"]
+    stats = scheduler.stats()
+    assert stats["queue_depth"] == 0
+    assert stats[f"admitted_{PRIORITY_NAMES[ONGOING]}"] == 2
+
+
+def test_rejects_when_the_queue_is_full():
+    scheduler = empty(LLMScheduler(rpm=1, max_depth=1, queue_timeout=5))
+
+    async def main():
+        queued = asyncio.ensure_future(scheduler.admit_async(1))
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected):
+            await scheduler.admit_async(1)
+        queued.cancel()
+
+    asyncio.run(main())
+    assert scheduler.counts["rejected_full"] == 1
+
+
+def test_rejects_after_the_queue_timeout():
+    scheduler = empty(LLMScheduler(rpm=1, queue_timeout=0.05))
+
+    with pytest.raises(AdmissionRejected):
+        scheduler.admit(1)
+    with pytest.raises(AdmissionRejected):
+        asyncio.run(scheduler.admit_async(1))
+
+    assert scheduler.counts["rejected_timeout"] == 2
+    assert scheduler.stats()["queue_depth"] == 0
+
+
+def test_cancelled_waiter_frees_its_place():
+    scheduler = empty(LLMScheduler(rpm=600, queue_timeout=5))
+
+    async def main():
+        head = asyncio.ensure_future(scheduler.admit_async(1, FOLLOW_UP))
+        behind = asyncio.ensure_future(scheduler.admit_async(1, ONGOING))
+        await asyncio.sleep(0)
+        head.cancel()
+        await asyncio.wait_for(behind, timeout=1)
+
+    asyncio.run(main())
+    assert scheduler.counts["cancelled"] == 1
+    assert scheduler.counts["rejected_timeout"] == 0
+    assert scheduler.stats()["queue_depth"] == 0
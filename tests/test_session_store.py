@@ -0,0 +1,92 @@
+import pytest
+
+from conftest import StubBot
+from session_store import SQLiteSessionStore, SessionConflict, SessionStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = SQLiteSessionStore(str(tmp_path / "sessions.db"))
+    yield store
+    store.close()
+
+
+def new_bot(store, session_id="s1"):
+    bot = StubBot(user_location={"city": "Lahore", "country": "PK"})
+    bot.attach_session(store, session_id)
+    return bot
+
+
+def test_interface_is_abstract():
+    with pytest.raises(TypeError):
+        SessionStore()
+
+
+def test_persist_and_reload_round_trip(store):
+    bot = new_bot(store)
+    bot.chat("I have a headache")
+    bot.chat("It started two days ago")
+
+    again = StubBot.from_session(store, "s1")
+    assert again.messages == bot.messages
+    assert again.user_location == bot.user_location
+    assert (again.first_seq, again.next_seq) == (bot.first_seq, bot.next_seq) == (0, 4)
+    assert store.next_seq("s1") == 4
+
+
+def test_folded_history_reloads_with_summary(store):
+    bot = new_bot(store)
+    bot.chat("I have a headache")
+    bot.chat("It started two days ago")
+    bot.context.budget = 1  # fold everything but the latest turn
+    bot.chat("Is it serious?")
+
+    assert bot.context.summary and bot.first_seq == 4
+    again = StubBot.from_session(store, "s1")
+    assert again.context.summary == bot.context.summary
+    assert again.messages == bot.messages
+    assert (again.first_seq, again.next_seq) == (4, 6)
+
+
+def test_unknown_session_is_none(store):
+    assert StubBot.from_session(store, "missing") is None
+
+
+def test_taken_seq_raises_instead_of_dropping(store):
+    store.create("s1", "en", {})
+    store.append("s1", 0, [{"role": "user", "content": "first"}])
+    with pytest.raises(SessionConflict):
+        store.append("s1", 0, [{"role": "user", "content": "second"}])
+    assert store.load("s1")["messages"] == [{"role": "user", "content": "first"}]
+
+
+def test_stale_copy_conflicts(store):
+    here = new_bot(store)
+    here.chat("I have a headache")
+    elsewhere = StubBot.from_session(store, "s1")
+    elsewhere.chat("It started two days ago")
+
+    assert store.next_seq("s1") != here.next_seq
+    with pytest.raises(SessionConflict):
+        here.chat("Is it serious?")
+
+
+def test_resume_loads_and_folds_every_unfolded_message(store):
+    store.create("s1", "en", {})
+    turns = []
+    for i in range(30):
+        turns += [{"role": "user", "content": f"symptom {i}"}, {"role": "assistant", "content": f"answer {i}"}]
+    store.append("s1", 0, turns)
+
+    again = StubBot.from_session(store, "s1")
+    assert again.messages[1:] == turns and again.first_seq == 0
+
+    folded = []
+    summary_request = again.context.summary_request
+    again.context.summary_request = lambda messages: folded.extend(messages) or summary_request(messages)
+    again.context.budget = 1
+    again.add_message(role="user", content="Is it serious?")
+    again.compact_history()
+
+    assert folded == turns
+    assert again.first_seq == store.load("s1")["first_seq"] == len(turns)
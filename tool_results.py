@@ -0,0 +1,84 @@
+import os
+
+from search_cache import normalize_text
+from medical_index import tokenize
+from context_window import count_text_tokens
+
+# Tokens of tool output injected into the conversation, per tool
+TOOL_RESULT_BUDGET = {
+    "fetch_medical_info": int(os.getenv("TOOL_RESULT_BUDGET_MEDICAL", "800")),
+    "fetch_nearby_clinic": int(os.getenv("TOOL_RESULT_BUDGET_CLINIC", "600")),
+}
+DEFAULT_BUDGET = int(os.getenv("TOOL_RESULT_BUDGET_DEFAULT", "600"))
+DIGEST_CHARS = 160
+
+
+def _content(result):
+    return result["content"] if isinstance(result, dict) else str(result)
+
+
+def _truncate(text, tokens):
+    """ Cut `text` to roughly `tokens` tokens on a word boundary. """
+    words = text.split()
+    low, high = 0, len(words)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if count_text_tokens(" ".join(words[:mid])) <= tokens:
+            low = mid
+        else:
+            high = mid - 1
+    return " ".join(words[:low]) + " ..."
+
+
+def compact_results(results, query, budget=DEFAULT_BUDGET):
+    """
+        Deduplicate search results, rank them by term overlap with `query` and keep
+        as many as fit in `budget` tokens (the last one truncated). Shape is preserved.
+    """
+    if not isinstance(results, list):
+        return results
+
+    seen, unique = set(), []
+    for result in results:
+        key = (normalize_text(_content(result))[:200], result.get("url") if isinstance(result, dict) else None)
+        if key[0] and key not in seen:
+            seen.add(key)
+            unique.append(result)
+
+    query_terms = set(tokenize(query))
+
+    def relevance(item):
+        position, result = item
+        terms = set(tokenize(_content(result)))
+        return (-len(query_terms & terms) / (len(query_terms) or 1), position)
+
+    ranked = [result for _, result in sorted(enumerate(unique), key=relevance)]
+
+    compacted, used = [], 0
+    for result in ranked:
+        content = _content(result)
+        tokens = count_text_tokens(content)
+        if used + tokens > budget:
+            remaining = budget - used
+            if remaining < 32:
+                break
+            content = _truncate(content, remaining)
+            tokens = remaining
+        compacted.append({**result, "content": content} if isinstance(result, dict) else content)
+        used += tokens
+        if used >= budget:
+            break
+    return compacted
+
+
+def digest(name, arguments, results):
+    """ Short stand-in for a tool result once the answer that used it has been given. """
+    if not isinstance(results, list):
+        return f"[{name}({arguments}) returned no data]"
+
+    urls = [result["url"] for result in results if isinstance(result, dict) and result.get("url")]
+    if urls:
+        return f"[{name}({arguments}) already answered, {len(results)} results. URLs: {', '.join(urls)}]"
+
+    top = _content(results[0])[:DIGEST_CHARS] if results else ""
+    return f"[{name}({arguments}) already answered, {len(results)} results. Top: {top}]"
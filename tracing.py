@@ -0,0 +1,305 @@
+"""
+    Per turn tracing and metrics.
+
+    Every chat turn is a `Trace` holding timed spans (model calls, each tool, cache lookups,
+    searches), time to first token, total stream duration and token counts. Finished traces
+    go to the configured sinks:
+
+        TRACE_SINKS=prometheus,jsonl      # default "prometheus"; "" disables tracing
+        TRACE_JSONL_PATH=traces.jsonl     # "-" for stdout
+        TRACE_SAMPLE_RATE=0.1             # share of traces written to sampled sinks (jsonl)
+        TRACE_METRICS_PORT=9100           # serve /metrics from a background thread (Streamlit)
+        LOG_PAYLOADS=true                 # also log full search results / tool payloads
+
+    Prometheus metrics aggregate every turn, sampling only thins out the JSON lines.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import threading
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TRACE_SINKS = [sink.strip() for sink in os.getenv("TRACE_SINKS", "prometheus").split(",") if sink.strip()]
+TRACE_JSONL_PATH = os.getenv("TRACE_JSONL_PATH", "traces.jsonl")
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "1.0"))
+TRACE_METRICS_PORT = int(os.getenv("TRACE_METRICS_PORT", "0"))
+LOG_PAYLOADS = os.getenv("LOG_PAYLOADS", "false").lower() == "true"
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Span:
+    def __init__(self, trace, name, attrs):
+        self.trace = trace
+        self.name = name
+        self.attrs = attrs
+        self.start = None
+        self.seconds = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.seconds = time.perf_counter() - self.start
+        if exc_type is not None and "outcome" not in self.attrs:
+            self.attrs["outcome"] = "cancelled" if exc_type.__name__ in ("GeneratorExit", "CancelledError") else "error"
+        self.trace.spans.append(self)
+        return False
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "offset": round(self.start - self.trace.started, 6),
+            "seconds": round(self.seconds, 6),
+            **self.attrs,
+        }
+
+
+class Trace:
+    """ One chat turn. Spans may be added from tool threads, list appends are atomic. """
+
+    def __init__(self, tracer, name, sampled, attrs):
+        self.tracer = tracer
+        self.name = name
+        self.sampled = sampled
+        self.attrs = attrs
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.timestamp = time.time()
+        self.started = time.perf_counter()
+        self.spans = []
+        self.marks = {}
+        self.counters = defaultdict(int)
+        self.lock = threading.Lock()
+        self.seconds = None
+
+    def span(self, name, **attrs):
+        return Span(self, name, attrs)
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def add(self, **counters):
+        with self.lock:
+            for name, value in counters.items():
+                self.counters[name] += value or 0
+
+    def mark(self, name):
+        """ Seconds since the turn started at the first call for `name` (e.g. first_token). """
+        self.marks.setdefault(name, time.perf_counter() - self.started)
+
+    def finish(self, **attrs):
+        if self.seconds is not None:
+            return
+        self.seconds = time.perf_counter() - self.started
+        self.attrs.update(attrs)
+        self.tracer.export(self)
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "timestamp": self.timestamp,
+            "seconds": round(self.seconds or 0.0, 6),
+            **self.attrs,
+            **{name: round(seconds, 6) for name, seconds in self.marks.items()},
+            **self.counters,
+            "spans": [span.to_dict() for span in list(self.spans)],
+        }
+
+
+class _NullSpan:
+    def set(self, **attrs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+class _NullTrace:
+    """ Stand in when tracing is disabled, every call is a no-op. """
+    sampled = False
+
+    def span(self, name, **attrs):
+        return _NullSpan()
+
+    def set(self, **attrs):
+        pass
+
+    def add(self, **counters):
+        pass
+
+    def mark(self, name):
+        pass
+
+    def finish(self, **attrs):
+        pass
+
+
+NULL_TRACE = _NullTrace()
+
+
+class JsonLinesSink:
+    """ One JSON object per sampled trace / observation, appended to a file or stdout. """
+    sampled_only = True
+
+    def __init__(self, path=TRACE_JSONL_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = sys.stdout if path == "-" else open(path, "a", encoding="utf-8")
+
+    def write(self, record):
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self.lock:
+            self.file.write(line + "\n")
+            self.file.flush()
+
+    def export(self, trace):
+        self.write(trace.to_dict())
+
+    def observe(self, name, seconds, attrs):
+        self.write({"name": name, "timestamp": time.time(), "seconds": round(seconds, 6), **attrs})
+
+
+class PrometheusSink:
+    """ In process histograms / counters rendered in the Prometheus text format. """
+    sampled_only = False
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.histograms = defaultdict(lambda: [[0] * len(self.buckets), 0.0, 0])  # (name, labels) -> counts, sum, count
+        self.counters = defaultdict(float)
+
+    def _observe(self, name, labels, value):
+        histogram = self.histograms[(name, labels)]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                histogram[0][i] += 1
+        histogram[1] += value
+        histogram[2] += 1
+
+    def export(self, trace):
+        route = str(trace.attrs.get("route") or "none")
+        with self.lock:
+            self._observe("telemedic_turn_seconds", (("route", route),), trace.seconds)
+            if "first_token" in trace.marks:
+                self._observe("telemedic_first_token_seconds", (("route", route),), trace.marks["first_token"])
+            self.counters[("telemedic_turns_total", (("route", route), ("status", str(trace.attrs.get("status", "ok")))))] += 1
+            for kind, value in trace.counters.items():
+                if kind.endswith("_tokens"):
+                    self.counters[("telemedic_tokens_total", (("kind", kind[:-len("_tokens")]),))] += value
+            for span in list(trace.spans):
+                self._observe("telemedic_span_seconds", (("span", span.name),), span.seconds)
+                outcome = str(span.attrs.get("outcome", "ok"))
+                self.counters[("telemedic_spans_total", (("span", span.name), ("outcome", outcome)))] += 1
+
+    def observe(self, name, seconds, attrs):
+        with self.lock:
+            self._observe("telemedic_span_seconds", (("span", name),), seconds)
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        return "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}" if pairs else ""
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for name in sorted({name for name, _ in self.histograms}):
+                lines.append(f"# TYPE {name} histogram")
+                for (metric, labels), (counts, total, count) in self.histograms.items():
+                    if metric != name:
+                        continue
+                    for bound, bucket_count in zip(self.buckets, counts):
+                        lines.append(f"{name}_bucket{self._labels(labels, [('le', bound)])} {bucket_count}")
+                    lines.append(f"{name}_bucket{self._labels(labels, [('le', '+Inf')])} {count}")
+                    lines.append(f"{name}_sum{self._labels(labels)} {total}")
+                    lines.append(f"{name}_count{self._labels(labels)} {count}")
+            for name in sorted({name for name, _ in self.counters}):
+                lines.append(f"# TYPE {name} counter")
+                for (metric, labels), value in self.counters.items():
+                    if metric == name:
+                        lines.append(f"{name}{self._labels(labels)} {value:g}")
+        return "\n".join(lines) + "\n"
+
+
+class Tracer:
+    def __init__(self, sinks, sample_rate=TRACE_SAMPLE_RATE):
+        self.sinks = list(sinks)
+        self.sample_rate = sample_rate
+
+    def start(self, name, **attrs):
+        """ New Trace, or NULL_TRACE when no sink is configured. """
+        if not self.sinks:
+            return NULL_TRACE
+        return Trace(self, name, random.random() < self.sample_rate, attrs)
+
+    def export(self, trace):
+        for sink in self.sinks:
+            if trace.sampled or not sink.sampled_only:
+                try:
+                    sink.export(trace)
+                except Exception as e:
+                    print(f"[TRACE] Export failed => {e}" , flush=True)
+
+    def observe(self, name, seconds, **attrs):
+        """ Standalone timing outside a turn, e.g. UI render time. """
+        sampled = random.random() < self.sample_rate
+        for sink in self.sinks:
+            if sampled or not sink.sampled_only:
+                sink.observe(name, seconds, attrs)
+
+    def prometheus(self):
+        return next((sink for sink in self.sinks if isinstance(sink, PrometheusSink)), None)
+
+
+def build_sinks(names=TRACE_SINKS):
+    factories = {"prometheus": PrometheusSink, "jsonl": JsonLinesSink}
+    return [factories[name]() for name in names]
+
+
+_METRICS_SERVER = None
+_METRICS_LOCK = threading.Lock()
+
+
+def serve_metrics(port=TRACE_METRICS_PORT):
+    """ Serve the Prometheus text on http://0.0.0.0:<port>/metrics from a daemon thread (once per process). """
+    global _METRICS_SERVER
+    sink = TRACER.prometheus()
+    if not port or sink is None:
+        return None
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = sink.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    with _METRICS_LOCK:
+        if _METRICS_SERVER is None:
+            _METRICS_SERVER = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+            threading.Thread(target=_METRICS_SERVER.serve_forever, name="telemedic-metrics", daemon=True).start()
+    return _METRICS_SERVER
+
+
+TRACER = Tracer(build_sinks())